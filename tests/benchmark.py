@@ -0,0 +1,312 @@
+"""Нагрузочный замер публичных страниц Yatube.
+
+Заполняет базу правдоподобными данными (подписки распределены по
+степенному закону: у немногих авторов много читателей), прогоняет
+страницы через тестовый клиент Django и собирает p50/p95/p99 времени
+ответа и число SQL-запросов. Отчёт пишется в JSON и сравнивается
+с отчётом прошлого коммита.
+"""
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+
+from core.asgi import WsgiToAsgi
+from posts import counters, feed, images, search, thumbnails
+from posts.models import Comment, Follow, Group, Post, User
+
+BATCH_SIZE = 500
+
+
+def _image(seed):
+    file_obj = BytesIO()
+    Image.new('RGB', (1200, 800), color=(seed * 37 % 256, 90, 160)).save(
+        file_obj, 'JPEG')
+    return ContentFile(file_obj.getvalue(), name=f'bench_{seed}.jpg')
+
+
+def seed(scale=1.0, rng=None):
+    """Создаёт набор данных; возвращает самого активного читателя."""
+    rng = rng or random.Random(42)
+    users_count = max(int(300 * scale), 10)
+    posts_count = max(int(3000 * scale), 100)
+    comments_count = max(int(6000 * scale), 100)
+
+    User.objects.bulk_create(
+        [User(username=f'bench_user_{i}', first_name='Автор', last_name=str(i))
+         for i in range(users_count)],
+        batch_size=BATCH_SIZE,
+    )
+    users = list(User.objects.filter(
+        username__startswith='bench_user_').values_list('pk', flat=True))
+    Group.objects.bulk_create(
+        [Group(title=f'Группа {i}', slug=f'bench-group-{i}', description='')
+         for i in range(10)],
+    )
+    groups = list(Group.objects.filter(
+        slug__startswith='bench-group-').values_list('pk', flat=True))
+
+    # Несколько общих картинок на все посты с изображениями.
+    image_names = [
+        Post.image.field.storage.save(f'posts/bench_{i}.jpg', _image(i))
+        for i in range(5)
+    ]
+    Post.objects.bulk_create(
+        [
+            Post(
+                author_id=rng.choice(users),
+                group_id=rng.choice(groups + [None]),
+                text=f'Пост номер {i} про котиков и собак ' * 3,
+                image=rng.choice(image_names) if i % 4 == 0 else '',
+            )
+            for i in range(posts_count)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    for name in image_names:
+        thumbnails.generate(name)
+    posts = list(Post.objects.values_list('pk', flat=True))
+    Comment.objects.bulk_create(
+        [
+            Comment(author_id=rng.choice(users), post_id=rng.choice(posts),
+                    text=f'Комментарий {i}')
+            for i in range(comments_count)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+    # Подписки по закону Ципфа: автор с рангом r собирает ~1/r читателей.
+    follows = set()
+    for rank, author in enumerate(users, start=1):
+        followers = min(int(users_count / rank), users_count - 1)
+        for user in rng.sample(users, followers):
+            if user != author:
+                follows.add((user, author))
+    Follow.objects.bulk_create(
+        [Follow(user_id=user, author_id=author) for user, author in follows],
+        batch_size=BATCH_SIZE,
+    )
+    for follow in Follow.objects.select_related('user', 'author'):
+        feed.backfill_feed(follow.user, follow.author)
+    counters.recount()
+    search.rebuild_index()
+    cache.clear()
+
+    following = Counter(user for user, _ in follows)
+    return User.objects.get(pk=following.most_common(1)[0][0])
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = min(int(round(percent / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def measure(client, url, iterations=30, cold_cache=True):
+    """Время ответа (мс) и число запросов для одной страницы."""
+    timings = []
+    queries = 0
+    client.get(url)
+    for _ in range(iterations):
+        if cold_cache:
+            cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, f'{url}: {response.status_code}'
+        queries = max(queries, len(context))
+    return {
+        'p50_ms': round(_percentile(timings, 50), 3),
+        'p95_ms': round(_percentile(timings, 95), 3),
+        'p99_ms': round(_percentile(timings, 99), 3),
+        'queries': queries,
+    }
+
+
+def pages(reader):
+    """Замеряемые страницы: имя -> (url, нужен ли вход)."""
+    post = Post.objects.order_by('-comments_count').first()
+    group = Group.objects.order_by('-posts_count').first()
+    author = User.objects.order_by('-stats__followers_count').first()
+    return {
+        'posts:index': (reverse('posts:index'), False),
+        'posts:group_list': (
+            reverse('posts:group_list', kwargs={'slug': group.slug}), False),
+        'posts:profile': (
+            reverse('posts:profile', kwargs={'username': author.username}),
+            False),
+        'posts:post_detail': (
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}), False),
+        'posts:follow_index': (reverse('posts:follow_index'), True),
+    }
+
+
+def run(client, reader, iterations=30):
+    report = {}
+    for name, (url, login) in pages(reader).items():
+        client.logout()
+        if login:
+            client.force_login(reader)
+        report[name] = measure(client, url, iterations)
+    return report
+
+
+def compare(report, baseline, threshold):
+    """Список регрессий относительно baseline (пустой, если их нет)."""
+    regressions = []
+    for name, current in report.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * threshold:
+            regressions.append(
+                f"{name}: p95 {current['p95_ms']} мс "
+                f"> {previous['p95_ms']} мс x {threshold}")
+        if current['queries'] > previous['queries']:
+            regressions.append(
+                f"{name}: запросов {current['queries']} "
+                f"> {previous['queries']}")
+    return regressions
+
+
+def write_report(report, path):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+def read_report(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def _slow_body(chunks, delay):
+    """Тело запроса, которое клиент присылает кусками с паузами."""
+    for _ in range(chunks):
+        time.sleep(delay)
+        yield b'x' * 1024
+
+
+def _wsgi_request(application, url, chunks, delay):
+    body = b''.join(_slow_body(chunks, delay))
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': url, 'QUERY_STRING': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(body), 'wsgi.errors': None,
+        'wsgi.multithread': True, 'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    statuses = []
+    result = application(
+        environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b''.join(result)
+    result.close()
+    return int(statuses[0].split(' ', 1)[0])
+
+
+async def _asgi_request(application, url, chunks, delay):
+    messages = []
+    for index in range(chunks):
+        messages.append({'type': 'http.request', 'body': b'x' * 1024,
+                         'more_body': index < chunks - 1})
+    sent = []
+
+    async def receive():
+        await asyncio.sleep(delay)
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await application(
+        {'type': 'http', 'method': 'GET', 'path': url, 'query_string': b'',
+         'headers': [(b'host', b'testserver')]},
+        receive, send)
+    return sent[0]['status']
+
+
+def slow_clients(url, clients=32, threads=4, chunks=5, delay=0.02):
+    """Время обслуживания медленных клиентов: WSGI против ASGI.
+
+    Оба сервера получают одинаковое число потоков. WSGI-поток занят,
+    пока клиент присылает тело; в ASGI тело принимается без потока.
+    """
+    application = get_wsgi_application()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        statuses = list(executor.map(
+            lambda _: _wsgi_request(application, url, chunks, delay),
+            range(clients)))
+    wsgi_ms = (time.perf_counter() - start) * 1000
+
+    asgi_application = WsgiToAsgi(application, threads)
+
+    async def serve():
+        return await asyncio.gather(*[
+            _asgi_request(asgi_application, url, chunks, delay)
+            for _ in range(clients)])
+
+    start = time.perf_counter()
+    statuses += asyncio.run(serve())
+    asgi_ms = (time.perf_counter() - start) * 1000
+    asgi_application.executor.shutdown()
+    assert set(statuses) == {200}, f'{url}: {set(statuses)}'
+    return {'clients': clients, 'threads': threads,
+            'wsgi_ms': round(wsgi_ms, 3), 'asgi_ms': round(asgi_ms, 3)}
+
+
+def _phone_photo(seed, size=(4032, 3024)):
+    """Фото как с телефона: шум, высокое качество JPEG, EXIF."""
+    noise = Image.effect_noise((size[0] // 4, size[1] // 4), 40 + seed)
+    image = Image.merge('RGB', (noise, noise.rotate(90, expand=False),
+                                noise.transpose(Image.FLIP_LEFT_RIGHT)))
+    image = image.resize(size)
+    exif = Image.Exif()
+    exif[0x010f] = 'Телефон'
+    exif[0x0112] = 6
+    file_obj = BytesIO()
+    image.save(file_obj, 'JPEG', quality=95, exif=exif)
+    return SimpleUploadedFile(f'phone_{seed}.jpg', file_obj.getvalue())
+
+
+def _decode_ms(content, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with Image.open(BytesIO(content)) as image:
+            image.load()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def image_pipeline(count=5):
+    """Байты и время декодирования фото до и после posts.images."""
+    report = {'original_bytes': 0, 'stored_bytes': 0,
+              'original_decode_ms': 0.0, 'stored_decode_ms': 0.0}
+    for seed in range(count):
+        upload = _phone_photo(seed)
+        original = upload.read()
+        stored, _ = images.normalize(upload)
+        stored.seek(0)
+        stored = stored.read()
+        report['original_bytes'] += len(original)
+        report['stored_bytes'] += len(stored)
+        report['original_decode_ms'] += _decode_ms(original)
+        report['stored_decode_ms'] += _decode_ms(stored)
+    for key in ('original_decode_ms', 'stored_decode_ms'):
+        report[key] = round(report[key], 3)
+    return report
@@ -0,0 +1,60 @@
+"""Замер производительности страниц; запускается явно.
+
+    BENCHMARK=1 py.test tests/test_benchmark.py
+
+Переменные окружения:
+    BENCHMARK_SCALE      - множитель объёма данных (1.0 по умолчанию);
+    BENCHMARK_REPORT     - куда записать JSON-отчёт;
+    BENCHMARK_BASELINE   - отчёт прошлого коммита для сравнения;
+    BENCHMARK_THRESHOLD  - допустимый рост p95 (1.2 = на 20%).
+"""
+import os
+
+import pytest
+
+from tests import benchmark
+
+pytestmark = pytest.mark.skipif(
+    not os.getenv('BENCHMARK'),
+    reason='Замер запускается только с переменной BENCHMARK=1',
+)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_public_pages_latency(client, mock_media):
+    reader = benchmark.seed(float(os.getenv('BENCHMARK_SCALE', '1.0')))
+    report = benchmark.run(client, reader)
+    for name, result in sorted(report.items()):
+        print(f'{name}: {result}')
+
+    report_path = os.getenv('BENCHMARK_REPORT')
+    if report_path:
+        benchmark.write_report(report, report_path)
+
+    baseline_path = os.getenv('BENCHMARK_BASELINE')
+    if baseline_path:
+        regressions = benchmark.compare(
+            report,
+            benchmark.read_report(baseline_path),
+            float(os.getenv('BENCHMARK_THRESHOLD', '1.2')),
+        )
+        assert not regressions, (
+            'Страницы стали медленнее: ' + '; '.join(regressions)
+        )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_slow_clients_do_not_hold_threads(mock_media):
+    """С теми же потоками ASGI обслуживает медленных клиентов быстрее."""
+    benchmark.seed(0.1)
+    result = benchmark.slow_clients('/')
+    print(f'slow clients: {result}')
+    assert result['asgi_ms'] < result['wsgi_ms']
+
+
+def test_uploaded_images_get_lighter():
+    """Обработка загрузок уменьшает и вес фото, и время декодирования."""
+    result = benchmark.image_pipeline()
+    print(f'image pipeline: {result}')
+    assert result['stored_bytes'] < result['original_bytes']
+    assert result['stored_decode_ms'] < result['original_decode_ms']
@@ -0,0 +1,161 @@
+"""ASGI-обёртка над WSGI-приложением Django 2.2.
+
+Django 2.2 не умеет ни ASGI, ни асинхронных view, поэтому обёртка
+делает то, что можно без них: тело запроса принимается асинхронно,
+и медленный клиент не держит поток воркера, пока загружает форму.
+
+Весь вызов WSGI - view, чтение потокового ответа и close() - идёт
+в одном потоке пула (ASGI_THREADS): Django закрывает соединения с базой
+по сигналу request_finished в том потоке, где вызван close(), а
+потоковый ответ может читать курсор базы, который принадлежит потоку
+view. Куски ответа передаются в цикл событий через очередь из
+STREAM_BUFFER сообщений; пока она полна, поток ждёт клиента.
+"""
+import asyncio
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+STREAM_BUFFER = 8
+
+_END = object()
+
+
+def _environ(scope, body):
+    host, port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': host,
+        'SERVER_PORT': str(port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = f'HTTP_{name}'
+            environ[key] = (f'{environ[key]},{value}'
+                            if key in environ else value)
+    return environ
+
+
+class WsgiToAsgi:
+    def __init__(self, wsgi_application, threads):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"Неподдерживаемый тип ASGI: {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    def _run(self, environ, put, stopped):
+        """Вызывает view в потоке пула и отдаёт сообщения ответа в put."""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+
+        try:
+            result = self.wsgi_application(environ, start_response)
+            try:
+                if not getattr(result, 'streaming', True):
+                    body = b''.join(result)
+                    put({'type': 'http.response.start',
+                         'status': started['status'],
+                         'headers': started['headers']})
+                    put({'type': 'http.response.body', 'body': body})
+                    return
+                # Потоковый ответ (FileResponse, выгрузка API).
+                chunks = iter(result)
+                first = next(chunks, _END)
+                put({'type': 'http.response.start',
+                     'status': started['status'],
+                     'headers': started['headers']})
+                chunk = first
+                while chunk is not _END and not stopped.is_set():
+                    put({'type': 'http.response.body', 'body': chunk,
+                         'more_body': True})
+                    chunk = next(chunks, _END)
+                put({'type': 'http.response.body', 'body': b''})
+            finally:
+                close = getattr(result, 'close', None)
+                if close is not None:
+                    close()
+        finally:
+            put(_END)
+
+    async def _http(self, scope, receive, send):
+        body = await self._read_body(receive)
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+        messages = asyncio.Queue(maxsize=STREAM_BUFFER)
+        stopped = threading.Event()
+
+        def put(message):
+            asyncio.run_coroutine_threadsafe(
+                messages.put(message), loop).result()
+
+        done = loop.run_in_executor(
+            self.executor, self._run, _environ(scope, body), put, stopped)
+        try:
+            while True:
+                message = await messages.get()
+                if message is _END:
+                    break
+                await send(message)
+        except BaseException:
+            # Клиент ушёл: поток дочитывать ответ не будет, а очередь
+            # разбираем, чтобы он не ждал места в ней.
+            stopped.set()
+            while await messages.get() is not _END:
+                pass
+            raise
+        finally:
+            await done
@@ -0,0 +1,145 @@
+"""Бэкенды кэша со счётчиками попаданий и промахов.
+
+Бэкенд выбирается переменными окружения (см. CACHES в settings):
+LocMemCache - отдельный кэш в каждом процессе, FileBasedCache - общий
+для всех процессов одного хоста каталог на диске, MemcachedCache -
+внешний memcached. Попадания и промахи попадают в замеры запроса
+и в общие счётчики процесса.
+
+lock() - блокировка по ключу для get-изменить-set над одним значением:
+её видят все процессы, которые видят этот кэш.
+"""
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.core.cache.backends.filebased import (
+    FileBasedCache as BaseFileBasedCache)
+from django.core.cache.backends.locmem import LocMemCache as BaseLocMemCache
+from django.core.cache.backends.memcached import (
+    MemcachedCache as BaseMemcachedCache)
+
+from . import metrics
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _record(hits, misses):
+    with _stats_lock:
+        _stats['hits'] += hits
+        _stats['misses'] += misses
+    metrics.record_cache(hits, misses)
+
+
+def stats():
+    """Попадания и промахи всех кэшей с запуска процесса."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.update(hits=0, misses=0)
+
+
+class LockTimeout(Exception):
+    pass
+
+
+@contextmanager
+def lock(key, timeout=5, wait=1):
+    """Держит блокировку key, пока выполняется блок.
+
+    Блокировка - запись, созданная атомарным add; через timeout секунд
+    она снимается сама, если процесс упал. Не дождавшись её за wait
+    секунд, выбрасывает LockTimeout.
+    """
+    lock_key = f'lock:{key}'
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    while not cache.add(lock_key, token, timeout):
+        if time.monotonic() > deadline:
+            raise LockTimeout(key)
+        time.sleep(0.005)
+    try:
+        yield
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+class CacheStatsMixin:
+    """Считает попадания и промахи кэша.
+
+    BaseCache.get_many вызывает get по каждому ключу, поэтому сам
+    get_many считается только у бэкендов со своей реализацией.
+    """
+    native_get_many = False
+
+    def get(self, key, default=None, version=None):
+        sentinel = object()
+        value = super().get(key, sentinel, version)
+        if value is sentinel:
+            _record(0, 1)
+            return default
+        _record(1, 0)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = super().get_many(keys, version)
+        if self.native_get_many:
+            _record(len(found), len(keys) - len(found))
+        return found
+
+
+class LocMemCache(CacheStatsMixin, BaseLocMemCache):
+    pass
+
+
+class FileBasedCache(CacheStatsMixin, BaseFileBasedCache):
+    """Кэш в каталоге на диске, общий для процессов одного хоста.
+
+    incr в Django - это get и set, поэтому между процессами он
+    защищён блокировкой файла: версии лент в listing_cache не теряют
+    увеличения, сделанные разными воркерами. Блокировка - fcntl,
+    поэтому бэкенд работает только на POSIX.
+    """
+    lock_name = 'incr.lock'
+
+    @contextmanager
+    def _file_lock(self):
+        # Импорт здесь: без fcntl (Windows) settings и остальные бэкенды
+        # должны загружаться.
+        import fcntl
+
+        self._createdir()
+        with open(os.path.join(self._dir, self.lock_name), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def incr(self, key, delta=1, version=None):
+        with self._file_lock():
+            return super().incr(key, delta, version)
+
+    def add(self, key, value, timeout=None, version=None):
+        with self._file_lock():
+            return super().add(key, value, timeout, version)
+
+
+class MemcachedCache(CacheStatsMixin, BaseMemcachedCache):
+    native_get_many = True
+
+    def __init__(self, server, params):
+        super().__init__(server, params)
+        # Вытеснением занимается сам memcached, клиенту эти опции чужие.
+        self._options = {
+            name: value for name, value in self._options.items()
+            if name not in ('MAX_ENTRIES', 'CULL_FREQUENCY')
+        }
@@ -0,0 +1,29 @@
+"""Проверки настроек при запуске (manage.py check, runserver, migrate)."""
+from django.conf import settings
+from django.core.checks import Warning, register
+
+
+@register('database')
+def connection_pool_size(app_configs, **kwargs):
+    """MAX_CONNECTIONS должно хватать всем потокам процесса.
+
+    Каждый поток view держит соединение, и ещё по одному нужно потокам
+    core.concurrent. Если мест меньше, view ждут друг друга до
+    POOL_TIMEOUT, а gather выполняет запросы по очереди.
+    """
+    threads = settings.ASGI_THREADS
+    if settings.VIEW_QUERY_THREADS > 0:
+        threads += settings.VIEW_QUERY_THREADS
+    errors = []
+    for alias, database in settings.DATABASES.items():
+        size = database.get('MAX_CONNECTIONS')
+        if size and size < threads:
+            errors.append(Warning(
+                f'MAX_CONNECTIONS={size} у базы {alias} меньше числа '
+                f'потоков процесса ({threads} = ASGI_THREADS + '
+                f'VIEW_QUERY_THREADS).',
+                hint='Увеличьте DB_MAX_CONNECTIONS или уменьшите '
+                     'ASGI_THREADS / VIEW_QUERY_THREADS.',
+                id='core.W001',
+            ))
+    return errors
@@ -0,0 +1,95 @@
+"""Параллельное выполнение независимых запросов к базе внутри view.
+
+Каждый поток пула работает со своим соединением, поэтому выигрыш есть
+только на сервере БД (PostgreSQL): на SQLite и внутри транзакции
+(её видит лишь соединение текущего потока) функции выполняются
+по очереди. Контекст запроса (закрепление за основной базой,
+см. core.db_router) и его замеры передаются в потоки.
+
+Потоки пула, как и потоки запросов, держат соединения между задачами
+(CONN_MAX_AGE). Если у базы задан MAX_CONNECTIONS (core.db.pool),
+поток без соединения занимает место без ожидания: поток запроса уже
+держит своё и ждёт результата, так что ждать мест ему нельзя. Функцию,
+для которой места не нашлось, выполняет сам поток запроса.
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from . import metrics
+
+_executor = None
+_NO_SLOT = object()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.VIEW_QUERY_THREADS,
+            thread_name_prefix='view-queries')
+    return _executor
+
+
+def _parallel_allowed():
+    connection = connections[DEFAULT_DB_ALIAS]
+    return (settings.VIEW_QUERY_THREADS > 0
+            and connection.vendor != 'sqlite'
+            and not connection.in_atomic_block)
+
+
+def _take_slots():
+    """Места во всех ограниченных пулах; False, если хоть где-то нет."""
+    taken = []
+    for connection in connections.all():
+        if getattr(connection, 'holds_slot', True):
+            continue
+        if not connection.take_slot():
+            for held in taken:
+                held.return_slot()
+            return False
+        taken.append(connection)
+    return True
+
+
+def _call(function):
+    # Поток пула живёт долго: проверяем его соединения, как Django
+    # делает в начале и в конце каждого запроса.
+    for connection in connections.all():
+        connection.close_if_unusable_or_obsolete()
+    if not _take_slots():
+        return _NO_SLOT
+    request_metrics = metrics.current.get()
+    try:
+        with ExitStack() as stack:
+            if request_metrics is not None:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(
+                        request_metrics.db_wrapper))
+            return function()
+    finally:
+        for connection in connections.all():
+            connection.close_if_unusable_or_obsolete()
+            # Место без открытого соединения другим нужнее.
+            if (getattr(connection, 'holds_slot', False)
+                    and connection.connection is None):
+                connection.return_slot()
+
+
+def gather(*functions):
+    """Результаты функций в том же порядке; ошибки пробрасываются."""
+    if len(functions) < 2 or not _parallel_allowed():
+        return [function() for function in functions]
+    futures = [
+        _get_executor().submit(contextvars.copy_context().run, _call, function)
+        for function in functions[1:]
+    ]
+    # Первая функция выполняется в текущем потоке, пока остальные ждут.
+    results = [functions[0]()]
+    for function, future in zip(functions[1:], futures):
+        result = future.result()
+        results.append(function() if result is _NO_SLOT else result)
+    return results
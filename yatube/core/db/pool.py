@@ -0,0 +1,138 @@
+"""Ограничение и проверка соединений с базой внутри процесса.
+
+Django держит одно соединение на поток и при CONN_MAX_AGE переиспользует
+его между запросами. PooledConnectionMixin добавляет к бэкенду:
+
+- MAX_CONNECTIONS - сколько соединений с этой базой может держать
+  процесс; поток ждёт свободного места не дольше POOL_TIMEOUT секунд,
+  а время ожидания попадает в замеры запроса (db_wait). Мест нужно не
+  меньше, чем потоков процесса: ASGI_THREADS потоков view и ещё
+  VIEW_QUERY_THREADS потоков core.concurrent (иначе предупреждение
+  core.W001 при запуске);
+- HEALTH_CHECKS - перед первым запросом к базе в новом HTTP-запросе
+  переиспользуемое соединение проверяется, и мёртвое открывается заново.
+
+Если кто-то ждёт места, соединение отдаётся в конце запроса, даже если
+CONN_MAX_AGE ещё не истёк.
+"""
+import threading
+import time
+
+from django.db import OperationalError
+
+from .. import metrics
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionSlots:
+    """Счётчик соединений одной базы в процессе."""
+
+    def __init__(self, size):
+        self.size = size
+        self.waiting = 0
+        self._semaphore = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        with self._lock:
+            self.waiting += 1
+        start = time.perf_counter()
+        try:
+            acquired = self._semaphore.acquire(timeout=timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+            metrics.record_db_wait(time.perf_counter() - start)
+        return acquired
+
+    def try_acquire(self):
+        """Место без ожидания; False, если все заняты."""
+        return self._semaphore.acquire(blocking=False)
+
+    def release(self):
+        self._semaphore.release()
+
+
+def get_slots(alias, size):
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = ConnectionSlots(size)
+        return _pools[alias]
+
+
+class PooledConnectionMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_pending = False
+        self.holds_slot = False
+
+    @property
+    def slots(self):
+        size = self.settings_dict.get('MAX_CONNECTIONS')
+        return get_slots(self.alias, size) if size else None
+
+    def get_new_connection(self, conn_params):
+        slots = self.slots
+        if slots is not None and not self.holds_slot:
+            timeout = self.settings_dict.get('POOL_TIMEOUT', 10)
+            if not slots.acquire(timeout):
+                raise OperationalError(
+                    f'Нет свободных соединений с базой {self.alias} '
+                    f'(MAX_CONNECTIONS={slots.size}).')
+            self.holds_slot = True
+        try:
+            return super().get_new_connection(conn_params)
+        except Exception:
+            self._release_slot()
+            raise
+
+    def take_slot(self):
+        """Занимает место без ожидания; False, если свободных нет.
+
+        Так потоки core.concurrent не ждут места, которое держит поток
+        запроса, сам ожидающий их.
+        """
+        slots = self.slots
+        if self.holds_slot or slots is None:
+            return True
+        if not slots.try_acquire():
+            return False
+        self.holds_slot = True
+        return True
+
+    def return_slot(self):
+        """Закрывает соединение и отдаёт место, даже если оно не открылось."""
+        self.close()
+        self._release_slot()
+
+    def _release_slot(self):
+        if self.holds_slot:
+            self.holds_slot = False
+            self.slots.release()
+
+    def _close(self):
+        try:
+            super()._close()
+        finally:
+            self._release_slot()
+
+    def close_if_unusable_or_obsolete(self):
+        """Вызывается Django в начале и в конце каждого запроса."""
+        super().close_if_unusable_or_obsolete()
+        if self.connection is None or self.in_atomic_block:
+            return
+        slots = self.slots
+        if slots is not None and slots.waiting:
+            self.close()
+            return
+        self.health_check_pending = self.settings_dict.get(
+            'HEALTH_CHECKS', False)
+
+    def ensure_connection(self):
+        if self.health_check_pending:
+            self.health_check_pending = False
+            if self.connection is not None and not self.is_usable():
+                self.close()
+        super().ensure_connection()
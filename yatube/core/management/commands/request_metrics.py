@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core import metrics
+
+
+class Command(BaseCommand):
+    help = 'Показывает замеры запросов, собранные всеми процессами.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--json', action='store_true', help='Вывести сводку в JSON.')
+
+    def handle(self, *args, **options):
+        summary = metrics.summarize(metrics.collected_samples())
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2, sort_keys=True))
+            return
+        if not summary:
+            self.stdout.write('Замеров пока нет.')
+            return
+        columns = ('count', 'p50_ms', 'p95_ms', 'p99_ms', 'avg_queries',
+                   'avg_db', 'avg_db_wait', 'avg_template', 'avg_cache_hits',
+                   'avg_cache_misses')
+        self.stdout.write('view'.ljust(30) + ''.join(
+            column.rjust(17) for column in columns))
+        for view_name, row in sorted(summary.items()):
+            self.stdout.write(view_name.ljust(30) + ''.join(
+                str(row[column]).rjust(17) for column in columns))
@@ -0,0 +1,189 @@
+"""Отдача загруженных файлов (MEDIA_ROOT) без отдельного веб-сервера.
+
+Файл не читается в память целиком: весь файл отдаётся FileResponse
+(WSGI-сервер с wsgi.file_wrapper, например gunicorn, шлёт его через
+sendfile), диапазон (Range) - кусками по CHUNK_SIZE. Результат stat
+кэшируется на MEDIA_STAT_CACHE_TTL секунд, поэтому повторный запрос с
+If-None-Match отвечается 304 без обращений к диску. Если перед Django
+стоит nginx, MEDIA_ACCEL_REDIRECT передаёт ему отдачу через
+X-Accel-Redirect.
+"""
+import mimetypes
+import os
+import re
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.encoding import escape_uri_path
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+_stats = OrderedDict()
+_stats_lock = threading.Lock()
+
+
+def _stat(path):
+    """(mtime_ns, размер) обычного файла; OSError, если его нет."""
+    now = time.monotonic()
+    with _stats_lock:
+        cached = _stats.get(path)
+        if cached is not None and cached[0] > now:
+            _stats.move_to_end(path)
+            return cached[1]
+    result = os.stat(path)
+    if not stat.S_ISREG(result.st_mode):
+        raise FileNotFoundError(path)
+    value = (result.st_mtime_ns, result.st_size)
+    with _stats_lock:
+        _stats[path] = (now + settings.MEDIA_STAT_CACHE_TTL, value)
+        _stats.move_to_end(path)
+        while len(_stats) > settings.MEDIA_STAT_CACHE_SIZE:
+            _stats.popitem(last=False)
+    return value
+
+
+def _forget(path):
+    with _stats_lock:
+        _stats.pop(path, None)
+
+
+def clear_stat_cache():
+    with _stats_lock:
+        _stats.clear()
+
+
+def byte_range(header, size):
+    """(начало, длина) по заголовку Range или None - отдать весь файл.
+
+    Несколько диапазонов не поддерживаются: на них отдаётся весь файл,
+    это разрешено RFC 7233. ValueError - диапазон за концом файла.
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        length = min(int(last), size)
+        if not length:
+            raise ValueError(header)
+        return size - length, length
+    start = int(first)
+    if start >= size:
+        raise ValueError(header)
+    end = min(int(last), size - 1) if last else size - 1
+    if end < start:
+        return None
+    return start, end - start + 1
+
+
+class _FileRange:
+    """Читает из файла не больше length байт с текущей позиции."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class _MediaFileResponse(FileResponse):
+    block_size = CHUNK_SIZE
+
+    def set_headers(self, filelike):
+        # Заголовки ставит serve() по закэшированному stat.
+        pass
+
+
+def _requested_range(request, size, etag, last_modified):
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range not in (etag, last_modified):
+        return None
+    return byte_range(header, size)
+
+
+def _file_response(request, full_path, size, content_type, requested):
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+    else:
+        try:
+            file = open(full_path, 'rb')
+        except OSError:
+            _forget(full_path)
+            raise Http404
+        if requested is None:
+            response = _MediaFileResponse(file, content_type=content_type)
+        else:
+            file.seek(requested[0])
+            response = _MediaFileResponse(
+                _FileRange(file, requested[1]), content_type=content_type)
+    if requested is None:
+        response['Content-Length'] = size
+    else:
+        start, length = requested
+        response.status_code = 206
+        response['Content-Range'] = (
+            f'bytes {start}-{start + length - 1}/{size}')
+        response['Content-Length'] = length
+    return response
+
+
+@require_safe
+def serve(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        mtime_ns, size = _stat(full_path)
+    except OSError:
+        raise Http404
+    mtime = mtime_ns // 10 ** 9
+    etag = quote_etag(f'{mtime_ns:x}-{size:x}')
+    last_modified = http_date(mtime)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=mtime)
+    if response is None:
+        content_type = (mimetypes.guess_type(full_path)[0]
+                        or 'application/octet-stream')
+        if settings.MEDIA_ACCEL_REDIRECT:
+            # Диапазоны и sendfile - на стороне nginx.
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = escape_uri_path(
+                settings.MEDIA_ACCEL_REDIRECT + path)
+        else:
+            try:
+                requested = _requested_range(
+                    request, size, etag, last_modified)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+            response = _file_response(
+                request, full_path, size, content_type, requested)
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    response['Accept-Ranges'] = 'bytes'
+    patch_cache_control(
+        response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+    return response
@@ -0,0 +1,167 @@
+"""Замеры запросов: время, SQL, шаблоны и кэш по каждому view.
+
+Middleware собирает замеры в RequestMetrics текущего запроса,
+отдаёт их в заголовке Server-Timing и складывает в скользящее окно
+последних замеров по каждому view. Окно процесса периодически
+сохраняется в кэш, чтобы команда request_metrics видела все процессы.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.cache import cache
+
+FIELDS = ('total', 'db', 'template', 'queries', 'cache_hits',
+          'cache_misses', 'db_wait')
+SNAPSHOT_KEY = 'metrics:snapshot:{}'
+PROCESSES_KEY = 'metrics:processes'
+
+current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Замеры одного запроса; время в миллисекундах."""
+
+    def __init__(self):
+        # Запросы view могут идти из нескольких потоков (core.concurrent).
+        self.lock = threading.Lock()
+        self.total = 0.0
+        self.db = 0.0
+        self.template = 0.0
+        self.queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.db_wait = 0.0
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.db += (time.perf_counter() - start) * 1000
+                self.queries += 1
+
+    def as_tuple(self):
+        return tuple(getattr(self, field) for field in FIELDS)
+
+    def server_timing(self):
+        return (
+            f'total;dur={self.total:.1f}, '
+            f'db;dur={self.db:.1f};desc="{self.queries} queries", '
+            f'template;dur={self.template:.1f}, '
+            f'db_wait;dur={self.db_wait:.1f}, '
+            f'cache;desc="{self.cache_hits} hits {self.cache_misses} misses"'
+        )
+
+
+def record_template(duration):
+    metrics = current.get()
+    if metrics is not None:
+        with metrics.lock:
+            metrics.template += duration * 1000
+
+
+def record_db_wait(duration):
+    metrics = current.get()
+    if metrics is not None:
+        with metrics.lock:
+            metrics.db_wait += duration * 1000
+
+
+def record_cache(hits, misses):
+    metrics = current.get()
+    if metrics is not None:
+        with metrics.lock:
+            metrics.cache_hits += hits
+            metrics.cache_misses += misses
+
+
+class Histogram:
+    """Последние METRICS_WINDOW замеров по каждому view."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(self._window)
+        self._flushed = time.monotonic()
+
+    @staticmethod
+    def _window():
+        return deque(maxlen=settings.METRICS_WINDOW)
+
+    def add(self, view_name, metrics):
+        with self._lock:
+            self._samples[view_name].append(metrics.as_tuple())
+            due = (time.monotonic() - self._flushed
+                   > settings.METRICS_FLUSH_INTERVAL)
+            if due:
+                # Сохраняет только один из потоков.
+                self._flushed = time.monotonic()
+        if due:
+            self.flush()
+
+    def samples(self):
+        with self._lock:
+            return {name: list(window)
+                    for name, window in self._samples.items()}
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    def flush(self):
+        """Сохраняет окно процесса в кэш для команды request_metrics.
+
+        Под блокировкой: иначе потоки процесса, сохраняя одновременно,
+        затирают друг другу список процессов.
+        """
+        pid = os.getpid()
+        with self._lock:
+            self._flushed = time.monotonic()
+            samples = {name: list(window)
+                       for name, window in self._samples.items()}
+            cache.set(SNAPSHOT_KEY.format(pid), samples,
+                      settings.METRICS_SNAPSHOT_TIMEOUT)
+            processes = set(cache.get(PROCESSES_KEY, ()))
+            processes.add(pid)
+            cache.set(PROCESSES_KEY, processes,
+                      settings.METRICS_SNAPSHOT_TIMEOUT)
+
+
+histogram = Histogram()
+
+
+def _percentile(ordered, percent):
+    return ordered[min(int(percent / 100 * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(samples):
+    """Сводка по view: число замеров, p50/p95/p99 и средние значения."""
+    summary = {}
+    for view_name, rows in samples.items():
+        if not rows:
+            continue
+        columns = dict(zip(FIELDS, zip(*rows)))
+        total = sorted(columns['total'])
+        summary[view_name] = {
+            'count': len(rows),
+            'p50_ms': round(_percentile(total, 50), 2),
+            'p95_ms': round(_percentile(total, 95), 2),
+            'p99_ms': round(_percentile(total, 99), 2),
+        }
+        for field in FIELDS[1:]:
+            summary[view_name][f'avg_{field}'] = round(
+                sum(columns[field]) / len(rows), 2)
+    return summary
+
+
+def collected_samples():
+    """Замеры всех процессов, сохранённые в кэше."""
+    merged = defaultdict(list)
+    for pid in cache.get(PROCESSES_KEY, set()):
+        for view_name, rows in cache.get(SNAPSHOT_KEY.format(pid), {}).items():
+            merged[view_name].extend(rows)
+    return merged
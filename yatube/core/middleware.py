@@ -0,0 +1,36 @@
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+
+class RequestMetricsMiddleware:
+    """Замеряет часть запросов (METRICS_SAMPLE_RATE) по каждому view."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.current.set(request_metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(
+                        request_metrics.db_wrapper))
+                response = self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        request_metrics.total = (time.perf_counter() - start) * 1000
+        match = request.resolver_match
+        view_name = match.view_name if match else 'unresolved'
+        metrics.histogram.add(view_name, request_metrics)
+        response['Server-Timing'] = request_metrics.server_timing()
+        return response
@@ -0,0 +1,44 @@
+"""Ограничение частоты действий пользователя (token bucket).
+
+Состояние корзины хранится в кэше, поэтому с общим бэкендом
+(core.cache.FileBasedCache, memcached) лимит действует на все процессы.
+Корзина читается и пишется под блокировкой (core.cache.lock), иначе
+одновременные запросы тратили бы один и тот же токен.
+"""
+import time
+
+from django.core.cache import cache
+
+from .cache import LockTimeout, lock
+
+
+class TokenBucket:
+    """rate токенов в минуту, не больше burst подряд."""
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.rate = rate / 60
+        self.burst = burst
+
+    def _key(self, ident):
+        return f'ratelimit:{self.name}:{ident}'
+
+    def consume(self, ident):
+        """Забирает токен; False, если лимит исчерпан.
+
+        Не дождавшись блокировки, тоже отказывает: столько одновременных
+        запросов одного пользователя - уже перебор.
+        """
+        key = self._key(ident)
+        try:
+            with lock(key):
+                now = time.time()
+                tokens, updated = cache.get(key, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                cache.set(key, (tokens, now), int(self.burst / self.rate) + 1)
+        except LockTimeout:
+            return False
+        return allowed
@@ -0,0 +1,79 @@
+"""Хранилище, в котором одинаковые файлы лежат один раз.
+
+Имя файла - SHA-256 содержимого: posts/3f/3fa1...9c.jpg. Хэш считается,
+пока загрузка копируется во временный файл, поэтому файл читается один
+раз. Если такой файл уже есть, временный удаляется и возвращается имя
+существующего; миниатюры по этому имени тоже общие. Удалять файл можно
+только когда на него никто не ссылается: для картинок постов ссылки
+считает posts.images (ImageBlob). До проверки, есть ли уже такой файл,
+отправляется сигнал file_claimed: по нему posts.images блокирует запись
+о файле, чтобы его не удалили между проверкой и ссылкой на него.
+
+Временные файлы лежат не в MEDIA_ROOT (оттуда всё отдаётся как есть),
+а в отдельном соседнем каталоге: media -> media_incoming.
+MEDIA_INCOMING_ROOT задаёт другой каталог, если MEDIA_ROOT - точка
+монтирования (os.replace работает только в пределах одной файловой
+системы).
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.dispatch import Signal
+from django.utils.deconstruct import deconstructible
+
+INCOMING_PREFIX = '.incoming-'
+INCOMING_SUFFIX = '_incoming'
+
+file_claimed = Signal(providing_args=['name'])
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def _receive(self, content):
+        """Копирует содержимое во временный файл; возвращает хэш и путь."""
+        incoming = (getattr(settings, 'MEDIA_INCOMING_ROOT', None)
+                    or os.path.normpath(self.location) + INCOMING_SUFFIX)
+        os.makedirs(incoming, exist_ok=True)
+        digest = hashlib.sha256()
+        handle, temp_path = tempfile.mkstemp(dir=incoming,
+                                             prefix=INCOMING_PREFIX)
+        try:
+            with os.fdopen(handle, 'wb') as temp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return digest.hexdigest(), temp_path
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        directory, filename = posixpath.split(name.replace('\\', '/'))
+        extension = os.path.splitext(filename)[1].lower()
+        digest, temp_path = self._receive(content)
+        name = posixpath.join(directory, digest[:2], digest + extension)
+        file_claimed.send(sender=self.__class__, name=name)
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            os.remove(temp_path)
+            return name
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # mkstemp создаёт файл с правами 0600, а читать его может
+        # и nginx (MEDIA_ACCEL_REDIRECT).
+        os.chmod(temp_path, self.file_permissions_mode or 0o644)
+        # Атомарно: одновременная загрузка того же файла просто
+        # перезапишет его тем же содержимым.
+        os.replace(temp_path, full_path)
+        return name
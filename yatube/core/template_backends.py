@@ -0,0 +1,26 @@
+import time
+
+from django.template.backends.django import DjangoTemplates, Template
+
+from . import metrics
+
+
+class MeasuredTemplate(Template):
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.record_template(time.perf_counter() - start)
+
+
+class MeasuredDjangoTemplates(DjangoTemplates):
+    """Шаблонизатор Django, который учитывает время отрисовки."""
+
+    def from_string(self, template_code):
+        return MeasuredTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return MeasuredTemplate(template.template, self)
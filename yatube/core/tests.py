@@ -0,0 +1,687 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from http import HTTPStatus
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.wsgi import get_wsgi_application
+from django.db import OperationalError, connections, router, transaction
+from django.test import (
+    Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings)
+from django.urls import reverse
+from posts import search
+from posts.counters import user_stats
+from posts.models import Post
+
+from . import cache as cache_module
+from . import checks
+from . import concurrent
+from . import db_router
+from . import media
+from . import metrics
+from .asgi import WsgiToAsgi
+from .db.sqlite3.base import DatabaseWrapper as SQLiteWrapper
+from .ratelimit import TokenBucket
+from .storage import ContentAddressedStorage
+
+User = get_user_model()
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.histogram.clear()
+        self.guest_client = Client()
+
+    def test_server_timing_header(self):
+        """Ответ содержит Server-Timing с временем БД и шаблонов."""
+        response = self.guest_client.get('/')
+        header = response['Server-Timing']
+        for part in ('total;dur=', 'db;dur=', 'template;dur=', 'cache;desc='):
+            with self.subTest(part=part):
+                self.assertIn(part, header)
+
+    def test_samples_are_grouped_by_view(self):
+        self.guest_client.get('/')
+        self.guest_client.get('/')
+        summary = metrics.summarize(metrics.histogram.samples())
+        self.assertEqual(summary['posts:index']['count'], 2)
+        self.assertGreater(summary['posts:index']['avg_queries'], 0)
+        self.assertGreater(summary['posts:index']['avg_cache_misses'], 0)
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_measured(self):
+        response = self.guest_client.get('/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(metrics.histogram.samples(), {})
+
+    def test_stats_endpoint_is_admin_only(self):
+        response = self.guest_client.get('/admin/metrics/')
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        admin = User.objects.create_user('admin', is_staff=True)
+        self.guest_client.force_login(admin)
+        self.guest_client.get('/')
+        response = self.guest_client.get('/admin/metrics/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('posts:index', response.json()['views'])
+
+    def test_management_command_reads_flushed_samples(self):
+        self.guest_client.get('/')
+        metrics.histogram.flush()
+        out = StringIO()
+        call_command('request_metrics', stdout=out)
+        self.assertIn('posts:index', out.getvalue())
+
+    def test_concurrent_flushes_keep_every_process(self):
+        cache.delete(metrics.PROCESSES_KEY)
+        pids = iter(range(1000, 1016))
+        with mock.patch('core.metrics.os.getpid',
+                        side_effect=lambda: next(pids)):
+            threads = [threading.Thread(target=metrics.histogram.flush)
+                       for _ in range(16)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(cache.get(metrics.PROCESSES_KEY),
+                         set(range(1000, 1016)))
+
+
+class CacheBackendTests(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+        cache_module.reset_stats()
+
+    def make_cache(self, **params):
+        return cache_module.FileBasedCache(
+            self.location, {'KEY_PREFIX': 'yatube', **params})
+
+    def test_file_cache_is_shared_between_instances(self):
+        """Два экземпляра (как два процесса) видят общие ключи и incr."""
+        first, second = self.make_cache(), self.make_cache()
+        first.set('version', 1)
+        second.incr('version')
+        first.incr('version')
+        self.assertEqual(second.get('version'), 3)
+
+    def test_key_prefix_and_version_separate_namespaces(self):
+        self.make_cache().set('key', 'yatube')
+        self.assertIsNone(self.make_cache(KEY_PREFIX='other').get('key'))
+        self.assertIsNone(self.make_cache(VERSION=2).get('key'))
+
+    def test_hits_and_misses_are_counted(self):
+        backend = self.make_cache()
+        backend.set('key', 'value')
+        backend.get('key')
+        backend.get('missing')
+        backend.get_many(['key', 'missing'])
+        self.assertEqual(cache_module.stats(), {'hits': 2, 'misses': 2})
+
+    def test_lock_excludes_second_holder(self):
+        cache.clear()
+        with cache_module.lock('key'):
+            with self.assertRaises(cache_module.LockTimeout):
+                with cache_module.lock('key', wait=0):
+                    pass
+        with cache_module.lock('key', wait=0):
+            pass
+
+    def test_token_bucket_under_concurrency(self):
+        """Одновременные запросы не тратят один токен дважды."""
+        cache.clear()
+        bucket = TokenBucket('test', rate=1, burst=5)
+        results = []
+
+        def consume():
+            results.append(bucket.consume('user'))
+
+        threads = [threading.Thread(target=consume) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 5)
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """Основная база и реплика - два отдельных файла SQLite."""
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        connections.databases['replica'] = dict(
+            connections.databases['default'],
+            NAME=os.path.join(cls.workdir, 'replica.sqlite3'),
+        )
+        super().setUpClass()
+        call_command('migrate', database='replica', verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections.databases['replica']
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user('author', password='password')
+        user.save(using='replica')
+        # Реплика - копия основной базы: счётчики автора есть и там,
+        # иначе чтение страницы создавало бы их и закрепляло запрос
+        # за основной базой.
+        stats = user_stats(user.pk)
+        stats.save(using='replica')
+        self.settings_override = override_settings(
+            DATABASE_REPLICAS=['replica'])
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(Post.objects.all().db, 'replica')
+        self.assertEqual(router.db_for_write(Post), 'default')
+
+    def test_session_reads_its_own_writes(self):
+        client = Client()
+        client.post(reverse('users:login'),
+                    {'username': 'author', 'password': 'password'})
+        self.assertIn(db_router.PIN_COOKIE, client.cookies)
+        client.post(reverse('posts:post_create'), {'text': 'Свежий пост'})
+        self.assertTrue(Post.objects.using('default').filter(
+            text='Свежий пост').exists())
+        profile = reverse('posts:profile', kwargs={'username': 'author'})
+        self.assertContains(client.get(profile), 'Свежий пост')
+        # Чужая сессия без отметки читает реплику, где поста ещё нет
+        # (кэш фрагментов очищаем, чтобы страница собиралась из базы).
+        cache.clear()
+        self.assertNotContains(Client().get(profile), 'Свежий пост')
+
+    def test_search_index_is_written_to_primary(self):
+        def indexed(alias):
+            with connections[alias].cursor() as cursor:
+                cursor.execute(f'SELECT count(*) FROM {search.FTS_TABLE}')
+                return cursor.fetchone()[0]
+
+        post = Post.objects.create(
+            author=User.objects.using('default').get(), text='Поиск')
+        search.rebuild_index()
+        self.assertEqual((indexed('default'), indexed('replica')), (1, 0))
+        post.delete()
+        self.assertEqual(indexed('default'), 0)
+
+    def test_without_replicas_everything_uses_default(self):
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(Post.objects.all().db, 'default')
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir, ignore_errors=True)
+        self.settings_dict = dict(
+            connections.databases['default'],
+            ENGINE='core.db.sqlite3',
+            NAME=os.path.join(workdir, 'pool.sqlite3'),
+            MAX_CONNECTIONS=1,
+            POOL_TIMEOUT=0.05,
+            HEALTH_CHECKS=True,
+        )
+        self.alias = f'pool_{id(self)}'
+
+    def make_connection(self):
+        connection = SQLiteWrapper(self.settings_dict, self.alias)
+        self.addCleanup(connection.close)
+        return connection
+
+    def test_connections_are_capped_per_process(self):
+        first, second = self.make_connection(), self.make_connection()
+        first.ensure_connection()
+        with self.assertRaises(OperationalError):
+            second.ensure_connection()
+        first.close()
+        second.ensure_connection()
+        self.assertTrue(second.holds_slot)
+
+    def test_waiting_is_measured(self):
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.current.set(request_metrics)
+        try:
+            first, second = self.make_connection(), self.make_connection()
+            first.ensure_connection()
+            with self.assertRaises(OperationalError):
+                second.ensure_connection()
+        finally:
+            metrics.current.reset(token)
+        self.assertGreaterEqual(request_metrics.db_wait, 50)
+
+    def test_idle_connection_is_released_for_waiters(self):
+        first = self.make_connection()
+        first.ensure_connection()
+        first.slots.waiting = 1
+        try:
+            first.close_if_unusable_or_obsolete()
+        finally:
+            first.slots.waiting = 0
+        self.assertIsNone(first.connection)
+        self.assertFalse(first.holds_slot)
+
+    def test_dead_connection_is_replaced_on_checkout(self):
+        connection = self.make_connection()
+        connection.ensure_connection()
+        dead = connection.connection
+        connection.close_if_unusable_or_obsolete()
+        self.assertTrue(connection.health_check_pending)
+        with mock.patch.object(connection, 'is_usable', return_value=False):
+            connection.ensure_connection()
+        self.assertIsNot(connection.connection, dead)
+        self.assertFalse(connection.health_check_pending)
+
+    def test_slot_is_taken_without_waiting(self):
+        first, second = self.make_connection(), self.make_connection()
+        first.ensure_connection()
+        self.assertFalse(second.take_slot())
+        first.close()
+        self.assertTrue(second.take_slot())
+        second.ensure_connection()
+        second.return_slot()
+        self.assertFalse(second.holds_slot)
+        self.assertTrue(first.take_slot())
+        first.return_slot()
+
+
+class ConnectionPoolCheckTests(SimpleTestCase):
+    def pool_size(self, size):
+        return mock.patch.dict(connections.databases['default'],
+                               MAX_CONNECTIONS=size)
+
+    def test_small_pool_is_reported(self):
+        with self.pool_size(5), override_settings(ASGI_THREADS=4,
+                                                  VIEW_QUERY_THREADS=2):
+            errors = checks.connection_pool_size(None)
+        self.assertEqual([error.id for error in errors], ['core.W001'])
+
+    def test_enough_connections(self):
+        for size in (6, None):
+            with self.pool_size(size), override_settings(
+                    ASGI_THREADS=4, VIEW_QUERY_THREADS=2):
+                self.assertEqual(checks.connection_pool_size(None), [])
+
+
+class AsgiAdapterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.application = WsgiToAsgi(get_wsgi_application(), threads=2)
+
+    def tearDown(self):
+        self.application.executor.shutdown()
+
+    def call(self, scope, messages):
+        messages = list(messages)
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.application(scope, receive, send))
+        return sent
+
+    def request(self, path, method='GET', body=b'', headers=()):
+        scope = {'type': 'http', 'method': method, 'path': path,
+                 'query_string': b'', 'headers': list(headers)}
+        messages = [
+            {'type': 'http.request', 'body': body[:5], 'more_body': True},
+            {'type': 'http.request', 'body': body[5:]},
+        ]
+        return self.call(scope, messages)
+
+    def test_page_is_served(self):
+        start, *bodies = self.request('/', headers=[(b'host', b'testserver')])
+        self.assertEqual(start['status'], HTTPStatus.OK)
+        self.assertIn((b'content-type', b'text/html; charset=utf-8'),
+                      start['headers'])
+        self.assertIn('Последние обновления'.encode(),
+                      b''.join(body['body'] for body in bodies))
+
+    def test_request_body_is_passed_through(self):
+        def echo(environ, start_response):
+            length = int(environ['CONTENT_LENGTH'])
+            start_response('201 Created', [('X-Path', environ['PATH_INFO'])])
+            return iter([environ['wsgi.input'].read(length)])
+
+        self.application.wsgi_application = echo
+        body = 'текст из двух кусков'.encode()
+        start, *bodies = self.request(
+            '/пост/', method='POST', body=body,
+            headers=[(b'content-length', str(len(body)).encode())])
+        self.assertEqual(start['status'], HTTPStatus.CREATED)
+        self.assertIn((b'x-path', '/пост/'.encode()), start['headers'])
+        self.assertEqual(b''.join(body['body'] for body in bodies), body)
+        self.assertFalse(bodies[-1].get('more_body'))
+
+    def test_stream_is_read_and_closed_in_view_thread(self):
+        threads = []
+
+        class Body:
+            def __iter__(self):
+                for chunk in (b'a', b'b', b'c'):
+                    threads.append(threading.current_thread())
+                    yield chunk
+
+            def close(self):
+                threads.append(threading.current_thread())
+
+        def app(environ, start_response):
+            threads.append(threading.current_thread())
+            start_response('200 OK', [])
+            return Body()
+
+        self.application.wsgi_application = app
+        start, *bodies = self.request('/')
+        self.assertEqual(b''.join(body['body'] for body in bodies), b'abc')
+        self.assertEqual(len(threads), 5)
+        self.assertEqual(len(set(threads)), 1)
+        self.assertNotEqual(threads[0], threading.current_thread())
+
+    def test_stream_is_closed_when_client_leaves(self):
+        closed = threading.Event()
+
+        class Body:
+            def __iter__(self):
+                while True:
+                    yield b'x'
+
+            def close(self):
+                closed.set()
+
+        def app(environ, start_response):
+            start_response('200 OK', [])
+            return Body()
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            if message['type'] == 'http.response.body':
+                raise OSError('клиент ушёл')
+
+        self.application.wsgi_application = app
+        scope = {'type': 'http', 'method': 'GET', 'path': '/',
+                 'query_string': b'', 'headers': []}
+        with self.assertRaises(OSError):
+            asyncio.run(self.application(scope, receive, send))
+        self.assertTrue(closed.is_set())
+
+    def test_disconnect_before_body(self):
+        scope = {'type': 'http', 'method': 'GET', 'path': '/',
+                 'query_string': b'', 'headers': []}
+        self.assertEqual(self.call(scope, [{'type': 'http.disconnect'}]), [])
+
+    def test_lifespan(self):
+        sent = self.call({'type': 'lifespan'}, [
+            {'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        self.assertEqual([message['type'] for message in sent], [
+            'lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+
+class GatherTests(TestCase):
+    def test_results_keep_order(self):
+        with mock.patch.object(concurrent, '_parallel_allowed',
+                               return_value=True):
+            self.assertEqual(
+                concurrent.gather(lambda: 1, lambda: 2, lambda: 3), [1, 2, 3])
+
+    def test_errors_are_raised(self):
+        def fail():
+            raise ValueError('ошибка')
+
+        with mock.patch.object(concurrent, '_parallel_allowed',
+                               return_value=True):
+            with self.assertRaises(ValueError):
+                concurrent.gather(lambda: 1, fail)
+
+    def pooled_database(self, size):
+        """Отдельная база на core.db.sqlite3 со своим пулом мест."""
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir, ignore_errors=True)
+        alias = f'pooled_{id(self)}'
+        connections.databases[alias] = dict(
+            connections.databases['default'], ENGINE='core.db.sqlite3',
+            NAME=os.path.join(workdir, 'pooled.sqlite3'),
+            MAX_CONNECTIONS=size, POOL_TIMEOUT=0.05)
+        self.addCleanup(connections.databases.pop, alias)
+        # Свой поток пула: его соединения закроются вместе с ним.
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        patcher = mock.patch.object(concurrent, '_executor', executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return alias
+
+    def test_sequential_without_free_connections(self):
+        alias = self.pooled_database(1)
+        slots = connections[alias].slots
+        self.assertTrue(slots.try_acquire())
+        self.addCleanup(slots.release)
+        threads = []
+
+        def work():
+            threads.append(threading.current_thread())
+
+        with mock.patch.object(concurrent, '_parallel_allowed',
+                               return_value=True):
+            concurrent.gather(work, work, work)
+        self.assertEqual(threads, [threading.current_thread()] * 3)
+
+    def test_worker_keeps_its_connection(self):
+        alias = self.pooled_database(1)
+        opened = []
+
+        def query():
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+            opened.append(connections[alias].connection)
+
+        with mock.patch.object(concurrent, '_parallel_allowed',
+                               return_value=True):
+            for _ in range(2):
+                concurrent.gather(lambda: None, query)
+        self.assertEqual(len(opened), 2)
+        self.assertIs(opened[0], opened[1])
+        self.assertFalse(connections[alias].slots.try_acquire())
+
+    def test_worker_queries_are_measured(self):
+        def query():
+            with connections['default'].cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.current.set(request_metrics)
+        try:
+            with mock.patch.object(concurrent, '_parallel_allowed',
+                                   return_value=True):
+                concurrent.gather(lambda: None, query)
+        finally:
+            metrics.current.reset(token)
+        self.assertEqual(request_metrics.queries, 1)
+
+    def test_sequential_inside_transaction(self):
+        with override_settings(VIEW_QUERY_THREADS=4):
+            with mock.patch.object(
+                    connections['default'], 'vendor', 'postgresql'):
+                with transaction.atomic():
+                    self.assertFalse(concurrent._parallel_allowed())
+
+
+class MediaServingTests(TestCase):
+    content = bytes(range(256)) * 1024
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        os.makedirs(os.path.join(self.media_root, 'posts'))
+        with open(os.path.join(self.media_root, 'posts', 'cat.jpg'),
+                  'wb') as file:
+            file.write(self.content)
+        override = override_settings(MEDIA_ROOT=self.media_root,
+                                     MEDIA_ACCEL_REDIRECT='')
+        override.enable()
+        self.addCleanup(override.disable)
+        media.clear_stat_cache()
+        self.addCleanup(media.clear_stat_cache)
+
+    def get(self, path='/media/posts/cat.jpg', **headers):
+        return self.client.get(path, **headers)
+
+    def test_whole_file_is_streamed(self):
+        response = self.get()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_range(self):
+        cases = {
+            'bytes=10-19': (10, 20),
+            'bytes=-5': (len(self.content) - 5, len(self.content)),
+            f'bytes={len(self.content) - 3}-': (
+                len(self.content) - 3, len(self.content)),
+            'bytes=100-999999999': (100, len(self.content)),
+        }
+        for header, (start, end) in cases.items():
+            with self.subTest(header=header):
+                response = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.PARTIAL_CONTENT)
+                self.assertEqual(b''.join(response.streaming_content),
+                                 self.content[start:end])
+                self.assertEqual(
+                    response['Content-Range'],
+                    f'bytes {start}-{end - 1}/{len(self.content)}')
+                self.assertEqual(response['Content-Length'],
+                                 str(end - start))
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code,
+                         HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'],
+                         f'bytes */{len(self.content)}')
+
+    def test_multiple_ranges_get_whole_file(self):
+        response = self.get(HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_stale_if_range_gets_whole_file(self):
+        response = self.get(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        etag = response['ETag']
+        response = self.get(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, HTTPStatus.PARTIAL_CONTENT)
+
+    def test_not_modified_without_disk_access(self):
+        etag = self.get()['ETag']
+        with mock.patch.object(media, 'os') as media_os, \
+                mock.patch('core.media.open', create=True) as open_file:
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        media_os.stat.assert_not_called()
+        open_file.assert_not_called()
+
+    def test_head_has_headers_only(self):
+        response = self.client.head('/media/posts/cat.jpg')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+
+    def test_missing_and_outside_files(self):
+        for path in ('/media/posts/none.jpg', '/media/posts/',
+                     '/media/../manage.py', '/media/%2e%2e/manage.py'):
+            with self.subTest(path=path):
+                self.assertEqual(self.get(path).status_code,
+                                 HTTPStatus.NOT_FOUND)
+
+    def test_deleted_file_is_not_served_from_stat_cache(self):
+        self.get()
+        os.remove(os.path.join(self.media_root, 'posts', 'cat.jpg'))
+        self.assertEqual(self.get().status_code, HTTPStatus.NOT_FOUND)
+
+    def test_only_safe_methods(self):
+        response = self.client.post('/media/posts/cat.jpg')
+        self.assertEqual(response.status_code, HTTPStatus.METHOD_NOT_ALLOWED)
+
+    def test_accel_redirect(self):
+        with override_settings(MEDIA_ACCEL_REDIRECT='/protected-media/'):
+            response = self.get()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/protected-media/posts/cat.jpg')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+
+class ContentAddressedStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+        self.storage = ContentAddressedStorage(location=self.location)
+        self.incoming = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.incoming, ignore_errors=True)
+        override = override_settings(MEDIA_INCOMING_ROOT=self.incoming)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_name_is_content_digest(self):
+        name = self.storage.save('posts/Cat.JPG', ContentFile(b'cat'))
+        digest = hashlib.sha256(b'cat').hexdigest()
+        self.assertEqual(name, f'posts/{digest[:2]}/{digest}.jpg')
+        with self.storage.open(name) as file:
+            self.assertEqual(file.read(), b'cat')
+        mode = os.stat(self.storage.path(name)).st_mode & 0o777
+        self.assertEqual(mode, 0o644)
+
+    def test_same_content_is_stored_once(self):
+        first = self.storage.save('posts/a.gif', ContentFile(b'meme'))
+        second = self.storage.save('posts/b.gif', ContentFile(b'meme'))
+        other = self.storage.save('posts/c.gif', ContentFile(b'other'))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(os.listdir(self.incoming), [])
+        self.assertEqual(os.listdir(self.location), ['posts'])
+
+    def test_temporary_files_are_outside_location(self):
+        incoming = self.location + '_incoming'
+        self.addCleanup(shutil.rmtree, incoming, ignore_errors=True)
+        with override_settings(MEDIA_INCOMING_ROOT=None):
+            with mock.patch('core.storage.os.replace') as replace:
+                self.storage.save('posts/a.gif', ContentFile(b'meme'))
+        temp_path = replace.call_args[0][0]
+        # Отдельный каталог, а не родитель MEDIA_ROOT (там код проекта).
+        self.assertEqual(os.path.dirname(temp_path), incoming)
+
+    def test_plain_file_objects(self):
+        path = os.path.join(self.location, 'upload.png')
+        with open(path, 'wb') as file:
+            file.write(b'png')
+        with open(path, 'rb') as file:
+            name = self.storage.save('posts/upload.png', file)
+        self.assertTrue(name.endswith(
+            hashlib.sha256(b'png').hexdigest() + '.png'))
@@ -1,6 +1,12 @@
+import os
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
 from django.shortcuts import render
 from http import HTTPStatus
 
+from . import cache, metrics
+
 
 def page_not_found(request, exception):
     return render(request, 'core/404.html', {'path': request.path}, status=HTTPStatus.NOT_FOUND)
@@ -16,3 +22,13 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+@staff_member_required
+def request_metrics(request):
+    """Сводка замеров запросов этого процесса."""
+    return JsonResponse({
+        'pid': os.getpid(),
+        'views': metrics.summarize(metrics.histogram.samples()),
+        'cache': cache.stats(),
+    })
@@ -0,0 +1,168 @@
+"""JSON API только для чтения: ленты постов, пост с комментариями.
+
+Записи читаются через values() и сериализуются словарями, без создания
+экземпляров моделей. Списки листаются курсором (?after=, ?before=),
+а выгрузка /posts/export/ отдаётся StreamingHttpResponse: записи
+читаются из базы пачками и сразу уходят клиенту.
+"""
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_safe
+
+from .feed import FeedPaginator
+from .models import Comment, Group, Post, User
+from .paginator import CursorPaginator
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+EXPORT_CHUNK_SIZE = 2000
+
+POST_FIELDS = ('id', 'text', 'pub_date', 'author__username', 'group__slug',
+               'image', 'comments_count')
+COMMENT_FIELDS = ('id', 'text', 'created', 'author__username')
+GROUP_FIELDS = ('slug', 'title', 'description', 'posts_count')
+
+
+def _post(row):
+    return {
+        'id': row['id'],
+        'text': row['text'],
+        'pub_date': row['pub_date'],
+        'author': row['author__username'],
+        'group': row['group__slug'],
+        'image': default_storage.url(row['image']) if row['image'] else None,
+        'comments_count': row['comments_count'],
+    }
+
+
+def _comment(row):
+    return {
+        'id': row['id'],
+        'text': row['text'],
+        'created': row['created'],
+        'author': row['author__username'],
+    }
+
+
+def _not_found():
+    return JsonResponse({'detail': 'Не найдено.'}, status=404)
+
+
+def _page_size(request):
+    try:
+        return min(max(int(request.GET.get('limit', PAGE_SIZE)), 1),
+                   MAX_PAGE_SIZE)
+    except ValueError:
+        return PAGE_SIZE
+
+
+def _page(request, queryset, serialize, ordering=('-pub_date', '-id'),
+          paginator_class=CursorPaginator, **kwargs):
+    """Страница списка: записи и курсоры соседних страниц."""
+    page = paginator_class(queryset, _page_size(request),
+                           ordering=ordering, **kwargs).get_page(
+        after=request.GET.get('after'), before=request.GET.get('before'))
+    return {
+        'results': [serialize(row) for row in page],
+        'next': page.next_cursor or None,
+        'previous': page.previous_cursor or None,
+    }
+
+
+def _posts_response(request, queryset, **kwargs):
+    return JsonResponse(
+        _page(request, queryset.values(*POST_FIELDS), _post, **kwargs))
+
+
+@require_safe
+def post_list(request):
+    return _posts_response(request, Post.objects.all())
+
+
+@require_safe
+def group_posts(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True).first()
+    if group_id is None:
+        return _not_found()
+    return _posts_response(request, Post.objects.filter(group_id=group_id))
+
+
+@require_safe
+def author_posts(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True).first()
+    if author_id is None:
+        return _not_found()
+    return _posts_response(request, Post.objects.filter(author_id=author_id))
+
+
+@require_safe
+def follow_feed(request):
+    if not request.user.is_authenticated:
+        return JsonResponse(
+            {'detail': 'Нужно войти в аккаунт.'}, status=401)
+    return _posts_response(request, Post.objects.all(),
+                           paginator_class=FeedPaginator, user=request.user)
+
+
+@require_safe
+def group_list(request):
+    return JsonResponse({
+        'results': list(Group.objects.order_by('title').values(*GROUP_FIELDS)),
+    })
+
+
+def _comments_page(request, post_id):
+    return _page(
+        request,
+        Comment.objects.filter(post_id=post_id).values(*COMMENT_FIELDS),
+        _comment,
+        ordering=('created', 'id'),
+    )
+
+
+@require_safe
+def post_detail(request, post_id):
+    row = Post.objects.filter(pk=post_id).values(*POST_FIELDS).first()
+    if row is None:
+        return _not_found()
+    data = _post(row)
+    data['comments'] = _comments_page(request, post_id)
+    return JsonResponse(data)
+
+
+@require_safe
+def post_comments(request, post_id):
+    if not Post.objects.filter(pk=post_id).exists():
+        return _not_found()
+    return JsonResponse(_comments_page(request, post_id))
+
+
+def _stream_array(rows, serialize):
+    """Массив JSON кусками по EXPORT_CHUNK_SIZE записей."""
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    chunk = ['[']
+    for number, row in enumerate(rows):
+        chunk.append((',' if number else '') + encoder.encode(serialize(row)))
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']')
+    yield ''.join(chunk)
+
+
+@require_safe
+def post_export(request):
+    """Все посты (?group=, ?author=) одним массивом JSON потоком."""
+    posts = Post.objects.order_by('-pub_date', '-id')
+    if request.GET.get('group'):
+        posts = posts.filter(group__slug=request.GET['group'])
+    if request.GET.get('author'):
+        posts = posts.filter(author__username=request.GET['author'])
+    rows = posts.values(*POST_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    return StreamingHttpResponse(
+        _stream_array(rows, _post),
+        content_type='application/json; charset=utf-8',
+    )
@@ -0,0 +1,17 @@
+from django.urls import path
+from . import api
+
+app_name = 'api'
+
+urlpatterns = [
+    path('posts/', api.post_list, name='post_list'),
+    path('posts/export/', api.post_export, name='post_export'),
+    path('posts/<int:post_id>/', api.post_detail, name='post_detail'),
+    path('posts/<int:post_id>/comments/', api.post_comments,
+         name='post_comments'),
+    path('groups/', api.group_list, name='group_list'),
+    path('groups/<slug:slug>/posts/', api.group_posts, name='group_posts'),
+    path('authors/<str:username>/posts/', api.author_posts,
+         name='author_posts'),
+    path('feed/', api.follow_feed, name='follow_feed'),
+]
@@ -5,3 +5,6 @@ class PostsConfig(AppConfig):
 
     name = 'posts'
     verbose_name = 'Приложение для постов'
+
+    def ready(self):
+        from . import signals  # noqa: F401
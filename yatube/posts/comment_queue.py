@@ -0,0 +1,193 @@
+"""Приём комментариев под нагрузкой.
+
+Обычно комментарий сохраняется сразу. Если на пост пишут чаще
+COMMENT_QUEUE_THRESHOLD раз за COMMENT_HOT_WINDOW секунд, комментарии
+попадают в очередь процесса, и фоновый поток вставляет их пачками
+через bulk_create - вместо сотни мелких транзакций на одной таблице.
+Пока комментарий в очереди, автор видит его на странице поста:
+он лежит в кэше в списке ожидающих. Список меняется под блокировкой
+(core.cache.lock), чтобы одновременные запросы не теряли записи.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.utils import timezone
+
+from core.cache import LockTimeout, lock
+from core.ratelimit import TokenBucket
+
+from . import counters, listing_cache
+from .models import Comment, Post
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'comments:pending:{}:{}'
+RATE_KEY = 'comments:rate:{}:{}'
+
+_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def allow(user_id):
+    """Токен из корзины пользователя; False - пишет слишком часто."""
+    bucket = TokenBucket(
+        'comment', settings.COMMENT_RATE, settings.COMMENT_BURST)
+    return bucket.consume(user_id)
+
+
+def is_hot(post_id):
+    """Считает комментарии поста в текущем окне; True при шторме."""
+    window = int(time.time() // settings.COMMENT_HOT_WINDOW)
+    key = RATE_KEY.format(post_id, window)
+    cache.add(key, 0, settings.COMMENT_HOT_WINDOW * 2)
+    try:
+        return cache.incr(key) > settings.COMMENT_QUEUE_THRESHOLD
+    except ValueError:
+        return False
+
+
+def pending(post_id, user_id):
+    """Комментарии пользователя к посту, ещё не записанные в базу."""
+    return cache.get(PENDING_KEY.format(post_id, user_id), [])
+
+
+def pending_stamp(request, post_id):
+    """Для ETag страницы поста: меняется вместе с очередью автора."""
+    if not request.user.is_authenticated:
+        return []
+    return [entry['key'] for entry in pending(post_id, request.user.pk)]
+
+
+def _update_pending(post_id, user_id, change):
+    """Заменяет список ожидающих на change(список)."""
+    key = PENDING_KEY.format(post_id, user_id)
+    try:
+        with lock(key):
+            entries = change(cache.get(key, []))
+            if entries:
+                cache.set(key, entries, settings.COMMENT_PENDING_TIMEOUT)
+            else:
+                cache.delete(key)
+    except LockTimeout:
+        # Комментарий всё равно будет записан, а список истечёт сам.
+        logger.warning('Список ожидающих комментариев %s не обновлён', key)
+
+
+def submit(comment):
+    """Сохраняет комментарий сразу или ставит его в очередь."""
+    if not is_hot(comment.post_id):
+        comment.save()
+        return
+    entry = {
+        'key': uuid.uuid4().hex,
+        'post_id': comment.post_id,
+        'author_id': comment.author_id,
+        'text': comment.text,
+        'created': timezone.now().isoformat(),
+    }
+    _update_pending(comment.post_id, comment.author_id,
+                    lambda entries: entries + [entry])
+    _queue.put(entry)
+    if settings.COMMENT_QUEUE_WORKER:
+        _ensure_worker()
+
+
+def _ensure_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=_work, name='comment-queue', daemon=True)
+            _worker.start()
+
+
+def _take_batch(timeout):
+    batch = []
+    try:
+        batch.append(_queue.get(timeout=timeout))
+        while len(batch) < settings.COMMENT_BATCH_SIZE:
+            batch.append(_queue.get_nowait())
+    except queue.Empty:
+        pass
+    return batch
+
+
+def _work():
+    while True:
+        batch = _take_batch(settings.COMMENT_FLUSH_INTERVAL)
+        if not batch:
+            continue
+        try:
+            _write(batch)
+        except Exception:
+            logger.exception('Не удалось записать %s комментариев',
+                             len(batch))
+        finally:
+            connections.close_all()
+
+
+def _write(batch):
+    """Вставляет пачку одной транзакцией и делает работу сигналов.
+
+    Посты читаются внутри транзакции, то есть из основной базы: реплика
+    могла ещё не получить только что созданный пост. Комментарии
+    к удалённым постам отбрасываются.
+    """
+    with transaction.atomic():
+        posts = {
+            pk: (pk, author_id, group_id)
+            for pk, author_id, group_id in Post.objects.filter(
+                pk__in={entry['post_id'] for entry in batch}
+            ).values_list('pk', 'author_id', 'group_id')
+        }
+        entries = [entry for entry in batch if entry['post_id'] in posts]
+        if len(entries) < len(batch):
+            logger.warning(
+                'Пропущено %s комментариев из очереди: посты удалены',
+                len(batch) - len(entries))
+        # created проставит auto_now_add: время записи, а не отправки.
+        Comment.objects.bulk_create([
+            Comment(post_id=entry['post_id'],
+                    author_id=entry['author_id'],
+                    text=entry['text'])
+            for entry in entries
+        ])
+        for post_id, added in Counter(
+                entry['post_id'] for entry in entries).items():
+            counters.add_to_post(post_id, added)
+    scopes = set()
+    for post in posts.values():
+        scopes |= listing_cache.post_scopes(*post)
+    listing_cache.invalidate(scopes)
+    written = {entry['key'] for entry in batch}
+    for post_id, author_id in {(entry['post_id'], entry['author_id'])
+                               for entry in batch}:
+        _update_pending(post_id, author_id, lambda entries: [
+            entry for entry in entries if entry['key'] not in written
+        ])
+
+
+def flush():
+    """Записывает всё, что сейчас в очереди (выход процесса, тесты)."""
+    while True:
+        batch = _take_batch(0)
+        if not batch:
+            return
+        _write(batch)
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception('Комментарии из очереди не записаны')
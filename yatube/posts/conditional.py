@@ -0,0 +1,95 @@
+"""Условные GET (ETag/Last-Modified) для страниц поста и профиля.
+
+Свежесть страницы определяется одним запросом по индексам: дата поста,
+число и дата последнего комментария (индекс post, created) и отметка
+UserStats.updated, которую сигналы сдвигают при изменении постов
+и подписок автора. Если клиент или прокси прислал совпадающий
+ETag, view не вызывается и шаблоны не рендерятся.
+"""
+import hashlib
+from functools import wraps
+
+from django.db.models import OuterRef, Subquery
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+
+from .models import Comment, Post, User
+
+
+def post_freshness(post_id):
+    """Отметки страницы поста и время последнего изменения."""
+    last_comment = Comment.objects.filter(
+        post=OuterRef('pk')).order_by('-created').values('created')[:1]
+    row = Post.objects.filter(pk=post_id).annotate(
+        last_comment=Subquery(last_comment),
+    ).values_list(
+        'pub_date', 'comments_count', 'last_comment', 'author__stats__updated',
+    ).first()
+    if row is None:
+        return None
+    pub_date, comments_count, last_comment, author_updated = row
+    if author_updated is None:
+        return None
+    return row, max(filter(None, (pub_date, last_comment, author_updated)))
+
+
+def profile_freshness(username):
+    """Отметки страницы профиля и время последнего изменения."""
+    row = User.objects.filter(username=username).values_list(
+        'pk', 'stats__updated').first()
+    if row is None or row[1] is None:
+        return None
+    return row, row[1]
+
+
+def _etag(request, stamps):
+    raw = '|'.join(map(str, (
+        request.get_full_path(), request.user.pk, *stamps)))
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def _cache_headers(response, etag, last_modified, private):
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    patch_vary_headers(response, ('Cookie',))
+    if private:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+
+
+def conditional_page(freshness, extra=None):
+    """Отвечает 304, пока отметки freshness(**kwargs) не изменились.
+
+    extra(request, **kwargs) добавляет к ETag отметки, которые зависят
+    от посетителя, а не от базы.
+
+    Ответ помечается no-cache: браузер и прокси хранят страницу,
+    но каждый раз переспрашивают, а переспрос стоит одного запроса.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            found = freshness(**kwargs)
+            if found is None:
+                return view(request, *args, **kwargs)
+            stamps, updated = found
+            if extra is not None:
+                stamps = (*stamps, *extra(request, **kwargs))
+            etag = _etag(request, stamps)
+            last_modified = int(updated.timestamp())
+            private = request.user.is_authenticated
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            _cache_headers(
+                response, etag, http_date(last_modified), private)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,162 @@
+"""Денормализованные счётчики постов, комментариев и подписок.
+
+Счётчики меняются сигналами в той же транзакции, что и сама запись,
+а recount() пересчитывает их из исходных таблиц и чинит расхождения.
+"""
+import logging
+
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import (
+    Comment, Follow, Group, ImageBlob, Post, User, UserStats)
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+# Поле счётчика: модель-источник и поле, которое ссылается на владельца.
+USER_COUNTERS = {
+    'posts_count': (Post, 'author'),
+    'followers_count': (Follow, 'author'),
+    'following_count': (Follow, 'user'),
+}
+
+
+def _actual(model, field):
+    """Подзапрос с настоящим числом строк для OuterRef('pk')."""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def _shift(model, lookup, field, delta, **values):
+    """Сдвигает счётчик строки lookup; возвращает число изменённых строк.
+
+    Ниже нуля счётчик не опускается, но такое вычитание означает, что
+    он уже разошёлся с таблицами: об этом пишется предупреждение
+    (исправляет recount_counters).
+    """
+    queryset = model.objects.filter(**lookup)
+    if delta >= 0:
+        return queryset.update(**{field: F(field) + delta}, **values)
+    updated = queryset.filter(**{f'{field}__gte': -delta}).update(
+        **{field: F(field) + delta}, **values)
+    if updated or not queryset.exists():
+        return updated
+    logger.warning('Счётчик %s.%s для %s разошёлся с таблицами',
+                   model.__name__, field, lookup)
+    return queryset.update(**{field: 0}, **values)
+
+
+def user_stats(user_id):
+    """Счётчики пользователя; пересчитываются, если строки ещё нет."""
+    stats = UserStats.objects.filter(user_id=user_id).first()
+    if stats is None:
+        defaults = {
+            field: model.objects.filter(**{f'{owner}_id': user_id}).count()
+            for field, (model, owner) in USER_COUNTERS.items()
+        }
+        stats, _ = UserStats.objects.get_or_create(
+            user_id=user_id, defaults=defaults)
+    return stats
+
+
+def add_to_user(user_id, field, delta):
+    updated = _shift(UserStats, {'user_id': user_id}, field, delta,
+                     updated=timezone.now())
+    if not updated and delta > 0:
+        user_stats(user_id)
+
+
+def touch_user(user_id):
+    """Сдвигает отметку изменения автора (для ETag его страниц)."""
+    touch_users([user_id])
+
+
+def touch_users(user_ids):
+    UserStats.objects.filter(user_id__in=user_ids).update(
+        updated=timezone.now())
+
+
+def add_to_group(group_id, delta):
+    if group_id:
+        _shift(Group, {'pk': group_id}, 'posts_count', delta)
+
+
+def add_to_post(post_id, delta):
+    _shift(Post, {'pk': post_id}, 'comments_count', delta)
+
+
+def recount(repair=True):
+    """Сверяет счётчики с таблицами; возвращает число расхождений."""
+    UserStats.objects.bulk_create(
+        [
+            UserStats(user_id=user_id)
+            for user_id in User.objects.filter(
+                stats__isnull=True).values_list('pk', flat=True)
+        ],
+        ignore_conflicts=True,
+    )
+    targets = [
+        (UserStats, field, _actual(model, owner))
+        for field, (model, owner) in USER_COUNTERS.items()
+    ]
+    targets += [
+        (Group, 'posts_count', _actual(Post, 'group')),
+        (Post, 'comments_count', _actual(Comment, 'post')),
+    ]
+    drift = {}
+    for model, field, actual in targets:
+        stale = list(model.objects.annotate(actual=actual).filter(
+            ~Q(**{field: F('actual')})).values_list('pk', flat=True))
+        drift[f'{model.__name__}.{field}'] = len(stale)
+        if repair:
+            for start in range(0, len(stale), BATCH_SIZE):
+                _repair(model, field, actual, stale[start:start + BATCH_SIZE])
+    drift['ImageBlob.refs'] = _recount_image_refs(repair)
+    return drift
+
+
+def _repair(model, field, actual, pks):
+    """Пересчитывает счётчик только у разошедшихся строк.
+
+    Отметка изменения автора сдвигается, иначе ETag его страниц
+    (posts.conditional) не заметил бы исправления.
+    """
+    values = {field: actual}
+    if model is UserStats:
+        values['updated'] = timezone.now()
+    model.objects.filter(pk__in=pks).update(**values)
+    if model is Post:
+        touch_users(Post.objects.filter(pk__in=pks).values('author_id'))
+
+
+def _recount_image_refs(repair):
+    """Ссылки на файлы картинок; файлы без ссылок не удаляются."""
+    actual = dict(
+        Post.objects.exclude(image='').order_by().values('image')
+        .annotate(refs=Count('pk')).values_list('image', 'refs'))
+    stored = dict(ImageBlob.objects.values_list('name', 'refs'))
+    missing = actual.keys() - stored.keys()
+    orphans = stored.keys() - actual.keys()
+    changed = [name for name in actual.keys() & stored.keys()
+               if actual[name] != stored[name]]
+    if repair:
+        ImageBlob.objects.filter(name__in=orphans).delete()
+        ImageBlob.objects.bulk_create(
+            [ImageBlob(name=name, refs=actual[name]) for name in missing],
+            batch_size=BATCH_SIZE, ignore_conflicts=True)
+        ImageBlob.objects.bulk_update(
+            [ImageBlob(name=name, refs=actual[name]) for name in changed],
+            ['refs'], batch_size=BATCH_SIZE)
+    return len(missing) + len(orphans) + len(changed)
@@ -0,0 +1,209 @@
+"""Лента подписок: fan-out при записи и чтение для популярных авторов.
+
+Новый пост сразу раскладывается в FeedEntry всех подписчиков автора,
+поэтому лента читается по индексу (user, -pub_date, -post_id) без
+соединения с таблицей подписок. Авторов, у которых подписчиков больше
+FEED_FANOUT_LIMIT, не раскладываем: их посты подмешиваются при чтении
+(см. FeedPaginator). Когда автор опускается до предела, его последние
+посты раскладываются подписчикам заново.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import FeedEntry, Follow, Post, UserStats
+from .paginator import CursorPaginator
+
+REFILL_BATCH_SIZE = 100
+
+CELEBRITIES_CACHE_KEY = 'feed:celebrities'
+CELEBRITIES_CACHE_TIMEOUT = 300
+
+
+def celebrity_ids():
+    """Авторы, посты которых читаются из ленты без раскладки."""
+    ids = cache.get(CELEBRITIES_CACHE_KEY)
+    if ids is None:
+        ids = set(
+            UserStats.objects.filter(
+                followers_count__gt=settings.FEED_FANOUT_LIMIT)
+            .values_list('user_id', flat=True)
+        )
+        cache.set(CELEBRITIES_CACHE_KEY, ids, CELEBRITIES_CACHE_TIMEOUT)
+    return ids
+
+
+def trim_feeds(user_ids):
+    """Обрезает ленты до FEED_LENGTH, когда они выросли сверх запаса."""
+    overflow = (
+        FeedEntry.objects.filter(user_id__in=user_ids)
+        .values('user_id')
+        .annotate(total=Count('id'))
+        .filter(total__gt=settings.FEED_LENGTH + settings.FEED_TRIM_SLACK)
+        .values_list('user_id', flat=True)
+    )
+    for user_id in overflow:
+        entries = FeedEntry.objects.filter(user_id=user_id)
+        cutoff = entries.order_by('-pub_date', '-post_id').values_list(
+            'pub_date', 'post_id')[settings.FEED_LENGTH - 1]
+        entries.filter(
+            Q(pub_date__lt=cutoff[0])
+            | Q(pub_date=cutoff[0], post_id__lt=cutoff[1])
+        ).delete()
+
+
+def is_celebrity(author_id):
+    """То же, что celebrity_ids(), но по базе: для записи в ленты."""
+    return UserStats.objects.filter(
+        user_id=author_id,
+        followers_count__gt=settings.FEED_FANOUT_LIMIT).exists()
+
+
+def fan_out_post(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if is_celebrity(post.author_id):
+        return
+    # Из базы, а не из follow_graph: кэш может не знать о подписке,
+    # сделанной в другом процессе, и пост не попал бы в ленту.
+    follower_ids = list(Follow.objects.filter(
+        author_id=post.author_id).values_list('user_id', flat=True))
+    FeedEntry.objects.bulk_create(
+        [
+            FeedEntry(user_id=user_id, post=post,
+                      author_id=post.author_id, pub_date=post.pub_date)
+            for user_id in follower_ids
+        ],
+        ignore_conflicts=True,
+    )
+    trim_feeds(follower_ids)
+
+
+def backfill_feed(user, author):
+    """Добавляет в ленту последние посты автора после подписки."""
+    if is_celebrity(author.pk):
+        return
+    posts = author.posts.order_by('-pub_date', '-id').values_list(
+        'pk', 'pub_date')[:settings.FEED_LENGTH]
+    FeedEntry.objects.bulk_create(
+        [
+            FeedEntry(user=user, post_id=post_id,
+                      author=author, pub_date=pub_date)
+            for post_id, pub_date in posts
+        ],
+        ignore_conflicts=True,
+    )
+    trim_feeds([user.pk])
+
+
+def prune_feed(user, author):
+    """Убирает из ленты посты автора после отписки."""
+    FeedEntry.objects.filter(user=user, author=author).delete()
+
+
+def follower_gained(author_id):
+    """После подписки: не перешёл ли автор FEED_FANOUT_LIMIT.
+
+    Новые посты такого автора уже не раскладываются (is_celebrity
+    смотрит в базу), поэтому чтение должно сразу их подмешивать.
+    """
+    if UserStats.objects.filter(
+            user_id=author_id,
+            followers_count=settings.FEED_FANOUT_LIMIT + 1).exists():
+        cache.delete(CELEBRITIES_CACHE_KEY)
+
+
+def follower_lost(author_id):
+    """После отписки: не опустился ли автор до FEED_FANOUT_LIMIT.
+
+    Пока автор был популярным, его посты не раскладывались; теперь
+    они больше не подмешиваются при чтении, поэтому последние посты
+    раскладываются всем подписчикам после коммита.
+    """
+    if UserStats.objects.filter(
+            user_id=author_id,
+            followers_count=settings.FEED_FANOUT_LIMIT).exists():
+        cache.delete(CELEBRITIES_CACHE_KEY)
+        transaction.on_commit(lambda: refill_feeds(author_id))
+
+
+def refill_feeds(author_id):
+    posts = list(
+        Post.objects.filter(author_id=author_id)
+        .order_by('-pub_date', '-id')
+        .values_list('pk', 'pub_date')[:settings.FEED_LENGTH])
+    follower_ids = list(Follow.objects.filter(
+        author_id=author_id).values_list('user_id', flat=True))
+    for start in range(0, len(follower_ids), REFILL_BATCH_SIZE):
+        batch = follower_ids[start:start + REFILL_BATCH_SIZE]
+        FeedEntry.objects.bulk_create(
+            [
+                FeedEntry(user_id=user_id, post_id=post_id,
+                          author_id=author_id, pub_date=pub_date)
+                for user_id in batch
+                for post_id, pub_date in posts
+            ],
+            ignore_conflicts=True,
+        )
+        trim_feeds(batch)
+
+
+def feed_entries(user):
+    """Записи ленты читателя в порядке индекса."""
+    return FeedEntry.objects.filter(user=user).order_by(
+        '-pub_date', '-post_id')
+
+
+class FeedPaginator(CursorPaginator):
+    """Лента подписок постранично по ключу (pub_date, id).
+
+    Из FeedEntry читателя и из постов популярных авторов, на которых
+    он подписан, берётся не больше нужного числа ключей по индексам,
+    ключи сливаются без повторов, а посты страницы читаются одним
+    запросом из object_list.
+    """
+    ENTRY_FIELDS = ('pub_date', 'post_id')
+    # Кэша фрагментов у ленты подписок нет: откладывать чтение незачем.
+    lazy_pages = False
+
+    def __init__(self, object_list, per_page, user, **kwargs):
+        self.user = user
+        super().__init__(object_list, per_page, **kwargs)
+
+    def _keys(self, values, backwards, offset, limit):
+        entries = feed_entries(self.user)
+        celebrities = Follow.objects.filter(
+            user_id=self.user.pk, author_id__in=celebrity_ids(),
+        ).values('author_id')
+        posts = Post.objects.filter(author_id__in=celebrities)
+        if values is not None:
+            entries = entries.filter(self._keyset_filter(
+                values, backwards, names=self.ENTRY_FIELDS))
+            posts = posts.filter(self._keyset_filter(values, backwards))
+        if backwards:
+            entries = entries.reverse()
+            posts = posts.order_by(*self._reversed_ordering())
+        else:
+            posts = posts.order_by(*self.ordering)
+        # Первые offset + limit ключей ленты - среди первых offset + limit
+        # ключей каждого источника.
+        end = offset + limit
+        keys = set(entries.values_list(*self.ENTRY_FIELDS)[:end])
+        if celebrities:
+            keys.update(posts.values_list(*self._fields())[:end])
+        return sorted(keys, reverse=not backwards)[offset:end]
+
+    def _fetch(self, values, backwards, offset, limit):
+        ids = [post_id for _, post_id in
+               self._keys(values, backwards, offset, limit)]
+        rows = {}
+        for row in self.object_list.filter(pk__in=ids):
+            rows[row['id'] if isinstance(row, dict) else row.pk] = row
+        return [rows[post_id] for post_id in ids if post_id in rows]
+
+    def cursor_before_page(self, number):
+        keys = self._keys(None, False, (number - 1) * self.per_page - 1, 1)
+        if not keys:
+            return ''
+        pub_date, post_id = keys[0]
+        return self.encode_cursor({'pub_date': pub_date, 'id': post_id})
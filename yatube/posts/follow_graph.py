@@ -0,0 +1,130 @@
+"""Граф подписок в кэше.
+
+Для каждого пользователя в кэше лежат множества id авторов, на которых
+он подписан, и id его подписчиков. Проверка подписки, общие подписки
+и рекомендации считаются по ним без запросов к базе; при промахе
+множества читаются из Follow одним запросом на всех недостающих.
+
+Ключи множеств содержат версию из listing_cache. Сигналы подписки
+и отписки сдвигают её сразу (для чтений в той же транзакции) и ещё раз
+после коммита: множество, прочитанное из базы до коммита, остаётся
+под старой версией и больше не читается.
+
+Сбросить множества можно только в общем кэше: в LocMemCache у каждого
+процесса свой, и подписка в одном воркере не дошла бы до остальных.
+Поэтому без общего кэша множества всегда читаются из базы. Записи
+(раскладка ленты, см. posts.feed) на граф не опираются.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from . import listing_cache
+from .models import Follow
+
+FOLLOWING = 'following'
+FOLLOWERS = 'followers'
+# Направление -> (чей это список, что в нём лежит).
+_COLUMNS = {
+    FOLLOWING: ('user_id', 'author_id'),
+    FOLLOWERS: ('author_id', 'user_id'),
+}
+
+
+def _scope(direction, user_id):
+    return f'{direction}:{user_id}'
+
+
+def is_cached():
+    """Держит ли граф множества в кэше (только если кэш общий)."""
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def _query(direction, user_ids):
+    owner, target = _COLUMNS[direction]
+    loaded = {user_id: set() for user_id in user_ids}
+    for owner_id, target_id in Follow.objects.filter(
+            **{f'{owner}__in': user_ids}).values_list(owner, target):
+        loaded[owner_id].add(target_id)
+    return {user_id: frozenset(ids) for user_id, ids in loaded.items()}
+
+
+def _load(direction, user_ids):
+    """Множества направления для нескольких пользователей."""
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return {}
+    if not is_cached():
+        return _query(direction, user_ids)
+    versions = listing_cache.get_versions(
+        [_scope(direction, user_id) for user_id in user_ids])
+    keys = {
+        user_id: f'follow_graph:{direction}:{user_id}:{version}'
+        for user_id, version in zip(user_ids, versions)
+    }
+    found = cache.get_many(keys.values())
+    result = {user_id: found[key] for user_id, key in keys.items()
+              if key in found}
+    missing = [user_id for user_id in user_ids if user_id not in result]
+    if missing:
+        loaded = _query(direction, missing)
+        cache.set_many(
+            {keys[user_id]: ids for user_id, ids in loaded.items()},
+            settings.FOLLOW_GRAPH_TIMEOUT)
+        result.update(loaded)
+    return result
+
+
+def following_ids(user_id):
+    """Авторы, на которых подписан пользователь."""
+    if not user_id:
+        return frozenset()
+    return _load(FOLLOWING, [user_id])[user_id]
+
+
+def follower_ids(author_id):
+    """Подписчики автора."""
+    return _load(FOLLOWERS, [author_id])[author_id]
+
+
+def is_following(user_id, author_id):
+    return author_id in following_ids(user_id)
+
+
+def is_following_many(user_id, author_ids):
+    """{id автора: подписан ли} - для кнопок подписки в списках."""
+    following = following_ids(user_id)
+    return {author_id: author_id in following for author_id in author_ids}
+
+
+def mutual(user_id):
+    """Пользователи, с которыми подписки взаимны."""
+    if not user_id:
+        return frozenset()
+    return following_ids(user_id) & follower_ids(user_id)
+
+
+def suggestions(user_id, limit=10):
+    """На кого подписаны авторы пользователя, а он сам ещё нет.
+
+    Чем больше авторов пользователя подписаны на кандидата, тем он выше.
+    """
+    following = following_ids(user_id)
+    counts = Counter()
+    for ids in _load(FOLLOWING, following).values():
+        counts.update(ids)
+    candidates = [
+        (-count, author_id) for author_id, count in counts.items()
+        if author_id != user_id and author_id not in following
+    ]
+    return [author_id for _, author_id in sorted(candidates)[:limit]]
+
+
+def changed(user_id, author_id):
+    """Вызывается сигналами подписки и отписки."""
+    scopes = [_scope(FOLLOWING, user_id), _scope(FOLLOWERS, author_id)]
+    listing_cache.invalidate(scopes)
+    transaction.on_commit(lambda: listing_cache.invalidate(scopes))
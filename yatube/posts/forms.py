@@ -1,5 +1,9 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from PIL import Image
 from .models import Post, Comment
+from . import images, thumbnails
 
 
 class PostForm(forms.ModelForm):
@@ -23,6 +27,45 @@ class PostForm(forms.ModelForm):
             )
         return text
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        self.image_info = (None, None, None)
+        if isinstance(image, UploadedFile):
+            try:
+                image, self.image_info = images.normalize(image)
+            except (OSError, ValueError, Image.DecompressionBombError):
+                raise forms.ValidationError(
+                    'Не удалось обработать картинку'
+                )
+        return image
+
+    def save(self, commit=True):
+        """Правка пишет только поля формы.
+
+        Размеры и реестр миниатюр меняются вместе с картинкой; иначе
+        пост, прочитанный до фоновой нарезки (thumbnails.save_registry),
+        вернул бы в базу старый реестр.
+        """
+        post = self.instance
+        image_changed = 'image' in self.changed_data
+        fields = list(self._meta.fields)
+        if image_changed or post._state.adding:
+            (post.image_width,
+             post.image_height,
+             post.image_size) = self.image_info
+            post.image_variants = ''
+            fields += ['image_width', 'image_height', 'image_size',
+                       'image_variants']
+        post = super().save(commit=False)
+        if commit:
+            post.save(update_fields=None if post._state.adding else fields)
+            self._save_m2m()
+            if image_changed and post.image:
+                image_name = post.image.name
+                transaction.on_commit(
+                    lambda: thumbnails.schedule(image_name))
+        return post
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,270 @@
+"""Обработка загруженных картинок постов.
+
+Фото с телефона весит мегабайты и несёт EXIF (в том числе координаты
+съёмки), а миниатюры режутся из оригинала. Поэтому PostForm сохраняет
+картинку не больше IMAGE_MAX_SIZE, без EXIF и с уже применённым
+поворотом. Картинку, которой это не нужно, не пережимаем, чтобы не
+терять качество.
+
+Миниатюры для srcset (IMAGE_VARIANT_WIDTHS, в JPEG или PNG и в WebP/AVIF,
+если Pillow умеет их сохранять) нарезает фоновая задача
+(см. thumbnails.generate), а их список хранится в самом посте
+(Post.image_variants). Шаблону не нужно спрашивать хранилище, есть ли
+миниатюра.
+"""
+import json
+import logging
+import os
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from PIL import Image, ImageOps
+
+from .models import ImageBlob, Post
+
+logger = logging.getLogger(__name__)
+
+# Форматы, которые браузеры показывают без перекодирования.
+WEB_FORMATS = ('JPEG', 'PNG', 'GIF')
+# Форматы анимаций, которые храним как есть.
+ANIMATED_FORMATS = ('GIF', 'PNG', 'WEBP')
+# Формат варианта -> расширение файла.
+MODERN_FORMATS = {'WEBP': 'webp', 'AVIF': 'avif'}
+MIME_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png',
+              'WEBP': 'image/webp', 'AVIF': 'image/avif'}
+
+# Пропорции и ширина по умолчанию - как у прежней миниатюры 960x339.
+ASPECT = (960, 339)
+DEFAULT_WIDTH = 960
+SIZES = '(min-width: 1200px) 1110px, 100vw'
+
+ORIENTATION = 0x0112
+
+
+def modern_formats():
+    """Форматы вариантов, которые может сохранить установленный Pillow."""
+    Image.init()
+    return [(image_format, extension)
+            for image_format, extension in MODERN_FORMATS.items()
+            if image_format in Image.SAVE]
+
+
+def variant_name(name, width, height, extension):
+    return f'variants/{name}/{width}x{height}.{extension}'
+
+
+def _is_animated(image):
+    # Несколько кадров бывает и у фото: MPO (JPEG со вторым снимком)
+    # пишут многие телефоны, и его нужно пережать, как обычное фото.
+    return (image.format in ANIMATED_FORMATS
+            and getattr(image, 'is_animated', False))
+
+
+def _needs_processing(image):
+    max_width, max_height = settings.IMAGE_MAX_SIZE
+    return (image.format not in WEB_FORMATS
+            or image.width > max_width or image.height > max_height
+            or 'exif' in image.info
+            or ORIENTATION in image.getexif())
+
+
+def _has_alpha(image):
+    return (image.mode in ('RGBA', 'LA', 'PA')
+            or 'transparency' in image.info)
+
+
+def _encode(image):
+    """Сохраняет картинку без метаданных; возвращает байты и расширение."""
+    output = BytesIO()
+    options = {}
+    if image.info.get('icc_profile'):
+        options['icc_profile'] = image.info['icc_profile']
+    if _has_alpha(image):
+        image.convert('RGBA').save(output, 'PNG', optimize=True, **options)
+        return output.getvalue(), 'png'
+    image.convert('RGB').save(
+        output, 'JPEG', quality=settings.IMAGE_JPEG_QUALITY,
+        optimize=True, **options)
+    return output.getvalue(), 'jpg'
+
+
+def normalize(upload):
+    """Файл для сохранения и его (ширина, высота, размер в байтах).
+
+    Анимации хранятся как есть: перекодирование кадров дороже,
+    чем выигрыш от него.
+    """
+    upload.seek(0)
+    with Image.open(upload) as image:
+        if _is_animated(image) or not _needs_processing(image):
+            upload.seek(0)
+            return upload, (image.width, image.height, upload.size)
+        # thumbnail() сам просит у JPEG-декодера уменьшенную копию,
+        # поэтому огромное фото не разворачивается в память целиком.
+        image.thumbnail(settings.IMAGE_MAX_SIZE, Image.LANCZOS)
+        image = ImageOps.exif_transpose(image)
+        content, extension = _encode(image)
+        width, height = image.size
+    stem = os.path.splitext(os.path.basename(upload.name))[0]
+    result = ContentFile(content, name=f'{stem}.{extension}')
+    return result, (width, height, result.size)
+
+
+def _widths(source_width):
+    # Ширина по умолчанию режется всегда (с увеличением, как раньше),
+    # остальные - только если картинка не меньше.
+    widths = {width for width in settings.IMAGE_VARIANT_WIDTHS
+              if width <= source_width}
+    return sorted(widths | {DEFAULT_WIDTH})
+
+
+def write_variants(name, storage=default_storage):
+    """Нарезает миниатюры для srcset; возвращает их список для реестра.
+
+    Уже существующие файлы не перезаписываются.
+    """
+    with storage.open(name) as file, Image.open(file) as image:
+        alpha = _has_alpha(image)
+        source = image.convert('RGBA' if alpha else 'RGB')
+    formats = [('PNG', 'png') if alpha else ('JPEG', 'jpg')]
+    formats += modern_formats()
+    variants = []
+    for width in _widths(source.width):
+        height = round(width * ASPECT[1] / ASPECT[0])
+        resized = ImageOps.fit(source, (width, height), Image.LANCZOS)
+        for image_format, extension in formats:
+            target = variant_name(name, width, height, extension)
+            if not storage.exists(target):
+                output = BytesIO()
+                quality = (settings.IMAGE_JPEG_QUALITY
+                           if image_format == 'JPEG'
+                           else settings.IMAGE_VARIANT_QUALITY)
+                resized.save(output, image_format, quality=quality)
+                target = storage.save(target, ContentFile(output.getvalue()))
+            variants.append({'width': width, 'height': height,
+                             'type': MIME_TYPES[image_format],
+                             'name': target})
+    return variants
+
+
+def dump_registry(name, variants):
+    return json.dumps({'source': name, 'variants': variants})
+
+
+def picture(post, storage=default_storage):
+    """Данные для <picture> картинки поста без обращений к хранилищу.
+
+    Пока миниатюры не нарезаны (или реестр от прежней картинки),
+    показывается сама картинка.
+    """
+    if not post.image:
+        return None
+    registry = (json.loads(post.image_variants)
+                if post.image_variants else {})
+    if registry.get('source') != post.image.name:
+        return {'src': post.image.url, 'sources': []}
+    by_type = {}
+    for variant in registry['variants']:
+        by_type.setdefault(variant['type'], []).append(variant)
+    fallback_type = next(iter(by_type))
+    fallback = by_type.pop(fallback_type)
+
+    def srcset(variants):
+        return ', '.join(f"{storage.url(variant['name'])} {variant['width']}w"
+                         for variant in variants)
+
+    default = next((variant for variant in fallback
+                    if variant['width'] == DEFAULT_WIDTH), fallback[-1])
+    return {
+        'src': storage.url(default['name']),
+        'srcset': srcset(fallback),
+        'sizes': SIZES,
+        'sources': [{'type': mime_type, 'srcset': srcset(variants)}
+                    for mime_type, variants in by_type.items()],
+    }
+
+
+def lock(name):
+    """Блокирует запись о файле до конца транзакции.
+
+    delete_image удаляет файл под той же блокировкой, поэтому загрузка
+    того же содержимого либо дождётся удаления и запишет файл заново,
+    либо успеет сослаться на него раньше. Вне транзакции блокировать
+    нечем.
+    """
+    blobs = ImageBlob.objects.select_for_update().filter(name=name)
+    if transaction.get_connection(blobs.db).in_atomic_block:
+        list(blobs.values_list('pk', flat=True))
+
+
+def add_ref(name):
+    """Ещё один пост ссылается на файл картинки."""
+    if not name:
+        return
+    blob, created = ImageBlob.objects.get_or_create(
+        name=name, defaults={'refs': 1})
+    if not created:
+        ImageBlob.objects.filter(name=name).update(refs=F('refs') + 1)
+
+
+def release(name):
+    """Пост больше не ссылается на файл; последняя ссылка удаляет его.
+
+    Файлы без учёта ссылок (загруженные до него) не трогаются,
+    пока recount_counters не заведёт для них записи.
+    """
+    if not name:
+        return
+    ImageBlob.objects.filter(name=name, refs__gt=0).update(
+        refs=F('refs') - 1)
+    if ImageBlob.objects.filter(name=name, refs=0).exists():
+        transaction.on_commit(lambda: delete_image(name))
+
+
+def _remove_empty_dirs(storage, directory, top):
+    """Удаляет опустевшие каталоги от directory вверх до top."""
+    while directory and directory != top:
+        try:
+            os.rmdir(storage.path(directory))
+        except OSError:
+            return
+        directory = posixpath.dirname(directory)
+
+
+def delete_image(name):
+    """Удаляет файл и его миниатюры, если на него снова не сослались.
+
+    Запись о файле блокируется на всё удаление (см. lock) и удаляется
+    вместе с ним.
+    """
+    with transaction.atomic():
+        blob = (ImageBlob.objects.select_for_update()
+                .filter(name=name).first())
+        if blob is None or blob.refs:
+            return
+        directory = f'variants/{name}'
+        storage = Post.image.field.storage
+        try:
+            storage.delete(name)
+            try:
+                _, files = default_storage.listdir(directory)
+            except FileNotFoundError:
+                # Миниатюр ещё не делали, а каталог posts/xx/ чистить
+                # всё равно нужно.
+                files = []
+            for filename in files:
+                default_storage.delete(f'{directory}/{filename}')
+            _remove_empty_dirs(default_storage, directory, 'variants')
+            _remove_empty_dirs(storage, posixpath.dirname(name),
+                               Post.image.field.upload_to.rstrip('/'))
+        except (OSError, SuspiciousFileOperation):
+            # Например, имя вне MEDIA_ROOT, записанное в обход формы.
+            logger.warning('Не удалось удалить картинку %s', name,
+                           exc_info=True)
+        blob.delete()
@@ -0,0 +1,64 @@
+"""Версии кэша лент (index, группы, профиля) и страниц постов.
+
+Версия входит в ключ {% cache %}, поэтому изменение поста или
+комментария просто переключает ленту на новый ключ, а старые фрагменты
+доживают свой срок в кэше. Время жизни фрагмента можно держать в часах.
+"""
+import time
+
+from django.core.cache import cache
+
+INDEX = 'index'
+
+
+def group_scope(group_id):
+    return f'group:{group_id}'
+
+
+def profile_scope(author_id):
+    return f'profile:{author_id}'
+
+
+def post_scope(post_id):
+    return f'post:{post_id}'
+
+
+def _key(scope):
+    return f'listing_version:{scope}'
+
+
+def get_version(scope):
+    """Текущая версия ленты; создаётся при первом обращении."""
+    version = cache.get(_key(scope))
+    if version is None:
+        cache.add(_key(scope), time.time_ns(), None)
+        version = cache.get(_key(scope), 0)
+    return version
+
+
+def get_versions(scopes):
+    """Версии нескольких лент одним обращением к кэшу."""
+    found = cache.get_many([_key(scope) for scope in scopes])
+    return [
+        found.get(_key(scope)) or get_version(scope) for scope in scopes
+    ]
+
+
+def bump_version(scope):
+    try:
+        cache.incr(_key(scope))
+    except ValueError:
+        cache.set(_key(scope), time.time_ns(), None)
+
+
+def post_scopes(post_id, author_id, *group_ids):
+    """Страница поста и ленты, в которых он показывается."""
+    scopes = {INDEX, post_scope(post_id), profile_scope(author_id)}
+    scopes.update(
+        group_scope(group_id) for group_id in group_ids if group_id)
+    return scopes
+
+
+def invalidate(scopes):
+    for scope in scopes:
+        bump_version(scope)
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.query_plans import sequential_scans, view_queries
+
+
+class Command(BaseCommand):
+    help = ('Выполняет EXPLAIN для главных запросов страниц и падает, '
+            'если какой-то из них просматривает таблицу целиком.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Печатать планы всех запросов.')
+
+    def handle(self, *args, **options):
+        failed = []
+        for name, queryset in view_queries().items():
+            plan, scans = sequential_scans(queryset)
+            if options['verbose_plans'] or scans:
+                self.stdout.write(f'{name}:\n{plan}\n')
+            if scans:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(
+                    f'{name}: полный просмотр - {"; ".join(scans)}'))
+            else:
+                self.stdout.write(f'{name}: OK')
+        if failed:
+            raise CommandError(
+                'Запросы без подходящего индекса: ' + ', '.join(failed))
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from posts.transfer import BATCH_SIZE, IMAGE_WORKERS, export_posts, open_stream
+
+
+class Command(BaseCommand):
+    help = ('Выгружает посты с комментариями и подписки в NDJSON '
+            '(*.gz - со сжатием, "-" - в stdout).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл выгрузки.')
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help='Сколько постов читать из базы за раз.')
+        parser.add_argument(
+            '--images', metavar='DIR',
+            help='Скопировать картинки постов в этот каталог.')
+        parser.add_argument(
+            '--workers', type=int, default=IMAGE_WORKERS,
+            help='Потоков для копирования картинок.')
+
+    def handle(self, *args, **options):
+        with open_stream(options['path'], 'w') as stream:
+            written = export_posts(
+                stream,
+                batch_size=options['batch_size'],
+                images_dir=options['images'],
+                workers=options['workers'],
+            )
+        if options['path'] != '-':
+            self.stdout.write(
+                self.style.SUCCESS(f'Выгружено записей: {written}'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import generate_all
+
+
+class Command(BaseCommand):
+    help = 'Заранее нарезает миниатюры для всех картинок постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Число процессов (по умолчанию - по числу ядер).')
+
+    def handle(self, *args, **options):
+        done, failed = generate_all(
+            Post.objects.all(), workers=options['workers'])
+        self.stdout.write(f'Миниатюр создано: {done}, ошибок: {failed}')
+        if not failed:
+            self.stdout.write(self.style.SUCCESS('Готово'))
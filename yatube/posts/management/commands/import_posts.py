@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from posts.transfer import BATCH_SIZE, IMAGE_WORKERS, import_posts, open_stream
+
+
+class Command(BaseCommand):
+    help = ('Загружает выгрузку export_posts: авторы и группы '
+            'сопоставляются по username и slug, уже загруженные посты '
+            'и комментарии не дублируются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл выгрузки ("-" - stdin).')
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help='Сколько записей вставлять в одной транзакции.')
+        parser.add_argument(
+            '--images', metavar='DIR',
+            help='Каталог с картинками, выгруженными export_posts.')
+        parser.add_argument(
+            '--workers', type=int, default=IMAGE_WORKERS,
+            help='Потоков для копирования картинок.')
+
+    def handle(self, *args, **options):
+        with open_stream(options['path'], 'r') as stream:
+            imported = import_posts(
+                stream,
+                batch_size=options['batch_size'],
+                images_dir=options['images'],
+                workers=options['workers'],
+            )
+        self.stdout.write(self.style.SUCCESS(f'Загружено записей: {imported}'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.counters import recount
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов, комментариев и подписок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только показать расхождения, ничего не исправляя.')
+
+    def handle(self, *args, **options):
+        drift = recount(repair=not options['check'])
+        for counter, stale in drift.items():
+            self.stdout.write(f'{counter}: {stale}')
+        if options['check'] and any(drift.values()):
+            raise CommandError('Счётчики расходятся с данными.')
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    "ALTER TABLE posts_post ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('russian', coalesce(text, ''))) STORED",
+    "CREATE INDEX posts_post_search_idx ON posts_post "
+    "USING GIN (search_vector)",
+]
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS posts_post_search_idx",
+    "ALTER TABLE posts_post DROP COLUMN IF EXISTS search_vector",
+]
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE posts_post_fts USING fts5(text)",
+    "INSERT INTO posts_post_fts (rowid, text) SELECT id, text FROM posts_post",
+]
+SQLITE_BACKWARD = [
+    "DROP TABLE IF EXISTS posts_post_fts",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        for sql in statements.get(vendor, []):
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_comment_post_created_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            run({'postgresql': POSTGRES_BACKWARD,
+                 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.16 on 2026-10-18 20:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_post_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='updated',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='Меняется вместе с постами и подписками автора', verbose_name='Изменён'),
+        ),
+    ]
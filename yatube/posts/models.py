@@ -1,10 +1,39 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from core.storage import ContentAddressedStorage
 
 User = get_user_model()
 
 
-class Group(models.Model):
+class CountedModel(models.Model):
+    """Модель с полями, которые меняются только запросами update().
+
+    save() уже сохранённой записи их не пишет: экземпляр, прочитанный
+    до нового комментария, иначе вернул бы в базу старый счётчик
+    (см. posts.counters).
+    """
+    updated_separately = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if (not args and not self._state.adding
+                and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.updated_separately
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+class Group(CountedModel):
     title = models.CharField(
         max_length=200,
         verbose_name='Заголовок',
@@ -14,19 +43,40 @@ class Group(models.Model):
         verbose_name='Группа',
         help_text='Группа, '
         'к которой будет относиться пост')
+    posts_count = models.PositiveIntegerField(
+        verbose_name='Постов в группе',
+        default=0,
+        editable=False)
+
+    updated_separately = ('posts_count',)
 
     def __str__(self):
         return self.title
 
 
-class Post(models.Model):
+class PostQuerySet(models.QuerySet):
+
+    def for_listing(self):
+        """Посты для лент: автор и группа одним запросом."""
+        return self.select_related('author', 'group').defer(
+            'author__password',
+            'author__last_login',
+            'author__is_superuser',
+            'author__email',
+            'author__is_staff',
+            'author__is_active',
+            'author__date_joined',
+            'group__description',
+        )
+
+
+class Post(CountedModel):
     text = models.TextField(
         verbose_name='Текст поста',
         help_text='Введите текст поста')
     pub_date = models.DateTimeField(
         verbose_name='Дата публикации',
-        auto_now_add=True,
-        db_index=True)
+        auto_now_add=True)
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -43,11 +93,51 @@ class Post(models.Model):
         'будет относиться пост')
     image = models.ImageField(
         upload_to='posts/',
-        blank=True
+        blank=True,
+        storage=ContentAddressedStorage()
     )
+    # Заполняет PostForm (см. posts.images): по ним не нужно
+    # открывать файл, чтобы узнать размеры.
+    image_width = models.PositiveIntegerField(
+        verbose_name='Ширина картинки',
+        null=True,
+        editable=False)
+    image_height = models.PositiveIntegerField(
+        verbose_name='Высота картинки',
+        null=True,
+        editable=False)
+    image_size = models.PositiveIntegerField(
+        verbose_name='Размер картинки, байт',
+        null=True,
+        editable=False)
+    # Миниатюры для srcset, JSON (см. posts.images.picture); читается
+    # вместе с постом, поэтому шаблон не ищет миниатюры в хранилище.
+    image_variants = models.TextField(
+        verbose_name='Миниатюры картинки',
+        blank=True,
+        default='',
+        editable=False)
+    comments_count = models.PositiveIntegerField(
+        verbose_name='Комментариев',
+        default=0,
+        editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    # Реестр миниатюр пишет фоновая нарезка (posts.thumbnails).
+    updated_separately = ('comments_count', 'image_variants')
 
     class Meta():
         ordering = ('-pub_date',)
+        # Под курсорный порядок лент (-pub_date, -id).
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_id_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -73,6 +163,12 @@ class Comment(models.Model):
         related_name='comments'
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='comment_post_created_idx'),
+        ]
+
     def __str__(self):
         return self.text
 
@@ -93,3 +189,79 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ['user', 'author']
+        # unique_together покрывает поиск по user; подписчики автора
+        # (раскладка ленты, счётчики) ищутся по author.
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+        ]
+
+
+class FeedEntry(models.Model):
+    """Пост в ленте подписок пользователя, разложенный при публикации."""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Читатель',
+        related_name='feed_entries',
+        on_delete=models.CASCADE,
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='feed_entries'
+    )
+    author = models.ForeignKey(
+        User,
+        verbose_name='Автор',
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['user', 'post']
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='feed_user_pub_date_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='feed_user_author_idx'),
+        ]
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя, которые иначе считались бы COUNT(*)."""
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        related_name='stats',
+        on_delete=models.CASCADE,
+    )
+    posts_count = models.PositiveIntegerField(
+        verbose_name='Постов',
+        default=0)
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков',
+        default=0,
+        db_index=True)
+    following_count = models.PositiveIntegerField(
+        verbose_name='Подписок',
+        default=0)
+    updated = models.DateTimeField(
+        verbose_name='Изменён',
+        help_text='Меняется вместе с постами и подписками автора',
+        default=timezone.now)
+
+
+class ImageBlob(models.Model):
+    """Сколько постов ссылается на файл картинки.
+
+    Одинаковые загрузки хранятся одним файлом (core.storage), поэтому
+    файл удаляется, только когда ссылок не осталось (posts.images).
+    """
+    name = models.CharField(
+        verbose_name='Файл',
+        max_length=100,
+        primary_key=True)
+    refs = models.PositiveIntegerField(
+        verbose_name='Ссылок',
+        default=0)
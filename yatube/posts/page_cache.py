@@ -0,0 +1,93 @@
+"""Кэш целых страниц для анонимных посетителей.
+
+Ключ страницы строится из пути, строки запроса, cookie сессии и версий
+лент из listing_cache, поэтому сигналы моделей сбрасывают ровно те
+страницы, которые показывают изменившиеся данные. Ключ служит и ETag,
+так что повторный запрос браузера получает 304 без тела.
+"""
+import hashlib
+import logging
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from . import listing_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _page_key(request, scopes):
+    versions = listing_cache.get_versions(scopes)
+    raw = '|'.join([
+        request.path,
+        request.META.get('QUERY_STRING', ''),
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME, ''),
+        *scopes,
+        *map(str, versions),
+    ])
+    return 'page:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def _finish(request, response, key, last_modified):
+    response['ETag'] = quote_etag(key)
+    response['Last-Modified'] = http_date(last_modified)
+    patch_vary_headers(response, ('Cookie',))
+    return get_conditional_response(
+        request,
+        etag=response['ETag'],
+        last_modified=last_modified,
+        response=response,
+    )
+
+
+def _store(request, response, key):
+    last_modified = int(time.time())
+    try:
+        cache.set(
+            key,
+            (response.content, response['Content-Type'], last_modified),
+            settings.PAGE_CACHE_TIMEOUT,
+        )
+    except Exception:
+        logger.warning('Кэш страниц недоступен', exc_info=True)
+        return response
+    return _finish(request, response, key, last_modified)
+
+
+def cache_anonymous_page(scopes):
+    """Кэширует ответ view для анонимов.
+
+    scopes(**kwargs) возвращает ленты, от которых зависит страница;
+    если нужного объекта нет, страница отдаётся без кэша (и view
+    сам ответит 404).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ('GET', 'HEAD')
+                    or request.user.is_authenticated):
+                return view(request, *args, **kwargs)
+            try:
+                key = _page_key(request, scopes(**kwargs))
+                entry = cache.get(key)
+            except ObjectDoesNotExist:
+                return view(request, *args, **kwargs)
+            except Exception:
+                logger.warning('Кэш страниц недоступен', exc_info=True)
+                return view(request, *args, **kwargs)
+            if entry is not None:
+                content, content_type, last_modified = entry
+                response = HttpResponse(content, content_type=content_type)
+                return _finish(request, response, key, last_modified)
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200 or response.streaming:
+                return response
+            return _store(request, response, key)
+        return wrapper
+    return decorator
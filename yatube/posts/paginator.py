@@ -0,0 +1,276 @@
+import base64
+import json
+from types import SimpleNamespace
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Page, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.http import HttpResponseRedirect
+from django.utils.functional import cached_property
+
+# Старые ссылки ?page=N дальше этой страницы перенаправляются на токен:
+# OFFSET остаётся только у первых страниц.
+LEGACY_PAGES = 5
+
+
+class PageMoved(Exception):
+    """Старый номер страницы заменён ссылкой с токеном (см. paginate)."""
+
+    def __init__(self, url):
+        super().__init__(url)
+        self.url = url
+
+
+class CursorPaginator(Paginator):
+    """Постраничный вывод по ключу (pub_date, id).
+
+    Следующая страница выбирается условием WHERE по последней записи
+    текущей страницы, поэтому не нужны ни OFFSET, ни COUNT(*):
+    сотая страница стоит столько же, сколько первая.
+    """
+    # Записи страницы читаются при первом обращении (см. CursorPage).
+    lazy_pages = True
+
+    def __init__(self, object_list, per_page,
+                 ordering=('-pub_date', '-id'), approximate_count=False):
+        self.ordering = tuple(ordering)
+        self.approximate_count = approximate_count
+        super().__init__(object_list.order_by(*self.ordering), per_page)
+
+    @cached_property
+    def estimated_count(self):
+        """Оценка планировщика PostgreSQL; на других базах - None.
+
+        Точный COUNT(*) ради подписи под лентой не считаем.
+        """
+        connection = connections[self.object_list.db]
+        if not self.approximate_count or connection.vendor != 'postgresql':
+            return None
+        sql, params = self.object_list.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def _fields(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def _model_field(self, name):
+        """Поле модели или None для аннотации (например, rank поиска)."""
+        try:
+            return self.object_list.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def encode_cursor(self, obj):
+        """Непрозрачный токен с ключом сортировки записи.
+
+        obj - экземпляр модели или словарь из values().
+        """
+        if isinstance(obj, dict):
+            obj = SimpleNamespace(**obj)
+        values = []
+        for name in self._fields():
+            field = self._model_field(name)
+            values.append(
+                field.value_to_string(obj) if field else getattr(obj, name))
+        raw = json.dumps(values).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Ключ сортировки из токена или None, если токен испорчен."""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(raw.decode())
+            if len(values) != len(self.ordering):
+                return None
+            decoded = []
+            for name, value in zip(self._fields(), values):
+                field = self._model_field(name)
+                if field is None and not isinstance(value, (int, float)):
+                    return None
+                decoded.append(field.to_python(value) if field else value)
+            return decoded
+        except (ValueError, TypeError, ValidationError):
+            return None
+
+    def _keyset_filter(self, values, backwards, names=None):
+        """Условие "строго после ключа" в порядке ordering.
+
+        names - поля ключа, если в запросе они называются иначе.
+        """
+        names = names or self._fields()
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            descending = field.startswith('-') != backwards
+            lookup = f'{names[i]}__lt' if descending else f'{names[i]}__gt'
+            step = Q(**{lookup: values[i]})
+            for prev_name, prev_value in zip(names[:i], values):
+                step &= Q(**{prev_name: prev_value})
+            condition |= step
+        return condition
+
+    def _reversed_ordering(self):
+        return [
+            field[1:] if field.startswith('-') else f'-{field}'
+            for field in self.ordering
+        ]
+
+    def _fetch(self, values, backwards, offset, limit):
+        """Записи после ключа values (или с начала) в порядке чтения."""
+        queryset = self.object_list
+        if values is not None:
+            queryset = queryset.filter(
+                self._keyset_filter(values, backwards))
+            if backwards:
+                queryset = queryset.order_by(*self._reversed_ordering())
+        return list(queryset[offset:offset + limit])
+
+    def cursor_before_page(self, number):
+        """Токен after для старой страницы number или '', если её нет.
+
+        Читаются только столбцы ключа одной записи.
+        """
+        offset = (number - 1) * self.per_page
+        keys = list(self.object_list.values(*self._fields())[
+            offset - 1:offset])
+        return self.encode_cursor(keys[0]) if keys else ''
+
+    def get_page(self, number=None, after=None, before=None):
+        """Страница по токену after/before или по старому номеру ?page=."""
+        limit = self.per_page
+        has_previous = False
+        has_next = False
+        cursor = ''
+        values = None
+        backwards = False
+        if after:
+            values = self.decode_cursor(after)
+            if values is not None:
+                cursor = f'after={after}'
+                has_previous = True
+        elif before:
+            values = self.decode_cursor(before)
+            if values is not None:
+                cursor = f'before={before}'
+                has_next = True
+                backwards = True
+        if values is None:
+            try:
+                number = max(int(number), 1)
+            except (TypeError, ValueError):
+                number = 1
+            has_previous = number > 1
+        else:
+            number = 1
+
+        offset = 0 if values is not None else (number - 1) * limit
+
+        def load():
+            objects = self._fetch(values, backwards, offset, limit + 1)
+            more = len(objects) > limit
+            objects = objects[:limit]
+            if backwards:
+                objects.reverse()
+                return objects, has_next, more
+            return objects, more, has_previous
+
+        page = CursorPage(load, number, self, cursor)
+        return page if self.lazy_pages else page.evaluated()
+
+
+class CursorPage(Page):
+    """Страница, которая читает записи при первом обращении к ним.
+
+    Номер и токен известны сразу, а шаблон по ним ищет кэшированный
+    фрагмент ленты: если он найден, запроса к базе нет вовсе.
+    """
+
+    def __init__(self, load, number, paginator, cursor=''):
+        self._load = load
+        self.number = number
+        self.paginator = paginator
+        self.cursor = cursor
+
+    @cached_property
+    def _loaded(self):
+        objects, has_next, has_previous = self._load()
+        encode = self.paginator.encode_cursor
+        return (
+            objects,
+            encode(objects[-1]) if has_next and objects else '',
+            encode(objects[0]) if has_previous and objects else '',
+        )
+
+    @property
+    def object_list(self):
+        return self._loaded[0]
+
+    @property
+    def next_cursor(self):
+        return self._loaded[1]
+
+    @property
+    def previous_cursor(self):
+        return self._loaded[2]
+
+    def evaluated(self):
+        """Обычная Page с уже прочитанными записями."""
+        page = Page(self.object_list, self.number, self.paginator)
+        page.cursor = self.cursor
+        page.next_cursor = self.next_cursor
+        page.previous_cursor = self.previous_cursor
+        return page
+
+    def has_next(self):
+        return bool(self.next_cursor)
+
+    def has_previous(self):
+        return bool(self.previous_cursor)
+
+
+def _legacy_number(request):
+    try:
+        return int(request.GET.get('page'))
+    except (TypeError, ValueError):
+        return None
+
+
+def paginate(request, queryset, per_page, paginator_class=CursorPaginator,
+             **kwargs):
+    """Страница ленты по параметрам ?after=, ?before= или ?page=.
+
+    ?page= дальше LEGACY_PAGES вызывает PageMoved с адресом той же
+    страницы по токену (или первой, если такой страницы нет).
+    """
+    paginator = paginator_class(queryset, per_page, **kwargs)
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    number = _legacy_number(request)
+    if not (after or before) and number and number > LEGACY_PAGES:
+        query = request.GET.copy()
+        del query['page']
+        cursor = paginator.cursor_before_page(number)
+        if cursor:
+            query['after'] = cursor
+        raise PageMoved(f'{request.path}?{query.urlencode()}'
+                        if query else request.path)
+    return paginator.get_page(number, after=after, before=before)
+
+
+class LegacyPageMiddleware:
+    """Отвечает перенаправлением на PageMoved из view."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, PageMoved):
+            return HttpResponseRedirect(exception.url)
+        return None
@@ -0,0 +1,69 @@
+"""Планы основных запросов страниц: нет ли полного просмотра таблиц.
+
+Запросы строятся так же, как во view (тот же курсорный порядок и
+LIMIT), а параметры берутся из существующих записей. На PostgreSQL
+последовательное сканирование запрещается на время EXPLAIN: если
+Seq Scan в плане всё равно остался, подходящего индекса нет вовсе,
+и результат не зависит от размера таблиц.
+"""
+from django.db import connections, transaction
+
+from .feed import feed_entries
+from .models import Comment, Follow, Group, Post, User
+from .paginator import CursorPaginator
+
+PER_PAGE = 10
+
+
+def _page_query(queryset, ordering=('-pub_date', '-id')):
+    paginator = CursorPaginator(queryset, PER_PAGE, ordering=ordering)
+    return paginator.object_list[:PER_PAGE + 1]
+
+
+def view_queries():
+    """Имя view -> главный запрос страницы."""
+    group_id = Group.objects.values_list('pk', flat=True).first() or 0
+    author_id = Post.objects.values_list('author_id', flat=True).first() or 0
+    post_id = Comment.objects.values_list('post_id', flat=True).first() or 0
+    reader = (User.objects.filter(pk__in=Follow.objects.values('user_id'))
+              .first() or User(pk=0))
+    return {
+        'posts:index': _page_query(Post.objects.for_listing()),
+        'posts:group_list': _page_query(
+            Post.objects.filter(group_id=group_id).for_listing()),
+        'posts:profile': _page_query(
+            Post.objects.filter(author_id=author_id).for_listing()),
+        'posts:follow_index': feed_entries(reader).values_list(
+            'pub_date', 'post_id')[:PER_PAGE + 1],
+        'posts:post_detail': _page_query(
+            Comment.objects.filter(post_id=post_id).select_related('author'),
+            ordering=('created', 'id')),
+        'feed fan-out': Follow.objects.filter(
+            author_id=author_id).values_list('user_id', flat=True),
+    }
+
+
+def _sqlite_scans(plan):
+    """Строки EXPLAIN QUERY PLAN вида "SCAN таблица" без индекса."""
+    return [
+        line.strip() for line in plan.splitlines()
+        if 'SCAN' in line and ' USING ' not in line
+        and 'CONSTANT ROW' not in line
+    ]
+
+
+def sequential_scans(queryset):
+    """План запроса и список полных просмотров таблиц в нём."""
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        with transaction.atomic(using=queryset.db):
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+        scans = [line.strip() for line in plan.splitlines()
+                 if 'Seq Scan' in line]
+        return plan, scans
+    if connection.vendor == 'sqlite':
+        plan = queryset.explain()
+        return plan, _sqlite_scans(plan)
+    return queryset.explain(), []
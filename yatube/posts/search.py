@@ -0,0 +1,93 @@
+"""Полнотекстовый поиск по постам.
+
+На PostgreSQL текст индексируется вычисляемой колонкой search_vector
+с GIN-индексом, на SQLite - отдельной таблицей FTS5, которую
+обновляют сигналы Post (всегда в основной базе, как и сам пост).
+Результаты отсортированы по релевантности
+(rank) и листаются курсором по (rank, id).
+"""
+from django.db import connections, router
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'posts_post_fts'
+
+
+def _vendor(alias=None):
+    return connections[alias or Post.objects.db].vendor
+
+
+def _write_alias(post=None):
+    """База, куда записан пост: чтения могут идти с реплики."""
+    if post is not None and post._state.db:
+        return post._state.db
+    return router.db_for_write(Post)
+
+
+def _fts_query(query):
+    """Слова запроса как фразы FTS5, чтобы не разбирать его синтаксис."""
+    return ' '.join(
+        '"{}"'.format(word.replace('"', '""')) for word in query.split())
+
+
+def search_posts(query):
+    """Посты, подходящие под запрос, с аннотацией rank."""
+    posts = Post.objects.for_listing()
+    table = Post._meta.db_table
+    vendor = _vendor()
+    if vendor == 'postgresql':
+        tsquery = 'plainto_tsquery(%s::regconfig, %s)'
+        params = [SEARCH_CONFIG, query]
+        return posts.annotate(rank=RawSQL(
+            f'ts_rank({table}.search_vector, {tsquery})', params,
+            output_field=FloatField(),
+        )).extra(
+            where=[f'{table}.search_vector @@ {tsquery}'], params=params)
+    if vendor == 'sqlite':
+        match = _fts_query(query)
+        return posts.annotate(rank=RawSQL(
+            f'(SELECT -rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'AND rowid = {table}.id)', [match],
+            output_field=FloatField(),
+        )).extra(
+            where=[f'{table}.id IN (SELECT rowid FROM {FTS_TABLE} '
+                   f'WHERE {FTS_TABLE} MATCH %s)'],
+            params=[match])
+    return posts.filter(text__icontains=query).annotate(rank=RawSQL(
+        '0', [], output_field=FloatField()))
+
+
+def index_post(post):
+    """Обновляет запись поста в таблице FTS5 (нужно только SQLite)."""
+    alias = _write_alias(post)
+    if _vendor(alias) != 'sqlite':
+        return
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+            [post.pk, post.text])
+
+
+def unindex_post(post_id, alias=None):
+    alias = alias or _write_alias()
+    if _vendor(alias) != 'sqlite':
+        return
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id])
+
+
+def rebuild_index():
+    """Заново заполняет таблицу FTS5 из posts_post."""
+    alias = _write_alias()
+    if _vendor(alias) != 'sqlite':
+        return
+    table = Post._meta.db_table
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) '
+            f'SELECT id, text FROM {table}')
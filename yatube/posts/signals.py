@@ -0,0 +1,157 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from core.storage import ContentAddressedStorage, file_claimed
+
+from . import counters, feed, follow_graph, images, listing_cache, search
+from .models import Comment, Follow, Group, Post
+
+
+@receiver(post_init, sender=Post)
+def remember_post_group(sender, instance, **kwargs):
+    instance._loaded_group_id = instance.group_id
+
+
+@receiver(post_init, sender=Post)
+def remember_post_image(sender, instance, **kwargs):
+    # Сырое значение из базы: через дескриптор вышел бы лишний FieldFile.
+    # None - поле отложено, прежняя картинка неизвестна.
+    image = instance.__dict__.get('image')
+    instance._loaded_image = getattr(image, 'name', image)
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, **kwargs):
+    if created:
+        counters.add_to_user(instance.author_id, 'posts_count', 1)
+        counters.add_to_group(instance.group_id, 1)
+    else:
+        counters.touch_user(instance.author_id)
+        if instance.group_id != instance._loaded_group_id:
+            counters.add_to_group(instance._loaded_group_id, -1)
+            counters.add_to_group(instance.group_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.add_to_user(instance.author_id, 'posts_count', -1)
+    counters.add_to_group(instance._loaded_group_id, -1)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, **kwargs):
+    if created:
+        feed.fan_out_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, **kwargs):
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, **kwargs):
+    search.unindex_post(instance.pk, instance._state.db)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_listings(sender, instance, **kwargs):
+    listing_cache.invalidate(listing_cache.post_scopes(
+        instance.pk, instance.author_id, instance.group_id,
+        instance._loaded_group_id))
+    instance._loaded_group_id = instance.group_id
+
+
+@receiver(post_save, sender=Post)
+def count_image_refs(sender, instance, created, **kwargs):
+    image = instance.image.name or ''
+    if created:
+        images.add_ref(image)
+    elif instance._loaded_image is not None:
+        if image != (instance._loaded_image or ''):
+            images.add_ref(image)
+            images.release(instance._loaded_image)
+    instance._loaded_image = image
+
+
+@receiver(file_claimed, sender=ContentAddressedStorage)
+def lock_claimed_image(sender, name, **kwargs):
+    images.lock(name)
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    images.release(instance.image.name)
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.add_to_post(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.add_to_post(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_listings(sender, instance, **kwargs):
+    post = Post.objects.filter(pk=instance.post_id).values_list(
+        'pk', 'author_id', 'group_id').first()
+    if post is not None:
+        listing_cache.invalidate(listing_cache.post_scopes(*post))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_listing(sender, instance, **kwargs):
+    listing_cache.invalidate([listing_cache.group_scope(instance.pk)])
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_profiles(sender, instance, **kwargs):
+    listing_cache.invalidate([
+        listing_cache.profile_scope(instance.author_id),
+        listing_cache.profile_scope(instance.user_id),
+    ])
+
+
+@receiver(post_save, sender=Follow)
+def update_follow_graph(sender, instance, created, **kwargs):
+    if created:
+        follow_graph.changed(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def update_follow_graph_on_delete(sender, instance, **kwargs):
+    follow_graph.changed(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+def count_saved_follow(sender, instance, created, **kwargs):
+    if created:
+        counters.add_to_user(instance.author_id, 'followers_count', 1)
+        counters.add_to_user(instance.user_id, 'following_count', 1)
+        feed.follower_gained(instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    counters.add_to_user(instance.author_id, 'followers_count', -1)
+    counters.add_to_user(instance.user_id, 'following_count', -1)
+    feed.follower_lost(instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_follow_feed(sender, instance, created, **kwargs):
+    if created:
+        feed.backfill_feed(instance.user, instance.author)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_follow_feed(sender, instance, **kwargs):
+    feed.prune_feed(instance.user, instance.author)
@@ -0,0 +1,11 @@
+from django import template
+
+from posts import images
+
+register = template.Library()
+
+
+@register.inclusion_tag('posts/includes/picture.html')
+def post_image(post):
+    """Картинка поста со srcset по реестру миниатюр (Post.image_variants)."""
+    return {'picture': images.picture(post)}
@@ -0,0 +1,104 @@
+import json
+from http import HTTPStatus
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+class ReadApiTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='api', description='Описание')
+        Post.objects.bulk_create([
+            Post(author=cls.author, group=cls.group, text=f'Пост {i}')
+            for i in range(25)
+        ])
+        cls.post = Post.objects.create(author=cls.reader, text='Последний')
+        for i in range(3):
+            Comment.objects.create(
+                author=cls.author, post=cls.post, text=f'Ответ {i}')
+
+    def test_post_list_is_cursor_paginated(self):
+        url = reverse('api:post_list')
+        data = self.client.get(url, {'limit': 10}).json()
+        self.assertEqual(len(data['results']), 10)
+        self.assertEqual(data['results'][0]['id'], self.post.pk)
+        self.assertIsNone(data['previous'])
+        seen = [post['id'] for post in data['results']]
+        while data['next']:
+            data = self.client.get(
+                url, {'limit': 10, 'after': data['next']}).json()
+            seen += [post['id'] for post in data['results']]
+        self.assertEqual(len(seen), 26)
+        self.assertEqual(len(set(seen)), 26)
+
+    def test_post_fields(self):
+        with self.assertNumQueries(1):
+            data = self.client.get(reverse('api:post_list')).json()
+        self.assertEqual(data['results'][0], {
+            'id': self.post.pk,
+            'text': 'Последний',
+            'pub_date': data['results'][0]['pub_date'],
+            'author': 'reader',
+            'group': None,
+            'image': None,
+            'comments_count': 3,
+        })
+
+    def test_group_and_author_lists(self):
+        urls = {
+            reverse('api:group_posts', kwargs={'slug': 'api'}): 20,
+            reverse('api:author_posts', kwargs={'username': 'reader'}): 1,
+        }
+        for url, expected in urls.items():
+            with self.subTest(url=url):
+                self.assertEqual(
+                    len(self.client.get(url).json()['results']), expected)
+        missing = reverse('api:group_posts', kwargs={'slug': 'missing'})
+        self.assertEqual(
+            self.client.get(missing).status_code, HTTPStatus.NOT_FOUND)
+
+    def test_follow_feed_requires_login(self):
+        url = reverse('api:follow_feed')
+        self.assertEqual(
+            self.client.get(url).status_code, HTTPStatus.UNAUTHORIZED)
+        Follow.objects.create(user=self.author, author=self.reader)
+        self.client.force_login(self.author)
+        results = self.client.get(url).json()['results']
+        self.assertEqual([post['id'] for post in results], [self.post.pk])
+
+    def test_post_detail_with_comments(self):
+        url = reverse('api:post_detail', kwargs={'post_id': self.post.pk})
+        data = self.client.get(url, {'limit': 2}).json()
+        self.assertEqual(
+            [comment['text'] for comment in data['comments']['results']],
+            ['Ответ 0', 'Ответ 1'])
+        comments = self.client.get(
+            reverse('api:post_comments', kwargs={'post_id': self.post.pk}),
+            {'limit': 2, 'after': data['comments']['next']},
+        ).json()
+        self.assertEqual(
+            [comment['text'] for comment in comments['results']],
+            ['Ответ 2'])
+
+    def test_export_streams_all_posts(self):
+        response = self.client.get(
+            reverse('api:post_export'), {'group': 'api'})
+        self.assertTrue(response.streaming)
+        posts = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(posts), 25)
+        self.assertEqual(posts[0]['group'], 'api')
+
+    def test_read_only(self):
+        response = self.client.post(reverse('api:post_list'))
+        self.assertEqual(
+            response.status_code, HTTPStatus.METHOD_NOT_ALLOWED)
@@ -1,14 +1,21 @@
+import hashlib
 from http import HTTPStatus
+from io import BytesIO
 import shutil
 import tempfile
+from unittest import mock
 from django.conf import settings
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from posts.models import Group, Post, Comment, User
 from posts.forms import PostForm
+from posts import images, thumbnails
+from PIL import Image
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+DIGEST_NAME = r'^posts/([0-9a-f]{2})/\1[0-9a-f]{62}'
 
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
@@ -33,6 +40,7 @@ class PostFormsTests(TestCase):
     def tearDownClass(cls):
         super().tearDownClass()
         shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        shutil.rmtree(TEMP_MEDIA_ROOT + '_incoming', ignore_errors=True)
 
     def setUp(self):
         self.authorized_client = Client()
@@ -73,8 +81,11 @@ class PostFormsTests(TestCase):
         new_post = Post.objects.order_by('pk').last()
         self.assertEqual(new_post.text, form_data['text'])
         self.assertEqual(new_post.group.pk, form_data['group'])
+        # Файл назван по SHA-256 содержимого (core.storage).
+        self.uploaded.seek(0)
+        digest = hashlib.sha256(self.uploaded.read()).hexdigest()
         self.assertEqual(new_post.image.name,
-                         'posts/' + form_data['image'].name)
+                         f'posts/{digest[:2]}/{digest}.gif')
 
     def test_post_edit(self):
         count = Post.objects.all().count()
@@ -133,3 +144,201 @@ class PostFormsTests(TestCase):
             'Загрузите правильное изображение. Файл, который вы загрузили,'
             ' поврежден или не является изображением.'
         )
+
+    def test_image_thumbnail_is_scheduled(self):
+        """Миниатюра новой картинки ставится в фоновую очередь."""
+        self.uploaded.name = 'scheduled.gif'
+        with mock.patch('posts.forms.transaction.on_commit',
+                        side_effect=lambda callback: callback()), \
+                mock.patch('posts.forms.thumbnails.schedule') as schedule:
+            self.author_client.post(
+                reverse('posts:post_create'),
+                data={'text': 'Пост с картинкой', 'image': self.uploaded}
+            )
+        post = Post.objects.get(text='Пост с картинкой')
+        schedule.assert_called_once_with(post.image.name)
+
+    @override_settings(THUMBNAIL_WORKERS=0)
+    def test_thumbnails_without_workers_are_made_at_once(self):
+        post = Post.objects.create(
+            author=self.author, text='Сразу',
+            image=SimpleUploadedFile('now.gif', self.uploaded.read()))
+        with mock.patch.object(thumbnails, 'get_executor') as executor:
+            future = thumbnails.schedule(post.image.name)
+        executor.assert_not_called()
+        self.assertTrue(future.result())
+        post.refresh_from_db()
+        self.assertNotEqual(post.image_variants, '')
+
+    def test_post_without_image_schedules_nothing(self):
+        with mock.patch('posts.forms.transaction.on_commit',
+                        side_effect=lambda callback: callback()), \
+                mock.patch('posts.forms.thumbnails.schedule') as schedule:
+            self.author_client.post(
+                reverse('posts:post_create'),
+                data={'text': 'Пост без картинки'}
+            )
+        schedule.assert_not_called()
+
+    def test_generate_thumbnail(self):
+        self.uploaded.name = 'thumb.gif'
+        post = Post.objects.create(
+            text='Пост', author=self.author, image=self.uploaded)
+        self.assertTrue(thumbnails.generate(post.image.name))
+
+
+def photo(name, size, orientation=None, mode='RGB', image_format='JPEG'):
+    image = Image.new(mode, size, color='red')
+    exif = Image.Exif()
+    exif[0x010f] = 'Телефон'
+    if orientation:
+        exif[images.ORIENTATION] = orientation
+    file_obj = BytesIO()
+    options = {'exif': exif} if image_format == 'JPEG' else {}
+    image.save(file_obj, image_format, **options)
+    return SimpleUploadedFile(name, file_obj.getvalue(),
+                              content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_MAX_SIZE=(100, 100))
+class ImagePipelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='photographer')
+
+    def setUp(self):
+        self.client.force_login(self.author)
+
+    def create(self, upload):
+        self.client.post(reverse('posts:post_create'),
+                         data={'text': 'Фото', 'image': upload})
+        return Post.objects.get(author=self.author)
+
+    def test_large_photo_is_shrunk_and_stripped(self):
+        post = self.create(photo('phone.jpg', (400, 200), orientation=6))
+        self.assertRegex(post.image.name, DIGEST_NAME + r'\.jpg$')
+        # Поворот из EXIF применён к пикселям, затем уменьшение.
+        self.assertEqual((post.image_width, post.image_height), (50, 100))
+        self.assertEqual(post.image_size, post.image.size)
+        with Image.open(post.image) as stored:
+            self.assertEqual(stored.size, (50, 100))
+            self.assertNotIn('exif', stored.info)
+            self.assertFalse(stored.getexif())
+
+    def test_small_clean_image_is_kept(self):
+        upload = photo('clean.png', (20, 10), image_format='PNG')
+        original = upload.read()
+        upload.seek(0)
+        post = self.create(upload)
+        self.assertRegex(post.image.name, DIGEST_NAME + r'\.png$')
+        self.assertEqual(post.image.read(), original)
+        self.assertEqual(
+            (post.image_width, post.image_height, post.image_size),
+            (20, 10, len(original)))
+
+    def test_only_real_animations_are_kept(self):
+        frames = BytesIO()
+        Image.new('RGB', (10, 10), 'red').save(
+            frames, 'GIF', save_all=True,
+            append_images=[Image.new('RGB', (10, 10), 'blue')])
+        with Image.open(frames) as gif:
+            self.assertTrue(images._is_animated(gif))
+        # Фото MPO с телефона: второй кадр - не анимация.
+        mpo = mock.Mock(format='MPO', n_frames=2, is_animated=True)
+        self.assertFalse(images._is_animated(mpo))
+
+    def test_transparent_image_stays_png(self):
+        post = self.create(photo('logo.png', (300, 300), mode='RGBA',
+                                 image_format='PNG'))
+        self.assertRegex(post.image.name, DIGEST_NAME + r'\.png$')
+        with Image.open(post.image) as stored:
+            self.assertEqual((stored.format, stored.mode, stored.size),
+                             ('PNG', 'RGBA', (100, 100)))
+
+    def test_other_formats_become_jpeg(self):
+        post = self.create(photo('scan.bmp', (30, 30), image_format='BMP'))
+        self.assertRegex(post.image.name, DIGEST_NAME + r'\.jpg$')
+
+    def test_edit_without_new_image_keeps_dimensions(self):
+        post = self.create(photo('phone.jpg', (400, 200)))
+        self.client.post(
+            reverse('posts:post_edit', kwargs={'post_id': post.pk}),
+            data={'text': 'Новый текст'})
+        post.refresh_from_db()
+        self.assertEqual((post.text, post.image_width, post.image_height),
+                         ('Новый текст', 100, 50))
+
+    def test_clearing_image_clears_dimensions(self):
+        post = self.create(photo('phone.jpg', (400, 200)))
+        self.client.post(
+            reverse('posts:post_edit', kwargs={'post_id': post.pk}),
+            data={'text': 'Без картинки', 'image-clear': 'on'})
+        post.refresh_from_db()
+        self.assertEqual((post.image.name, post.image_width, post.image_size),
+                         ('', None, None))
+
+    def test_variants_for_srcset(self):
+        """Миниатюры всех ширин не больше картинки (PNG вместо WebP)."""
+        name = default_storage.save('posts/wide.jpg',
+                                    photo('wide.jpg', (1000, 500)))
+        with mock.patch.object(images, 'modern_formats',
+                               return_value=[('PNG', 'png')]):
+            variants = images.write_variants(name)
+        self.assertEqual(
+            [(variant['width'], variant['height'], variant['type'])
+             for variant in variants],
+            [(480, 170, 'image/jpeg'), (480, 170, 'image/png'),
+             (960, 339, 'image/jpeg'), (960, 339, 'image/png')])
+        for variant in variants:
+            with Image.open(default_storage.open(variant['name'])) as stored:
+                self.assertEqual(stored.size,
+                                 (variant['width'], variant['height']))
+
+    def test_small_image_gets_default_width(self):
+        name = default_storage.save('posts/tiny.jpg',
+                                    photo('tiny.jpg', (20, 20)))
+        with mock.patch.object(images, 'modern_formats', return_value=[]):
+            variants = images.write_variants(name)
+        self.assertEqual([(variant['width'], variant['height'])
+                          for variant in variants], [(960, 339)])
+
+    def test_existing_variants_are_not_rewritten(self):
+        name = default_storage.save('posts/again.jpg',
+                                    photo('again.jpg', (20, 20)))
+        first = images.write_variants(name)
+        with mock.patch.object(default_storage, 'save') as save:
+            self.assertEqual(images.write_variants(name), first)
+        save.assert_not_called()
+
+    def test_registry_is_saved_to_posts(self):
+        post = self.create(photo('registry.jpg', (400, 200)))
+        self.assertTrue(thumbnails.generate(post.image.name))
+        post.refresh_from_db()
+        picture = images.picture(post)
+        self.assertIn('960w', picture['srcset'])
+        self.assertTrue(picture['src'].endswith('/960x339.jpg'))
+
+    def test_edit_keeps_registry_saved_meanwhile(self):
+        """Правка поста, прочитанного до нарезки, не стирает реестр."""
+        post = self.create(photo('slow.jpg', (400, 200)))
+        stale_post = Post.objects.get(pk=post.pk)
+        thumbnails.generate(post.image.name)
+        form = PostForm({'text': 'Правка'}, instance=stale_post)
+        self.assertTrue(form.is_valid())
+        form.save()
+        post.refresh_from_db()
+        self.assertEqual(post.text, 'Правка')
+        self.assertNotEqual(post.image_variants, '')
+        self.assertEqual((post.image_width, post.image_height), (100, 50))
+
+    def test_new_image_drops_old_registry(self):
+        post = self.create(photo('first.jpg', (400, 200)))
+        thumbnails.generate(post.image.name)
+        self.client.post(
+            reverse('posts:post_edit', kwargs={'post_id': post.pk}),
+            data={'text': 'Фото', 'image': photo('second.jpg', (400, 200))})
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants, '')
+        self.assertEqual(images.picture(post),
+                         {'src': post.image.url, 'sources': []})
@@ -1,6 +1,24 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
-from posts.models import Group, Post
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from posts import follow_graph, images, listing_cache, search
+from posts.counters import recount, user_stats
+from posts.forms import PostForm
+from posts.models import (
+    Comment, FeedEntry, Follow, Group, ImageBlob, Post, UserStats)
 
 User = get_user_model()
 
@@ -49,3 +67,405 @@ class PostModelTest(TestCase):
             with self.subTest(field=field):
                 self.assertEqual(
                     post._meta.get_field(field).help_text, expected_value)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа',
+            slug='counters',
+            description='Описание',
+        )
+        cls.other_group = Group.objects.create(
+            title='Другая группа',
+            slug='other',
+            description='Описание',
+        )
+
+    def test_post_and_comment_counters(self):
+        post = Post.objects.create(
+            author=self.author, text='Пост', group=self.group)
+        Comment.objects.create(author=self.reader, post=post, text='1')
+        Comment.objects.create(author=self.reader, post=post, text='2')
+        post.refresh_from_db()
+        self.group.refresh_from_db()
+        self.assertEqual(user_stats(self.author.pk).posts_count, 1)
+        self.assertEqual(self.group.posts_count, 1)
+        self.assertEqual(post.comments_count, 2)
+        post.group = self.other_group
+        post.save()
+        self.group.refresh_from_db()
+        self.other_group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(self.other_group.posts_count, 1)
+        post.delete()
+        self.other_group.refresh_from_db()
+        self.assertEqual(user_stats(self.author.pk).posts_count, 0)
+        self.assertEqual(self.other_group.posts_count, 0)
+
+    def test_edit_keeps_counters_that_changed_meanwhile(self):
+        """Правка поста, прочитанного до комментария, не сбрасывает счётчик."""
+        post = Post.objects.create(
+            author=self.author, text='Пост', group=self.group)
+        stale_post = Post.objects.get(pk=post.pk)
+        stale_group = Group.objects.get(pk=self.group.pk)
+        Comment.objects.create(author=self.reader, post=post, text='1')
+        form = PostForm({'text': 'Правка', 'group': self.group.pk},
+                        instance=stale_post)
+        self.assertTrue(form.is_valid())
+        form.save()
+        stale_group.title = 'Новое название'
+        stale_group.save()
+        post.refresh_from_db()
+        self.group.refresh_from_db()
+        self.assertEqual(post.text, 'Правка')
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.group.title, 'Новое название')
+        self.assertEqual(self.group.posts_count, 1)
+
+    def test_counter_below_zero_is_logged(self):
+        post = Post.objects.create(author=self.author, text='Пост')
+        comment = Comment.objects.create(
+            author=self.reader, post=post, text='1')
+        Post.objects.filter(pk=post.pk).update(comments_count=0)
+        with self.assertLogs('posts.counters', 'WARNING'):
+            comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+
+    def test_follow_counters(self):
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(user_stats(self.author.pk).followers_count, 1)
+        self.assertEqual(user_stats(self.reader.pk).following_count, 1)
+        follow.delete()
+        self.assertEqual(user_stats(self.author.pk).followers_count, 0)
+        self.assertEqual(user_stats(self.reader.pk).following_count, 0)
+
+    def test_recount_repairs_drift(self):
+        Post.objects.create(author=self.author, text='Пост', group=self.group)
+        UserStats.objects.filter(user=self.author).update(posts_count=7)
+        Group.objects.filter(pk=self.group.pk).update(posts_count=3)
+        with self.assertRaises(CommandError):
+            call_command('recount_counters', '--check', stdout=StringIO())
+        call_command('recount_counters', stdout=StringIO())
+        self.group.refresh_from_db()
+        self.assertEqual(user_stats(self.author.pk).posts_count, 1)
+        self.assertEqual(self.group.posts_count, 1)
+        call_command('recount_counters', '--check', stdout=StringIO())
+
+    def test_recount_touches_only_repaired_rows(self):
+        Post.objects.create(author=self.author, text='Пост')
+        user_stats(self.reader.pk)
+        old = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        UserStats.objects.update(updated=old)
+        UserStats.objects.filter(user=self.author).update(posts_count=7)
+        recount()
+        self.assertEqual(user_stats(self.author.pk).posts_count, 1)
+        self.assertGreater(user_stats(self.author.pk).updated, old)
+        self.assertEqual(user_stats(self.reader.pk).updated, old)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(dir=settings.BASE_DIR))
+class TransferCommandsTest(TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.addCleanup(
+            shutil.rmtree, settings.MEDIA_ROOT, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT + '_incoming',
+                        ignore_errors=True)
+        author = User.objects.create_user(username='author')
+        reader = User.objects.create_user(username='reader')
+        group = Group.objects.create(
+            title='Группа', slug='transfer', description='Описание')
+        self.pub_date = datetime(2020, 5, 1, 12, 0, tzinfo=timezone.utc)
+        post = Post.objects.create(
+            author=author, group=group, text='Пост про котиков',
+            image=ContentFile(b'gif', name='cat.gif'))
+        Post.objects.filter(pk=post.pk).update(pub_date=self.pub_date)
+        Post.objects.create(author=reader, text='Второй пост')
+        Comment.objects.create(author=reader, post=post, text='Мяу')
+        Follow.objects.create(user=reader, author=author)
+
+    def export(self, *args):
+        path = os.path.join(self.workdir, 'posts.ndjson.gz')
+        call_command('export_posts', path, *args, stdout=StringIO())
+        return path
+
+    def test_round_trip_to_empty_database(self):
+        images = os.path.join(self.workdir, 'images')
+        path = self.export('--images', images)
+        image_name = Post.objects.exclude(image='').get().image.name
+        self.assertTrue(os.path.exists(os.path.join(images, image_name)))
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        os.remove(os.path.join(settings.MEDIA_ROOT, image_name))
+
+        call_command('import_posts', path, '--images', images,
+                     '--batch-size', '1', stdout=StringIO())
+
+        post = Post.objects.get(text='Пост про котиков')
+        self.assertEqual(post.author.username, 'author')
+        self.assertEqual(post.group.slug, 'transfer')
+        self.assertEqual(post.pub_date, self.pub_date)
+        self.assertEqual(post.comments_count, 1)
+        self.assertTrue(post.image.storage.exists(post.image.name))
+        self.assertEqual(post.comments.get().author.username, 'reader')
+        self.assertFalse(User.objects.get(
+            username='author').has_usable_password())
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertTrue(Follow.objects.filter(
+            user__username='reader', author__username='author').exists())
+        self.assertEqual(user_stats(post.author_id).followers_count, 1)
+        self.assertTrue(FeedEntry.objects.filter(post=post).exists())
+        self.assertEqual(list(search.search_posts('котиков')), [post])
+
+    def test_import_remaps_existing_authors(self):
+        path = self.export()
+        Post.objects.all().delete()
+        author = User.objects.get(username='author')
+        call_command('import_posts', path, stdout=StringIO())
+        self.assertEqual(
+            Post.objects.get(text='Пост про котиков').author, author)
+        self.assertEqual(Group.objects.filter(slug='transfer').count(), 1)
+        self.assertEqual(Follow.objects.count(), 1)
+
+    def test_repeated_import_does_not_duplicate(self):
+        path = self.export()
+        Comment.objects.all().delete()
+        for _ in range(2):
+            call_command('import_posts', path, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 2)
+        post = Post.objects.get(text='Пост про котиков')
+        self.assertEqual(post.comments.get().text, 'Мяу')
+        self.assertEqual(post.comments_count, 1)
+
+    def test_import_changes_author_etag(self):
+        path = self.export()
+        Post.objects.filter(text='Второй пост').delete()
+        profile = reverse('posts:profile', kwargs={'username': 'reader'})
+        etag = self.client.get(profile)['ETag']
+        call_command('import_posts', path, stdout=StringIO())
+        response = self.client.get(profile, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Второй пост')
+
+
+class QueryPlansTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author')
+        reader = User.objects.create_user(username='reader')
+        group = Group.objects.create(
+            title='Группа', slug='plans', description='Описание')
+        post = Post.objects.create(author=author, group=group, text='Пост')
+        Comment.objects.create(author=reader, post=post, text='Ответ')
+        Follow.objects.create(user=reader, author=author)
+
+    def test_view_queries_use_indexes(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('posts:follow_index: OK', out.getvalue())
+
+    def test_sequential_scan_fails_the_check(self):
+        queries = {'text search': Post.objects.filter(text='Пост').order_by()}
+        with mock.patch('posts.management.commands.check_query_plans.'
+                        'view_queries', return_value=queries):
+            with self.assertRaises(CommandError):
+                call_command('check_query_plans', stdout=StringIO())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(dir=settings.BASE_DIR))
+class ImageRefsTest(TestCase):
+    def setUp(self):
+        self.addCleanup(
+            shutil.rmtree, settings.MEDIA_ROOT, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT + '_incoming',
+                        ignore_errors=True)
+        self.author = User.objects.create_user(username='author')
+        patcher = mock.patch('posts.images.transaction.on_commit',
+                             side_effect=lambda callback: callback())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create(self, content=b'meme', name='meme.gif'):
+        return Post.objects.create(author=self.author, text='Мем',
+                                   image=ContentFile(content, name=name))
+
+    def refs(self, name):
+        return ImageBlob.objects.filter(name=name).values_list(
+            'refs', flat=True).first()
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(settings.MEDIA_ROOT, name))
+
+    def test_same_upload_is_stored_once(self):
+        first = self.create(name='first.gif')
+        second = self.create(name='second.gif')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(self.refs(first.image.name), 2)
+        self.assertNotEqual(self.create(b'other').image.name,
+                            first.image.name)
+
+    def test_last_reference_deletes_file_and_variants(self):
+        first, second = self.create(), self.create()
+        name = first.image.name
+        variant = default_storage.save(f'variants/{name}/960x339.jpg',
+                                       ContentFile(b'thumb'))
+        first.delete()
+        self.assertEqual(self.refs(name), 1)
+        self.assertTrue(self.exists(name))
+        second.delete()
+        self.assertIsNone(self.refs(name))
+        self.assertFalse(self.exists(name))
+        self.assertFalse(self.exists(variant))
+        self.assertFalse(self.exists(os.path.dirname(name)))
+        self.assertFalse(self.exists('variants/posts'))
+
+    def test_image_without_variants_leaves_no_directories(self):
+        post = self.create()
+        name = post.image.name
+        post.delete()
+        self.assertFalse(self.exists(name))
+        self.assertFalse(self.exists(os.path.dirname(name)))
+
+    def test_upload_before_pending_delete_keeps_file(self):
+        """Та же картинка, загруженная до удаления файла, остаётся."""
+        post = self.create()
+        name = post.image.name
+        pending = []
+        with mock.patch('posts.images.transaction.on_commit',
+                        side_effect=pending.append):
+            post.delete()
+        self.assertEqual(self.refs(name), 0)
+        with mock.patch.object(images, 'lock') as lock:
+            self.create(name='again.gif')
+        lock.assert_called_once_with(name)
+        for callback in pending:
+            callback()
+        self.assertEqual(self.refs(name), 1)
+        self.assertTrue(self.exists(name))
+
+    def test_new_image_releases_old_one(self):
+        post = self.create()
+        old_name = post.image.name
+        post = Post.objects.get(pk=post.pk)
+        post.image = ContentFile(b'new meme', name='new.gif')
+        post.save()
+        self.assertEqual(self.refs(post.image.name), 1)
+        self.assertIsNone(self.refs(old_name))
+        self.assertFalse(self.exists(old_name))
+
+    def test_saving_without_image_change_keeps_refs(self):
+        post = self.create()
+        post = Post.objects.get(pk=post.pk)
+        post.text = 'Новый текст'
+        post.save()
+        self.assertEqual(self.refs(post.image.name), 1)
+
+    def test_untracked_legacy_file_is_kept(self):
+        post = Post.objects.create(author=self.author, text='Старый',
+                                   image='posts/legacy.gif')
+        ImageBlob.objects.all().delete()
+        default_storage.save('posts/legacy.gif', ContentFile(b'gif'))
+        post.delete()
+        self.assertTrue(self.exists('posts/legacy.gif'))
+
+    def test_name_outside_media_root_is_not_deleted(self):
+        outside = tempfile.NamedTemporaryFile(suffix='.jpg')
+        self.addCleanup(outside.close)
+        post = Post.objects.create(author=self.author, text='Чужой путь',
+                                   image=outside.name)
+        with self.assertLogs('posts.images', 'WARNING'):
+            post.delete()
+        self.assertTrue(os.path.exists(outside.name))
+
+    def test_recount_repairs_refs(self):
+        post = self.create()
+        ImageBlob.objects.all().delete()
+        ImageBlob.objects.create(name='posts/gone.gif', refs=3)
+        self.assertEqual(recount(repair=False)['ImageBlob.refs'], 2)
+        recount()
+        self.assertEqual(list(ImageBlob.objects.values_list('name', 'refs')),
+                         [(post.image.name, 1)])
+
+
+class FollowGraphTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        # В тестах LocMemCache; проверяем граф так, будто кэш общий.
+        patcher = mock.patch.object(follow_graph, 'is_cached',
+                                    return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.reader, self.ann, self.bob, self.eve = [
+            User.objects.create_user(username=name)
+            for name in ('reader', 'ann', 'bob', 'eve')]
+        for user, author in ((self.reader, self.ann),
+                             (self.reader, self.bob),
+                             (self.ann, self.reader),
+                             (self.ann, self.eve),
+                             (self.bob, self.eve),
+                             (self.bob, self.ann)):
+            Follow.objects.create(user=user, author=author)
+
+    def test_queries(self):
+        self.assertTrue(follow_graph.is_following(self.reader.pk, self.ann.pk))
+        self.assertFalse(
+            follow_graph.is_following(self.reader.pk, self.eve.pk))
+        self.assertFalse(follow_graph.is_following(None, self.ann.pk))
+        self.assertEqual(
+            follow_graph.is_following_many(
+                self.reader.pk, [self.ann.pk, self.bob.pk, self.eve.pk]),
+            {self.ann.pk: True, self.bob.pk: True, self.eve.pk: False})
+        self.assertEqual(follow_graph.mutual(self.reader.pk), {self.ann.pk})
+        self.assertEqual(follow_graph.follower_ids(self.eve.pk),
+                         {self.ann.pk, self.bob.pk})
+        # eve - у обоих авторов читателя, сам читатель не предлагается.
+        self.assertEqual(follow_graph.suggestions(self.reader.pk),
+                         [self.eve.pk])
+        self.assertEqual(follow_graph.suggestions(self.eve.pk), [])
+
+    def test_hot_path_has_no_queries(self):
+        follow_graph.suggestions(self.reader.pk)
+        follow_graph.mutual(self.reader.pk)
+        with self.assertNumQueries(0):
+            follow_graph.is_following(self.reader.pk, self.ann.pk)
+            follow_graph.is_following_many(self.reader.pk, [self.eve.pk])
+            follow_graph.mutual(self.reader.pk)
+            follow_graph.suggestions(self.reader.pk)
+
+    def test_follow_and_unfollow_update_sets(self):
+        self.assertFalse(
+            follow_graph.is_following(self.reader.pk, self.eve.pk))
+        follow = Follow.objects.create(user=self.reader, author=self.eve)
+        self.assertTrue(follow_graph.is_following(self.reader.pk, self.eve.pk))
+        self.assertIn(self.reader.pk, follow_graph.follower_ids(self.eve.pk))
+        follow.delete()
+        self.assertFalse(
+            follow_graph.is_following(self.reader.pk, self.eve.pk))
+        self.assertNotIn(self.reader.pk,
+                         follow_graph.follower_ids(self.eve.pk))
+
+    def test_per_process_cache_is_not_used(self):
+        with mock.patch.object(follow_graph, 'is_cached',
+                               return_value=False):
+            follow_graph.is_following(self.reader.pk, self.ann.pk)
+            with self.assertNumQueries(1):
+                follow_graph.is_following(self.reader.pk, self.ann.pk)
+
+    def test_read_before_commit_is_not_kept(self):
+        """Множество, прочитанное до коммита подписки, не используется."""
+        with mock.patch('posts.follow_graph.transaction.on_commit') as hook:
+            Follow.objects.create(user=self.reader, author=self.eve)
+        version = listing_cache.get_version(f'following:{self.reader.pk}')
+        cache.set(f'follow_graph:following:{self.reader.pk}:{version}',
+                  frozenset())
+        self.assertFalse(
+            follow_graph.is_following(self.reader.pk, self.eve.pk))
+        for call in hook.call_args_list:
+            call[0][0]()
+        self.assertTrue(follow_graph.is_following(self.reader.pk, self.eve.pk))
@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
 from http import HTTPStatus
@@ -22,6 +23,7 @@ class PostURLTests(TestCase):
             description='Описание группы')
 
     def setUp(self):
+        cache.clear()
         """Создание автороа поста"""
         self.author_client = Client()
         """Создание неавторизованного клиента"""
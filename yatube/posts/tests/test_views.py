@@ -1,10 +1,18 @@
-from django.test import TestCase, Client
+from http import HTTPStatus
+import threading
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django import forms
 
 
-from ..models import Post, Group, Follow
+from .. import comment_queue, follow_graph, images
+from ..models import Post, Group, Follow, FeedEntry, Comment
 
 User = get_user_model()
 
@@ -106,20 +114,31 @@ class PostViewsTests(TestCase):
                     self.assertIsInstance(form_field, expected)
 
     def test_cash(self):
+        """Лента отдаётся из кэша, пока посты не менялись."""
+        cache.clear()
         response = self.authorized_client.get(reverse('posts:index'))
         first_object = response.content
-        form_data = {
-            'title': 'Тестовый заголовок',
-            'text': 'Тестовый текст',
-        }
-        response = self.authorized_client.post(
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигналов')
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertEqual(first_object, response.content)
+
+    def test_cache_invalidated_on_new_post(self):
+        """Новый пост сразу сбрасывает кэш ленты."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'iva'}),
+        )
+        for url in urls:
+            self.authorized_client.get(url)
+        self.authorized_client.post(
             reverse('posts:post_create'),
-            data=form_data,
-            follow=True
+            data={'text': 'Свежий пост', 'group': self.group.pk},
         )
-        response = self.authorized_client.get(reverse('posts:index'))
-        second_object = response.content
-        self.assertEqual(first_object, second_object)
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertContains(response, 'Свежий пост')
 
 
 class PaginatorViewsTest(TestCase):
@@ -140,6 +159,7 @@ class PaginatorViewsTest(TestCase):
                 group=cls.group))
 
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(username='User')
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
@@ -166,11 +186,58 @@ class PaginatorViewsTest(TestCase):
             response = self.client.get(test_url + '?page=2')
             self.assertEqual(len(response.context['page_obj']), 3)
 
+    def test_cursor_pages(self):
+        """Переход по токенам after/before без номеров страниц."""
+        urls_names = {
+            reverse('posts:index'),
+            reverse('posts:group_list',
+                    kwargs={'slug': f'{self.group.slug}'}),
+            reverse('posts:profile',
+                    kwargs={'username': 'iva'})}
+        for test_url in urls_names:
+            with self.subTest(url=test_url):
+                first_page = self.client.get(test_url).context['page_obj']
+                self.assertEqual(first_page.previous_cursor, '')
+                response = self.client.get(
+                    test_url, {'after': first_page.next_cursor})
+                second_page = response.context['page_obj']
+                self.assertEqual(len(second_page), 3)
+                self.assertEqual(second_page[0].text, 'Тестовый пост 2')
+                self.assertEqual(second_page.next_cursor, '')
+                response = self.client.get(
+                    test_url, {'before': second_page.previous_cursor})
+                self.assertEqual(
+                    list(response.context['page_obj']), list(first_page))
+
+    def test_broken_cursor_returns_first_page(self):
+        response = self.client.get(
+            reverse('posts:index') + '?after=broken')
+        self.assertEqual(len(response.context['page_obj']), 10)
+
+    def test_far_legacy_page_redirects_to_cursor(self):
+        url = reverse('posts:profile', kwargs={'username': 'iva'})
+        with mock.patch('posts.paginator.LEGACY_PAGES', 1):
+            response = self.client.get(url, {'page': 2})
+            self.assertEqual(response.status_code, 302)
+            page = self.client.get(response.url).context['page_obj']
+            self.assertEqual([post.text for post in page],
+                             [f'Тестовый пост {i}' for i in (2, 1, 0)])
+            response = self.client.get(url, {'page': 3})
+            self.assertRedirects(response, url)
+
+    def test_index_has_no_exact_total(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('posts:index'))
+        self.assertFalse(any('COUNT(' in query['sql']
+                             for query in queries.captured_queries))
+
 
 class TestFollowing(TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
+        # Граф подписок в кэше мог остаться от других тестов с теми же id.
+        cache.clear()
         cls.follower = User.objects.create_user(username='follower')
         cls.author = User.objects.create_user(username='author')
         cls.not_follower = User.objects.create_user(username='not_follower')
@@ -180,6 +247,7 @@ class TestFollowing(TestCase):
         )
 
     def setUp(self) -> None:
+        cache.clear()
         self.follower_client = Client()
         self.follower_client.force_login(self.follower)
 
@@ -228,3 +296,536 @@ class TestFollowing(TestCase):
         not_follower_client.force_login(self.follower)
         response = not_follower_client.get(reverse('posts:follow_index'))
         self.assertFalse(response.context.get('post'))
+
+
+class TestFollowFeed(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.follower = User.objects.create_user(username='follower')
+        cls.author = User.objects.create_user(username='author')
+
+    def setUp(self):
+        cache.clear()
+        self.follower_client = Client()
+        self.follower_client.force_login(self.follower)
+
+    def feed_texts(self):
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        return [post.text for post in response.context['page_obj']]
+
+    def test_new_post_is_fanned_out(self):
+        """Новый пост попадает в ленты подписчиков при публикации."""
+        Follow.objects.create(user=self.follower, author=self.author)
+        post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertTrue(FeedEntry.objects.filter(
+            user=self.follower, post=post).exists())
+        self.assertEqual(self.feed_texts(), ['Новый пост'])
+
+    def test_fan_out_ignores_stale_follow_graph(self):
+        """Подписку из другого процесса кэш графа мог не увидеть."""
+        Follow.objects.create(user=self.follower, author=self.author)
+        with mock.patch.object(follow_graph, 'follower_ids',
+                               return_value=frozenset()):
+            post = Post.objects.create(author=self.author, text='Пост')
+        self.assertTrue(FeedEntry.objects.filter(
+            user=self.follower, post=post).exists())
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        Post.objects.create(author=self.author, text='Старый пост')
+        self.follower_client.get(reverse(
+            'posts:profile_follow', kwargs={'username': 'author'}))
+        self.assertEqual(self.feed_texts(), ['Старый пост'])
+        self.follower_client.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': 'author'}))
+        self.assertFalse(FeedEntry.objects.filter(
+            user=self.follower).exists())
+        self.assertEqual(self.feed_texts(), [])
+
+    @override_settings(FEED_LENGTH=3, FEED_TRIM_SLACK=1)
+    def test_feed_is_trimmed(self):
+        Follow.objects.create(user=self.follower, author=self.author)
+        for i in range(5):
+            Post.objects.create(author=self.author, text=f'Пост {i}')
+        entries = FeedEntry.objects.filter(user=self.follower)
+        self.assertLessEqual(entries.count(), 4)
+        self.assertEqual(self.feed_texts()[0], 'Пост 4')
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_celebrity_posts_are_read_on_request(self):
+        """Посты популярного автора не раскладываются, а читаются."""
+        Follow.objects.create(user=self.follower, author=self.author)
+        cache.clear()
+        Post.objects.create(author=self.author, text='Пост звезды')
+        self.assertFalse(FeedEntry.objects.filter(
+            user=self.follower).exists())
+        self.assertEqual(self.feed_texts(), ['Пост звезды'])
+
+    @override_settings(FEED_FANOUT_LIMIT=1)
+    def test_celebrity_posts_are_merged_in_order(self):
+        """Разложенные посты и посты звезды идут одной лентой без повторов."""
+        star = User.objects.create_user(username='star')
+        fan = User.objects.create_user(username='fan')
+        Follow.objects.create(user=self.follower, author=self.author)
+        Follow.objects.create(user=self.follower, author=star)
+        Follow.objects.create(user=fan, author=star)
+        for i in range(12):
+            Post.objects.create(author=(star if i % 3 else self.author),
+                                text=f'Пост {i}')
+        # Теперь и автор популярен, а его посты уже разложены.
+        Follow.objects.create(user=fan, author=self.author)
+        cache.clear()
+        first = self.follower_client.get(
+            reverse('posts:follow_index')).context['page_obj']
+        second = self.follower_client.get(
+            reverse('posts:follow_index'),
+            {'after': first.next_cursor}).context['page_obj']
+        self.assertEqual(
+            [post.text for post in first] + [post.text for post in second],
+            [f'Пост {i}' for i in reversed(range(12))])
+        self.assertEqual(second.next_cursor, '')
+
+    @override_settings(FEED_FANOUT_LIMIT=1)
+    def test_posts_are_read_when_author_crosses_limit(self):
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=self.follower, author=self.author)
+        self.assertEqual(self.feed_texts(), [])
+        Follow.objects.create(user=other, author=self.author)
+        Post.objects.create(author=self.author, text='Пост звезды')
+        self.assertFalse(FeedEntry.objects.exists())
+        self.assertEqual(self.feed_texts(), ['Пост звезды'])
+
+    @override_settings(FEED_FANOUT_LIMIT=1)
+    def test_posts_return_when_author_drops_below_limit(self):
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=self.follower, author=self.author)
+        Follow.objects.create(user=other, author=self.author)
+        Post.objects.create(author=self.author, text='Пост звезды')
+        self.assertFalse(FeedEntry.objects.exists())
+        with mock.patch('posts.feed.transaction.on_commit',
+                        side_effect=lambda callback: callback()):
+            Follow.objects.filter(user=other).delete()
+        self.assertEqual(self.feed_texts(), ['Пост звезды'])
+
+
+class ListingQueriesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа',
+            slug='queries',
+            description='Описание',
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        self.client.force_login(self.reader)
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        return len(context)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        """Число запросов на страницу не зависит от числа постов."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:follow_index'),
+        )
+        Post.objects.create(author=self.author, text='Пост', group=self.group)
+        single = {url: self.count_queries(url) for url in urls}
+        for i in range(9):
+            Post.objects.create(
+                author=self.author, text=f'Пост {i}', group=self.group)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), single[url])
+
+    def test_cached_fragment_skips_page_query(self):
+        """Если фрагмент ленты в кэше, посты страницы не читаются."""
+        Post.objects.create(author=self.author, text='Пост', group=self.group)
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+        )
+        cache.clear()
+        for url in urls:
+            with self.subTest(url=url):
+                self.client.get(url)
+                with CaptureQueriesContext(connection) as context:
+                    self.client.get(url)
+                self.assertFalse([
+                    query for query in context.captured_queries
+                    if 'LIMIT' in query['sql']
+                    and 'FROM "posts_post"' in query['sql']])
+
+
+class PostDetailCommentsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def add_comments(self, count):
+        for i in range(count):
+            commenter = User.objects.create_user(
+                username=f'commenter_{Comment.objects.count()}')
+            Comment.objects.create(
+                author=commenter, post=self.post, text=f'Комментарий {i}')
+
+    def detail_queries(self, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse('posts:post_detail',
+                        kwargs={'post_id': self.post.pk}), params)
+        return response, len(context)
+
+    def test_comments_are_paginated(self):
+        self.add_comments(25)
+        response, _ = self.detail_queries()
+        comments = response.context['comments']
+        self.assertEqual(len(comments), 20)
+        self.assertEqual(comments[0].text, 'Комментарий 0')
+        response, _ = self.detail_queries({'after': comments.next_cursor})
+        self.assertEqual(len(response.context['comments']), 5)
+        self.assertEqual(response.context['comments'].next_cursor, '')
+
+    def test_comment_authors_do_not_add_queries(self):
+        self.add_comments(1)
+        _, single = self.detail_queries()
+        self.add_comments(10)
+        _, many = self.detail_queries()
+        self.assertEqual(single, many)
+
+
+class SearchViewTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(
+            author=cls.author, text='Котики спят на диване')
+        Post.objects.create(author=cls.author, text='Собаки гуляют')
+
+    def search(self, query, **params):
+        response = self.client.get(
+            reverse('posts:search'), {'q': query, **params})
+        return response.context['page_obj']
+
+    def test_search_finds_matching_posts(self):
+        self.assertEqual([post.text for post in self.search('диване')],
+                         ['Котики спят на диване'])
+        self.assertEqual(len(self.search('кошки-мышки')), 0)
+
+    def test_empty_query(self):
+        response = self.client.get(reverse('posts:search'))
+        self.assertIsNone(response.context['page_obj'])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.post.text = 'Хомяки спят'
+        self.post.save()
+        self.assertEqual(len(self.search('диване')), 0)
+        self.assertEqual(len(self.search('Хомяки')), 1)
+        self.post.delete()
+        self.assertEqual(len(self.search('Хомяки')), 0)
+
+    def test_search_syntax_is_not_interpreted(self):
+        self.assertEqual(len(self.search('"спят OR (')), 0)
+
+    def test_results_are_paginated(self):
+        for i in range(12):
+            Post.objects.create(author=self.author, text=f'Рыбки {i}')
+        first_page = self.search('Рыбки')
+        self.assertEqual(len(first_page), 10)
+        second_page = self.search('Рыбки', after=first_page.next_cursor)
+        self.assertEqual(len(second_page), 2)
+        self.assertFalse(
+            {post.pk for post in first_page}
+            & {post.pk for post in second_page})
+
+
+class AnonymousPageCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Группа',
+            slug='page-cache',
+            description='Описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, text='Пост', group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+        self.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+
+    def test_pages_are_served_from_cache(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.client.get(url)
+                # поиск объекта для версий кэша; у поста и профиля
+                # ещё проверка свежести для ETag
+                queries = {'/': 0, self.urls[1]: 1}.get(url, 2)
+                with self.assertNumQueries(queries):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertIsNone(response.context)
+
+    def test_model_changes_invalidate_pages(self):
+        for url in self.urls:
+            self.client.get(url)
+        self.post.text = 'Изменённый пост'
+        self.post.save()
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), 'Изменённый пост')
+
+    def test_conditional_get(self):
+        url = self.urls[3]
+        response = self.client.get(url)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        Comment.objects.create(author=self.author, post=self.post, text='!')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_authenticated_users_bypass_cache(self):
+        self.client.get(self.urls[0])
+        self.client.force_login(self.author)
+        response = self.client.get(self.urls[0])
+        self.assertIsNotNone(response.context)
+
+    def test_cache_failure_falls_back_to_view(self):
+        with mock.patch('posts.page_cache.cache') as broken_cache:
+            broken_cache.get.side_effect = ConnectionError
+            response = self.client.get(self.urls[0])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+        self.post_url = reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.profile_url = reverse(
+            'posts:profile', kwargs={'username': 'author'})
+
+    def assertNotModified(self, url):
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(3):
+            # сессия, пользователь и одна проверка свежести
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertIsNone(response.context)
+        return etag
+
+    def test_unchanged_pages_return_304(self):
+        for url in (self.post_url, self.profile_url):
+            with self.subTest(url=url):
+                self.assertNotModified(url)
+
+    def test_if_modified_since(self):
+        last_modified = self.client.get(self.post_url)['Last-Modified']
+        response = self.client.get(
+            self.post_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_changes_refresh_etag(self):
+        both = (self.post_url, self.profile_url)
+        changes = (
+            (lambda: Comment.objects.create(
+                author=self.reader, post=self.post, text='!'),
+             (self.post_url,)),
+            (lambda: Post.objects.get(pk=self.post.pk).save(), both),
+            (lambda: Follow.objects.create(
+                user=self.reader, author=self.author), both),
+        )
+        for change, urls in changes:
+            etags = [self.assertNotModified(url) for url in urls]
+            change()
+            for url, etag in zip(urls, etags):
+                with self.subTest(url=url):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                    self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_etag_depends_on_user(self):
+        etag = self.client.get(self.post_url)['ETag']
+        self.client.logout()
+        response = self.client.get(self.post_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('Cookie', response['Vary'])
+
+
+@override_settings(COMMENT_QUEUE_THRESHOLD=0, COMMENT_QUEUE_WORKER=False)
+class CommentQueueTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+        self.url = reverse('posts:add_comment', args=[self.post.pk])
+        self.detail_url = reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.pk})
+
+    def test_queued_comment_is_visible_to_its_author(self):
+        self.client.post(self.url, {'text': 'Из очереди'})
+        self.assertFalse(Comment.objects.exists())
+        self.assertContains(self.client.get(self.detail_url), 'Из очереди')
+        other = Client()
+        other.force_login(self.author)
+        self.assertNotContains(other.get(self.detail_url), 'Из очереди')
+
+        comment_queue.flush()
+        comment = Comment.objects.get()
+        self.assertEqual(comment.author, self.reader)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertEqual(comment_queue.pending(self.post.pk, self.reader.pk),
+                         [])
+        self.assertContains(other.get(self.detail_url), 'Из очереди')
+
+    def test_queued_comment_changes_etag(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        self.client.post(self.url, {'text': 'Из очереди'})
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        comment_queue.flush()
+
+    def test_batch_is_written_at_once(self):
+        for number in range(3):
+            self.client.post(self.url, {'text': f'Ответ {number}'})
+        with self.assertNumQueries(5):
+            # посты пачки, вставка и счётчик в одной транзакции
+            # (в тесте она - savepoint и его release)
+            comment_queue.flush()
+        self.assertEqual(Comment.objects.count(), 3)
+
+    def test_comments_to_deleted_post_are_logged(self):
+        post = Post.objects.create(author=self.author, text='Удалят')
+        self.client.post(reverse('posts:add_comment', args=[post.pk]),
+                         {'text': 'Опоздал'})
+        post.delete()
+        with self.assertLogs('posts.comment_queue', 'WARNING'):
+            comment_queue.flush()
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(comment_queue.pending(post.pk, self.reader.pk), [])
+
+    def test_parallel_submits_keep_pending_entries(self):
+        def submit(number):
+            comment_queue.submit(Comment(
+                post=self.post, author=self.reader, text=str(number)))
+
+        threads = [threading.Thread(target=submit, args=(number,))
+                   for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            len(comment_queue.pending(self.post.pk, self.reader.pk)), 8)
+        comment_queue.flush()
+
+    @override_settings(COMMENT_BURST=2)
+    def test_rate_limit(self):
+        for number in range(2):
+            response = self.client.post(self.url, {'text': str(number)})
+            self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        response = self.client.post(self.url, {'text': 'лишний'})
+        self.assertEqual(
+            response.status_code, HTTPStatus.TOO_MANY_REQUESTS)
+        comment_queue.flush()
+        self.assertEqual(Comment.objects.count(), 2)
+
+
+class PostImageTemplateTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='photo_author')
+
+    def setUp(self):
+        cache.clear()
+
+    def create_posts(self, with_images):
+        for index in range(10):
+            name = f'posts/photo_{index}.jpg' if with_images else ''
+            variants = [
+                {'width': width, 'height': height, 'type': mime_type,
+                 'name': f'variants/{name}/{width}x{height}.{extension}'}
+                for width, height in ((480, 170), (960, 339))
+                for mime_type, extension in (('image/jpeg', 'jpg'),
+                                             ('image/webp', 'webp'))
+            ]
+            Post.objects.create(
+                author=self.author, text=f'Пост {index}', image=name,
+                image_variants=images.dump_registry(name, variants)
+                if with_images else '')
+
+    def render_index(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('posts:index'))
+        return response, len(context)
+
+    def test_srcset_is_rendered(self):
+        self.create_posts(with_images=True)
+        response, _ = self.render_index()
+        self.assertContains(
+            response,
+            '<source type="image/webp" '
+            'srcset="/media/variants/posts/photo_9.jpg/480x170.webp 480w, '
+            '/media/variants/posts/photo_9.jpg/960x339.webp 960w"',
+            html=False)
+        self.assertContains(
+            response,
+            'src="/media/variants/posts/photo_9.jpg/960x339.jpg"')
+
+    def test_no_storage_lookups_or_extra_queries(self):
+        self.create_posts(with_images=False)
+        _, text_queries = self.render_index()
+        Post.objects.all().delete()
+        cache.clear()
+        self.create_posts(with_images=True)
+        storage = Post.image.field.storage
+        with mock.patch.object(storage, 'exists',
+                               side_effect=AssertionError), \
+                mock.patch.object(storage, 'open',
+                                  side_effect=AssertionError):
+            response, image_queries = self.render_index()
+        self.assertEqual(response.content.count(b'<picture>'), 10)
+        self.assertEqual(image_queries, text_queries)
+
+    def test_image_without_registry_falls_back_to_original(self):
+        Post.objects.create(author=self.author, text='Старый пост',
+                            image='posts/legacy.jpg')
+        response, _ = self.render_index()
+        self.assertContains(response, 'src="/media/posts/legacy.jpg"')
+        self.assertNotContains(response, 'srcset=')
@@ -0,0 +1,107 @@
+"""Заранее нарезанные миниатюры картинок постов.
+
+Миниатюры режутся в фоне после сохранения поста, а их список
+записывается в посты с этой картинкой (Post.image_variants). Тег
+{% post_image %} строит srcset по этому списку, ничего не спрашивая
+у хранилища.
+"""
+import logging
+import os
+from concurrent.futures import (
+    Future, ProcessPoolExecutor, ThreadPoolExecutor)
+
+from django.conf import settings
+from django.db import connections
+
+from . import counters, images, listing_cache
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+
+_executor = None
+
+
+def save_registry(image_name, variants):
+    """Записывает миниатюры в посты с картинкой и сбрасывает их страницы."""
+    posts = Post.objects.filter(image=image_name)
+    rows = list(posts.values_list('pk', 'author_id', 'group_id'))
+    posts.update(image_variants=images.dump_registry(image_name, variants))
+    scopes = set()
+    for post_id, author_id, group_id in rows:
+        scopes |= listing_cache.post_scopes(post_id, author_id, group_id)
+    listing_cache.invalidate(scopes)
+    for author_id in {author_id for _, author_id, _ in rows}:
+        counters.touch_user(author_id)
+
+
+def generate(image_name):
+    """Создаёт миниатюры картинки; возвращает False при ошибке."""
+    try:
+        save_registry(image_name, images.write_variants(image_name))
+        return True
+    except Exception:
+        logger.exception('Не удалось создать миниатюру %s', image_name)
+        return False
+
+
+def _generate_in_thread(image_name):
+    try:
+        return generate(image_name)
+    finally:
+        connections.close_all()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            thread_name_prefix='thumbnails',
+        )
+    return _executor
+
+
+def schedule(image_name):
+    """Ставит генерацию миниатюры в фоновый пул потоков.
+
+    При THUMBNAIL_WORKERS = 0 миниатюры режутся сразу: в тестах фоновый
+    поток пережил бы временный MEDIA_ROOT.
+    """
+    if not image_name:
+        return None
+    if not settings.THUMBNAIL_WORKERS:
+        future = Future()
+        future.set_result(generate(image_name))
+        return future
+    return get_executor().submit(_generate_in_thread, image_name)
+
+
+def generate_all(posts, workers=None):
+    """Нарезает миниатюры постов в нескольких процессах.
+
+    Возвращает пару (создано, ошибок). Посты читаются пачками по pk,
+    а перед отправкой пачки соединение с базой закрывается, чтобы
+    процессы пула не унаследовали сокет родителя.
+    """
+    done = failed = 0
+    last_pk = 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        while True:
+            batch = list(
+                posts.exclude(image='').filter(pk__gt=last_pk)
+                .order_by('pk').values_list('pk', 'image')
+                [:BACKFILL_BATCH_SIZE]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            connections.close_all()
+            names = [name for _, name in batch]
+            for result in pool.map(generate, names, chunksize=16):
+                if result:
+                    done += 1
+                else:
+                    failed += 1
+    return done, failed
@@ -0,0 +1,334 @@
+"""Перенос постов между окружениями потоком NDJSON.
+
+Каждая строка файла - одна запись: пост вместе со своими
+комментариями или подписка. Авторы и группы указываются по
+естественным ключам (username и slug) и при импорте сопоставляются
+с записями базы пачками, поэтому память не растёт с размером выгрузки.
+Файлы с расширением .gz читаются и пишутся через gzip.
+"""
+import gzip
+import io
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from . import counters, feed, listing_cache, search
+from .models import Comment, FeedEntry, Follow, Group, Post, User
+
+BATCH_SIZE = 1000
+IMAGE_WORKERS = 8
+
+
+@contextmanager
+def open_stream(path, mode):
+    """Файл, stdin/stdout для '-' или gzip для *.gz, в текстовом режиме."""
+    if path == '-':
+        yield sys.stdin if mode == 'r' else sys.stdout
+    elif path.endswith('.gz'):
+        with gzip.open(path, mode + 't', encoding='utf-8') as stream:
+            yield stream
+    else:
+        with io.open(path, mode, encoding='utf-8') as stream:
+            yield stream
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _parallel(function, items, workers):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(function, items))
+
+
+def _export_images(names, target_dir, workers):
+    """Копирует картинки пачки из хранилища медиа в каталог."""
+    def copy(name):
+        path = os.path.join(target_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with Post.image.field.storage.open(name) as src, \
+                open(path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        return name, name
+
+    return _parallel(copy, names, workers)
+
+
+def _import_images(names, source_dir, workers):
+    """Копирует картинки в хранилище; возвращает старое -> новое имя.
+
+    Имя в хранилище - хэш содержимого, одинаковые файлы не дублируются.
+    """
+    def copy(name):
+        with open(os.path.join(source_dir, name), 'rb') as file:
+            return name, Post.image.field.storage.save(name, file)
+
+    return _parallel(copy, names, workers)
+
+
+def export_posts(stream, batch_size=BATCH_SIZE, images_dir=None,
+                 workers=IMAGE_WORKERS):
+    """Пишет посты с комментариями и подписки; возвращает число записей."""
+    written = 0
+    last_pk = 0
+    while True:
+        posts = list(
+            Post.objects.filter(pk__gt=last_pk).order_by('pk').values(
+                'pk', 'text', 'pub_date', 'image',
+                'author__username', 'group__slug', 'group__title',
+                'group__description',
+            )[:batch_size]
+        )
+        if not posts:
+            break
+        last_pk = posts[-1]['pk']
+        comments = {}
+        for comment in Comment.objects.filter(
+                post_id__in=[post['pk'] for post in posts]).order_by(
+                'post_id', 'created', 'pk').values(
+                'post_id', 'author__username', 'text', 'created'):
+            comments.setdefault(comment['post_id'], []).append({
+                'author': comment['author__username'],
+                'text': comment['text'],
+                'created': comment['created'].isoformat(),
+            })
+        if images_dir:
+            _export_images(
+                [post['image'] for post in posts if post['image']],
+                images_dir, workers)
+        for post in posts:
+            group = None
+            if post['group__slug']:
+                group = {
+                    'slug': post['group__slug'],
+                    'title': post['group__title'],
+                    'description': post['group__description'],
+                }
+            stream.write(json.dumps({
+                'type': 'post',
+                'author': post['author__username'],
+                'group': group,
+                'text': post['text'],
+                'pub_date': post['pub_date'].isoformat(),
+                'image': post['image'],
+                'comments': comments.get(post['pk'], []),
+            }, ensure_ascii=False) + '\n')
+        written += len(posts)
+    follows = Follow.objects.order_by('pk').values_list(
+        'user__username', 'author__username').iterator(chunk_size=batch_size)
+    for user, author in follows:
+        stream.write(json.dumps(
+            {'type': 'follow', 'user': user, 'author': author},
+            ensure_ascii=False) + '\n')
+        written += 1
+    return written
+
+
+@contextmanager
+def _keep_dates():
+    """Отключает auto_now_add, чтобы сохранить даты из выгрузки."""
+    fields = [Post._meta.get_field('pub_date'),
+              Comment._meta.get_field('created')]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _user_ids(usernames):
+    """username -> pk; недостающие пользователи создаются без пароля."""
+    found = dict(User.objects.filter(username__in=usernames).values_list(
+        'username', 'pk'))
+    missing = set(usernames) - set(found)
+    if missing:
+        User.objects.bulk_create(
+            [User(username=name, password=make_password(None))
+             for name in missing],
+            ignore_conflicts=True,
+        )
+        found.update(User.objects.filter(username__in=missing).values_list(
+            'username', 'pk'))
+    return found
+
+
+def _group_ids(groups):
+    """slug -> pk; недостающие группы создаются из выгрузки."""
+    found = dict(Group.objects.filter(slug__in=groups).values_list(
+        'slug', 'pk'))
+    missing = [group for slug, group in groups.items() if slug not in found]
+    if missing:
+        Group.objects.bulk_create(
+            [Group(slug=group['slug'], title=group['title'],
+                   description=group['description']) for group in missing],
+            ignore_conflicts=True,
+        )
+        found.update(Group.objects.filter(
+            slug__in=[group['slug'] for group in missing]).values_list(
+            'slug', 'pk'))
+    return found
+
+
+def _fan_out(posts):
+    """Раскладывает пачку постов по лентам подписчиков их авторов."""
+    celebrities = feed.celebrity_ids()
+    author_ids = {post.author_id for post in posts} - celebrities
+    followers = {}
+    for user_id, author_id in Follow.objects.filter(
+            author_id__in=author_ids).values_list('user_id', 'author_id'):
+        followers.setdefault(author_id, []).append(user_id)
+    FeedEntry.objects.bulk_create(
+        [
+            FeedEntry(user_id=user_id, post_id=post.pk,
+                      author_id=post.author_id, pub_date=post.pub_date)
+            for post in posts
+            for user_id in followers.get(post.author_id, [])
+        ],
+        ignore_conflicts=True,
+    )
+    feed.trim_feeds({user_id for ids in followers.values() for user_id in ids})
+
+
+def _post_key(record, user_ids):
+    """Естественный ключ поста: автор, дата публикации и текст."""
+    return (user_ids[record['author']], parse_datetime(record['pub_date']),
+            record['text'])
+
+
+def _post_keys(records, user_ids):
+    """Естественный ключ -> pk для постов пачки, которые уже есть в базе."""
+    keys = {_post_key(record, user_ids) for record in records}
+    found = Post.objects.filter(
+        author_id__in={author_id for author_id, _, _ in keys},
+        pub_date__in={pub_date for _, pub_date, _ in keys},
+    ).values_list('author_id', 'pub_date', 'text', 'pk')
+    return {(author_id, pub_date, text): pk
+            for author_id, pub_date, text, pk in found
+            if (author_id, pub_date, text) in keys}
+
+
+def _comment_keys(post_ids):
+    return set(Comment.objects.filter(post_id__in=post_ids).values_list(
+        'post_id', 'author_id', 'created', 'text'))
+
+
+def _import_posts(records, images_dir, workers):
+    user_ids = _user_ids(
+        {record['author'] for record in records}
+        | {comment['author'] for record in records
+           for comment in record['comments']})
+    group_ids = _group_ids(
+        {record['group']['slug']: record['group']
+         for record in records if record['group']})
+    images = {}
+    if images_dir:
+        images = _import_images(
+            [record['image'] for record in records if record['image']],
+            images_dir, workers)
+    existing = _post_keys(records, user_ids)
+    new_records = {}
+    for record in records:
+        key = _post_key(record, user_ids)
+        if key not in existing:
+            new_records.setdefault(key, record)
+    posts = [
+        Post(
+            author_id=key[0],
+            group_id=record['group'] and group_ids[record['group']['slug']],
+            text=record['text'],
+            pub_date=key[1],
+            image=images.get(record['image'], record['image']),
+        )
+        for key, record in new_records.items()
+    ]
+    with transaction.atomic(), _keep_dates():
+        Post.objects.bulk_create(posts)
+        # Ключи ищутся по тем же полям: SQLite не возвращает их из
+        # bulk_create, а порядок rowid не гарантирован.
+        existing.update(_post_keys(new_records.values(), user_ids))
+        for post in posts:
+            post.pk = existing[(post.author_id, post.pub_date, post.text)]
+        comments = {}
+        for record in records:
+            post_id = existing[_post_key(record, user_ids)]
+            for comment in record['comments']:
+                key = (post_id, user_ids[comment['author']],
+                       parse_datetime(comment['created']), comment['text'])
+                comments.setdefault(key, comment)
+        for key in _comment_keys(existing.values()):
+            comments.pop(key, None)
+        Comment.objects.bulk_create([
+            Comment(post_id=post_id, author_id=author_id,
+                    created=created, text=text)
+            for post_id, author_id, created, text in comments
+        ])
+        _fan_out(posts)
+        # Сигналов нет: ETag страниц авторов сдвигаем сами.
+        counters.touch_users({author_id for author_id, _, _ in existing})
+    scopes = {listing_cache.INDEX}
+    for post in posts:
+        scopes |= listing_cache.post_scopes(
+            post.pk, post.author_id, post.group_id)
+    listing_cache.invalidate(scopes)
+
+
+def _import_follows(records):
+    user_ids = _user_ids(
+        {record['user'] for record in records}
+        | {record['author'] for record in records})
+    pairs = {(user_ids[record['user']], user_ids[record['author']])
+             for record in records if record['user'] != record['author']}
+    with transaction.atomic():
+        Follow.objects.bulk_create(
+            [Follow(user_id=user, author_id=author) for user, author in pairs],
+            ignore_conflicts=True,
+        )
+        for follow in Follow.objects.filter(
+                user_id__in={user for user, _ in pairs},
+                author_id__in={author for _, author in pairs},
+        ).select_related('user', 'author'):
+            if (follow.user_id, follow.author_id) in pairs:
+                feed.backfill_feed(follow.user, follow.author)
+    listing_cache.invalidate(
+        {listing_cache.profile_scope(user_id)
+         for pair in pairs for user_id in pair})
+
+
+def import_posts(stream, batch_size=BATCH_SIZE, images_dir=None,
+                 workers=IMAGE_WORKERS):
+    """Загружает выгрузку пачками; возвращает число записей.
+
+    Посты и комментарии, которые уже есть в базе (совпадают автор,
+    дата и текст), не дублируются, так что импорт можно повторить.
+    bulk_create не вызывает сигналы, поэтому ленты раскладываются
+    и отметки изменения авторов сдвигаются здесь же, а счётчики
+    и поисковый индекс пересчитываются в конце.
+    """
+    imported = 0
+    records = (json.loads(line) for line in stream if line.strip())
+    for batch in _batches(records, batch_size):
+        posts = [record for record in batch if record['type'] == 'post']
+        follows = [record for record in batch if record['type'] == 'follow']
+        if posts:
+            _import_posts(posts, images_dir, workers)
+        if follows:
+            _import_follows(follows)
+        imported += len(batch)
+    counters.recount()
+    search.rebuild_index()
+    return imported
@@ -1,85 +1,163 @@
-from django.core.paginator import Paginator
+from http import HTTPStatus
+
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404
 from .models import Post, Group, Follow, User
 from django.shortcuts import redirect
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from core.concurrent import gather
 from .forms import PostForm, CommentForm
+from . import comment_queue, follow_graph, listing_cache
+from .conditional import conditional_page, post_freshness, profile_freshness
+from .counters import user_stats
+from .feed import FeedPaginator
+from .page_cache import cache_anonymous_page
+from .paginator import paginate
+from .search import search_posts
 
 
 CNT_SORT = 10
+COMMENTS_PER_PAGE = 20
+
+
+def _index_scopes():
+    return [listing_cache.INDEX]
+
+
+def _group_scopes(slug):
+    group_id = Group.objects.values_list('pk', flat=True).get(slug=slug)
+    return [listing_cache.group_scope(group_id)]
+
+
+def _profile_scopes(username):
+    author_id = User.objects.values_list('pk', flat=True).get(
+        username=username)
+    return [listing_cache.profile_scope(author_id)]
+
+
+def _post_scopes(post_id):
+    author_id, group_id = Post.objects.values_list(
+        'author_id', 'group_id').get(pk=post_id)
+    return [
+        listing_cache.post_scope(post_id),
+        listing_cache.profile_scope(author_id),
+        listing_cache.group_scope(group_id),
+    ]
 
 
+@cache_anonymous_page(_index_scopes)
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, CNT_SORT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_list = Post.objects.for_listing()
+    page_obj = paginate(request, post_list, CNT_SORT, approximate_count=True)
     context = {
         'page_obj': page_obj,
+        'cache_timeout': settings.LISTING_CACHE_TIMEOUT,
+        'listing_version': listing_cache.get_version(listing_cache.INDEX),
     }
     return render(request, 'posts/index.html', context)
 
 
+@cache_anonymous_page(_group_scopes)
 def group_posts(request, slug):
 
     group = get_object_or_404(Group, slug=slug)
-    pg_list = group.posts.all()
-    paginator = Paginator(pg_list, CNT_SORT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    pg_list = group.posts.for_listing()
+    page_obj = paginate(request, pg_list, CNT_SORT)
     context = {
         'group': group,
         'page_obj': page_obj,
+        'cache_timeout': settings.LISTING_CACHE_TIMEOUT,
+        'listing_version': listing_cache.get_version(
+            listing_cache.group_scope(group.pk)),
     }
     return render(request, 'posts/group_list.html', context)
 
 
+@conditional_page(profile_freshness)
+@cache_anonymous_page(_profile_scopes)
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    user_post = author.posts.all()
-    paginator = Paginator(user_post, CNT_SORT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    count_post = author.posts.count()
+    user_post = author.posts.for_listing()
+    page_obj, stats, following = gather(
+        lambda: paginate(request, user_post, CNT_SORT),
+        lambda: user_stats(author.pk),
+        lambda: follow_graph.is_following(request.user.pk, author.pk),
+    )
+    count_post = stats.posts_count
+    listing_version = listing_cache.get_version(
+        listing_cache.profile_scope(author.pk))
     context = {
         'author': author,
         'user_post': user_post,
         'page_obj': page_obj,
-        'count_post': count_post
+        'count_post': count_post,
+        'stats': stats,
+        'cache_timeout': settings.LISTING_CACHE_TIMEOUT,
+        'listing_version': listing_version,
     }
-    following = request.user.is_authenticated and Follow.objects.filter(
-        user=request.user,
-        author=author).exists()
     user = request.user
     if user.is_authenticated:
         foll_context = {
             'author': author,
             'user': user,
             'page_obj': page_obj,
-            'following': following
+            'following': following,
+            'count_post': count_post,
+            'stats': stats,
+            'cache_timeout': settings.LISTING_CACHE_TIMEOUT,
+            'listing_version': listing_version,
         }
         return render(request, 'posts/profile.html', foll_context)
     return render(request, 'posts/profile.html', context)
 
 
+@conditional_page(post_freshness, extra=comment_queue.pending_stamp)
+@cache_anonymous_page(_post_scopes)
 def post_detail(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     author = post.author
-    count_post = author.posts.count()
+    stats, comments = gather(
+        lambda: user_stats(author.pk),
+        lambda: paginate(
+            request,
+            post.comments.select_related('author'),
+            COMMENTS_PER_PAGE,
+            ordering=('created', 'id'),
+        ),
+    )
+    count_post = stats.posts_count
     group = post.group
     form = CommentForm()
-    comments = post.comments.all()
+    pending_comments = []
+    if request.user.is_authenticated and not comments.next_cursor:
+        pending_comments = comment_queue.pending(post.pk, request.user.pk)
     context = {
         'post': post,
         'count_post': count_post,
         'group': group,
         'comments': comments,
+        'pending_comments': pending_comments,
         'form': form
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    if query:
+        page_obj = paginate(
+            request, search_posts(query), CNT_SORT, ordering=('-rank', '-id'))
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
+@transaction.atomic
 def post_create(request):
 
     post_create = 'posts/create_post.html'
@@ -98,6 +176,7 @@ def post_create(request):
 
 
 @login_required
+@transaction.atomic
 def post_edit(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     if request.user != post.author:
@@ -117,24 +196,25 @@ def post_edit(request, post_id):
 
 
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
+        if not comment_queue.allow(request.user.pk):
+            return render(request, 'core/429.html',
+                          status=HTTPStatus.TOO_MANY_REQUESTS)
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        comment_queue.submit(comment)
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(
-        author__following__user=request.user).select_related('author', 'group')
-    paginator = Paginator(posts, CNT_SORT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(request, Post.objects.for_listing(), CNT_SORT,
+                        paginator_class=FeedPaginator, user=request.user)
     context = {
         'page_obj': page_obj
     }
@@ -142,6 +222,7 @@ def follow_index(request):
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user == author:
@@ -151,6 +232,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     author = User.objects.get(username=username)
     follow = Follow.objects.filter(user=request.user, author=author)
@@ -0,0 +1,20 @@
+"""
+ASGI config for yatube project.
+
+Django 2.2 has no ASGI handler, so the WSGI application is wrapped
+by core.asgi.WsgiToAsgi: request and response bodies are transferred
+asynchronously, views run in a pool of ASGI_THREADS threads.
+
+    uvicorn yatube.asgi:application
+"""
+
+import os
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+from core.asgi import WsgiToAsgi
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+
+application = WsgiToAsgi(get_wsgi_application(), settings.ASGI_THREADS)
@@ -52,13 +52,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.db_router.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'posts.paginator.LegacyPageMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -66,7 +69,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.template_backends.MeasuredDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -89,14 +92,41 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.postgresql'),
+        'ENGINE': os.getenv('DB_ENGINE', 'core.db.postgresql'),
         'NAME': os.getenv('DB_NAME'),
         'USER': os.getenv('POSTGRES_USER'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
-        'PORT': os.getenv('DB_PORT')
+        'PORT': os.getenv('DB_PORT'),
+        # Соединение живёт между запросами и проверяется перед
+        # повторным использованием; MAX_CONNECTIONS и POOL_TIMEOUT
+        # ограничивают соединения процесса (см. core/db/pool.py);
+        # MAX_CONNECTIONS >= ASGI_THREADS + VIEW_QUERY_THREADS.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'HEALTH_CHECKS': True,
+        'MAX_CONNECTIONS': int(os.getenv('DB_MAX_CONNECTIONS', 0)) or None,
+        'POOL_TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', 10)),
     }
-} 
+}
+
+# Реплики для чтения: DB_REPLICAS - хосты через запятую (для SQLite -
+# пути к файлам), остальные параметры берутся у основной базы.
+DATABASE_REPLICAS = []
+for number, replica in enumerate(
+        filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1):
+    alias = f'replica_{number}'
+    DATABASES[alias] = dict(DATABASES['default'])
+    if DATABASES['default']['ENGINE'].endswith('sqlite3'):
+        DATABASES[alias]['NAME'] = replica.strip()
+    else:
+        DATABASES[alias]['HOST'] = replica.strip()
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
+
+# Сколько секунд после записи сессия читает только из основной базы.
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
 
 
 # Password validation
@@ -157,9 +187,83 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
-
+# Куда принимаются загрузки до переноса в MEDIA_ROOT (core.storage):
+# по умолчанию - соседний каталог media_incoming на той же файловой
+# системе.
+MEDIA_INCOMING_ROOT = os.getenv('MEDIA_INCOMING_ROOT') or None
+# Отдача MEDIA самим Django (core.media): сколько браузеры кэшируют
+# файлы, сколько секунд и записей помнить stat. MEDIA_ACCEL_REDIRECT -
+# internal-location nginx (например, /protected-media/), если файлы
+# отдаёт он.
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 30
+MEDIA_STAT_CACHE_TTL = 60
+MEDIA_STAT_CACHE_SIZE = 4096
+MEDIA_ACCEL_REDIRECT = os.getenv('MEDIA_ACCEL_REDIRECT', '')
+
+# Кэш выбирается окружением: по умолчанию свой в каждом процессе,
+# core.cache.FileBasedCache с CACHE_LOCATION=/var/tmp/yatube_cache
+# общий для всех воркеров хоста, core.cache.MemcachedCache - внешний.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': os.getenv('CACHE_BACKEND', 'core.cache.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+        'KEY_PREFIX': os.getenv('CACHE_KEY_PREFIX', 'yatube'),
+        'VERSION': int(os.getenv('CACHE_VERSION', 1)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+        },
     }
 }
+
+# Лента подписок: сколько постов хранить на читателя и сверх какого
+# числа подписчиков посты автора подмешиваются при чтении.
+FEED_LENGTH = 500
+FEED_TRIM_SLACK = 50
+FEED_FANOUT_LIMIT = 1000
+# Множества подписок и подписчиков в кэше (posts.follow_graph);
+# только с общим для процессов кэшем, с LocMemCache - из базы.
+FOLLOW_GRAPH_TIMEOUT = 60 * 60 * 24
+
+# Фрагменты лент сбрасываются сигналами через версию ключа,
+# поэтому срок жизни в кэше может быть большим.
+LISTING_CACHE_TIMEOUT = 60 * 60 * 6
+
+# Потоки, которые нарезают миниатюры загруженных картинок в фоне
+# (0 - нарезать сразу, в том же потоке: для тестов).
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 2))
+
+# Загруженные картинки уменьшаются до IMAGE_MAX_SIZE и теряют EXIF
+# (posts.images); миниатюры режутся ещё и в WebP/AVIF.
+IMAGE_MAX_SIZE = (1920, 1920)
+IMAGE_JPEG_QUALITY = 85
+IMAGE_VARIANT_QUALITY = 80
+# Ширины миниатюр для srcset (пропорции 960x339, как у карточек).
+IMAGE_VARIANT_WIDTHS = (480, 960, 1440)
+
+# Замеры запросов: доля замеряемых запросов, размер окна на view,
+# как часто и насколько сохранять окно процесса в кэш.
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', 1.0))
+METRICS_WINDOW = 1000
+METRICS_FLUSH_INTERVAL = 30
+METRICS_SNAPSHOT_TIMEOUT = 60 * 10
+
+# Целые страницы для анонимов; сбрасываются сигналами моделей.
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Комментарии: не больше COMMENT_RATE в минуту (COMMENT_BURST подряд)
+# от пользователя; при шторме на посте (больше COMMENT_QUEUE_THRESHOLD
+# за COMMENT_HOT_WINDOW секунд) - запись пачками из очереди.
+COMMENT_RATE = int(os.getenv('COMMENT_RATE', 10))
+COMMENT_BURST = int(os.getenv('COMMENT_BURST', 5))
+COMMENT_QUEUE_THRESHOLD = int(os.getenv('COMMENT_QUEUE_THRESHOLD', 20))
+COMMENT_HOT_WINDOW = 10
+COMMENT_BATCH_SIZE = 200
+COMMENT_FLUSH_INTERVAL = 1
+COMMENT_PENDING_TIMEOUT = 60 * 5
+COMMENT_QUEUE_WORKER = True
+
+# ASGI (yatube/asgi.py): потоков для view в одном процессе.
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', 8))
+# Потоков для параллельных независимых запросов внутри view
+# (только PostgreSQL; 0 - выключить).
+VIEW_QUERY_THREADS = int(os.getenv('VIEW_QUERY_THREADS', 4))